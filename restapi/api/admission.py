@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import re
+import time
+
+from jose import jwt, JWTError
+
+from restapi.api.database import pool_wait_seconds
+from restapi.api.routers.auth import SECRET_KEY, ALGORITHM
+
+try:
+    rate_limit_per_second = float(os.environ["rate_limit_per_second"])
+except KeyError:
+    rate_limit_per_second = 20.0
+
+try:
+    rate_limit_burst = float(os.environ["rate_limit_burst"])
+except KeyError:
+    rate_limit_burst = 100.0
+
+# per client, so one user's slow writes cannot hold the slots every other user's writes need
+try:
+    write_concurrency = int(os.environ["write_concurrency"])
+except KeyError:
+    write_concurrency = 4
+
+# per process across all clients, so the writes together cannot exhaust the database pool
+try:
+    global_write_concurrency = int(os.environ["global_write_concurrency"])
+except KeyError:
+    global_write_concurrency = 32
+
+try:
+    pool_wait_threshold = float(os.environ["pool_wait_threshold"])
+except KeyError:
+    pool_wait_threshold = 0.5
+
+# writes that recompute an account tail or move rows between tables, grouped by the work they contend on
+expensive_routes = [
+    ("transaction_write", "POST", re.compile(r"^/transactions/?$")),
+    ("transaction_write", "PATCH", re.compile(r"^/transactions/[^/]+/?$")),
+    ("transaction_write", "POST", re.compile(r"^/accounts/[^/]+/transactions/?$")),
+    ("transaction_write", "POST", re.compile(r"^/transfers/?$")),
+    ("recategorize", "POST", re.compile(r"^/rules/recategorize/?$")),
+    ("period_close", "POST", re.compile(r"^/accounts/[^/]+/(close|reopen)/?$")),
+]
+
+# never throttled, so operators can still see why everything else is
+exempt_paths = ("/metrics",)
+
+buckets: dict[str, tuple[float, float]] = {}
+in_flight: dict[str, int] = {name: 0 for name, method, pattern in expensive_routes}
+# (client key, route group) -> requests in flight; entries are dropped when they reach zero
+client_in_flight: dict[tuple[str, str], int] = {}
+counters = {"admitted": 0, "rate_limited": 0, "concurrency_limited": 0, "shed": 0}
+
+
+def client_key(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                except JWTError:
+                    break
+                return f"user:{payload.get('uid') or payload.get('sub')}"
+            break
+    client = scope.get("client")
+    return f"address:{client[0] if client else 'unknown'}"
+
+
+def take_token(key: str) -> float:
+    # 0 when admitted, otherwise the seconds until the bucket holds a whole token again
+    now = time.monotonic()
+    tokens, updated = buckets.get(key, (rate_limit_burst, now))
+    tokens = min(rate_limit_burst, tokens + (now - updated) * rate_limit_per_second)
+    if tokens < 1:
+        buckets[key] = (tokens, now)
+        return (1 - tokens) / rate_limit_per_second
+    buckets[key] = (tokens - 1, now)
+    if len(buckets) > 10000:
+        prune_buckets(now)
+    return 0.0
+
+
+def prune_buckets(now: float):
+    # a bucket that has refilled is the same as no bucket at all
+    for key, (tokens, updated) in list(buckets.items()):
+        if tokens + (now - updated) * rate_limit_per_second >= rate_limit_burst:
+            del buckets[key]
+
+
+def route_group(method: str, path: str) -> str | None:
+    for name, route_method, pattern in expensive_routes:
+        if method == route_method and pattern.match(path):
+            return name
+    return None
+
+
+def admission_stats() -> dict:
+    return {
+        **counters,
+        "rate_limit_per_second": rate_limit_per_second,
+        "rate_limit_burst": rate_limit_burst,
+        "write_concurrency": write_concurrency,
+        "global_write_concurrency": global_write_concurrency,
+        "pool_wait_threshold": pool_wait_threshold,
+        "in_flight": dict(in_flight),
+        "clients_in_flight": len(client_in_flight),
+        "tracked_clients": len(buckets),
+    }
+
+
+async def reject(send, status_code: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Per client token bucket, per client and per process write limits and load shedding on database pool wait."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        waited = pool_wait_seconds()
+        if waited > pool_wait_threshold:
+            counters["shed"] += 1
+            await reject(send, 503, "Server busy, retry later", waited)
+            return
+
+        key = client_key(scope)
+        retry_after = take_token(key)
+        if retry_after:
+            counters["rate_limited"] += 1
+            await reject(send, 429, "Too many requests", retry_after)
+            return
+
+        group = route_group(scope["method"], scope["path"])
+        if group is None:
+            counters["admitted"] += 1
+            await self.app(scope, receive, send)
+            return
+
+        slot = (key, group)
+        if client_in_flight.get(slot, 0) >= write_concurrency or in_flight[group] >= global_write_concurrency:
+            counters["concurrency_limited"] += 1
+            await reject(send, 503, "Too many concurrent writes, retry later", 1)
+            return
+        counters["admitted"] += 1
+        client_in_flight[slot] = client_in_flight.get(slot, 0) + 1
+        in_flight[group] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight[group] -= 1
+            client_in_flight[slot] -= 1
+            if not client_in_flight[slot]:
+                del client_in_flight[slot]
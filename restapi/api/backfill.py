@@ -0,0 +1,125 @@
+"""One-off backfills for data written before a feature existed.
+
+Run offline, once per deployment that predates the feature:
+
+    python -m restapi.api.backfill directory
+    python -m restapi.api.backfill checkpoints
+
+and after a crash during registration, to remove shard users that lost their name to another user:
+
+    python -m restapi.api.backfill orphans
+"""
+import argparse
+
+from sqlalchemy import select, insert, delete, exists, or_
+from sqlmodel import col
+
+from restapi.api import balances, rebalance
+from restapi.api.database import engines, directory_engine, create_db_and_tables
+from restapi.api.schemas import User, UserDirectory, Transaction, ArchivedTransaction, BalanceCheckpoint, \
+    BalanceWatermark
+
+batch_size = 1000
+
+
+def shard_user_batches(shard_connection):
+    last_id = None
+    while True:
+        statement = select(User.id, User.username, User.email).order_by(col(User.id).asc())
+        if last_id is not None:
+            statement = statement.where(User.id > last_id)
+        users = shard_connection.execute(statement.limit(batch_size)).all()
+        if not users:
+            return
+        last_id = users[-1].id
+        yield users
+
+
+def split_unlisted(directory_connection, users) -> tuple[list, list]:
+    # users without a directory entry, split into those whose name and email are free and those another user holds
+    statement = select(UserDirectory.user_id).where(col(UserDirectory.user_id).in_([user.id for user in users]))
+    listed = set(directory_connection.execute(statement).scalars().all())
+    unlisted = [user for user in users if user.id not in listed]
+    if not unlisted:
+        return [], []
+    statement = select(UserDirectory.username, UserDirectory.email).where(or_(
+        col(UserDirectory.username).in_([user.username for user in unlisted]),
+        col(UserDirectory.email).in_([user.email for user in unlisted]),
+    ))
+    taken = directory_connection.execute(statement).all()
+    usernames, emails = {entry.username for entry in taken}, {entry.email for entry in taken}
+    free = [user for user in unlisted if user.username not in usernames and user.email not in emails]
+    return free, [user for user in unlisted if user.username in usernames or user.email in emails]
+
+
+def backfill_directory() -> int:
+    # users registered before the directory existed, or whose registration stopped before its entry was written,
+    # can only log in once they have one
+    added = 0
+    for shard_engine in engines.values():
+        with shard_engine.connect() as shard_connection:
+            for users in shard_user_batches(shard_connection):
+                with directory_engine.begin() as directory_connection:
+                    free, taken = split_unlisted(directory_connection, users)
+                    missing = [{"user_id": user.id, "username": user.username, "email": user.email} for user in free]
+                    if missing:
+                        directory_connection.execute(insert(UserDirectory.__table__), missing)
+                added += len(missing)
+    return added
+
+
+def sweep_orphans() -> int:
+    # a registration that crashed between its shard and directory commits, whose name someone else has since
+    # registered, can never be listed or log in
+    removed = 0
+    tables = list(reversed(rebalance.user_tables()))
+    for shard_engine in engines.values():
+        with shard_engine.begin() as shard_connection:
+            for users in shard_user_batches(shard_connection):
+                with directory_engine.connect() as directory_connection:
+                    free, taken = split_unlisted(directory_connection, users)
+                for user in taken:
+                    for table in tables:
+                        shard_connection.execute(delete(table).where(rebalance.user_filter(table, user.id)))
+                removed += len(taken)
+    return removed
+
+
+def backfill_checkpoints() -> int:
+    # accounts written before checkpoints existed read every row for a point-in-time balance until they have them
+    added = 0
+    columns = ["account_id", "ordinal", "transaction_date", "running_balance", "user_id"]
+    for shard_engine in engines.values():
+        with shard_engine.begin() as connection:
+            for model in (Transaction, ArchivedTransaction):
+                checkpointed = exists().where(
+                    BalanceCheckpoint.account_id == model.account_id,
+                    BalanceCheckpoint.ordinal == model.ordinal,
+                )
+                # rows at or past a pending watermark get theirs when the account is settled
+                stale = exists().where(
+                    BalanceWatermark.account_id == model.account_id,
+                    BalanceWatermark.from_ordinal <= model.ordinal,
+                )
+                rows = select(*[model.__table__.c[name] for name in columns])
+                rows = rows.where(model.ordinal % balances.checkpoint_interval == 0, ~checkpointed, ~stale)
+                result = connection.execute(insert(BalanceCheckpoint.__table__).from_select(columns, rows))
+                added += result.rowcount
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("backfill", choices=["directory", "checkpoints", "orphans"], help="what to backfill")
+    args = parser.parse_args()
+    create_db_and_tables()
+    if args.backfill == "directory":
+        print(f"{backfill_directory()} directory entries added")
+    elif args.backfill == "checkpoints":
+        print(f"{backfill_checkpoints()} balance checkpoints added")
+    elif args.backfill == "orphans":
+        print(f"{sweep_orphans()} orphaned users removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import datetime
+import logging
+import os
+import threading
+import uuid
+
+from sqlalchemy import delete
+from sqlmodel import Session, select, col, func
+
+from restapi.api import periods
+from restapi.api.database import engines
+from restapi.api.schemas import Transaction, BalanceWatermark, ReadTransaction, User, BalanceCheckpoint, \
+    ArchivedTransaction, AccountBalance
+
+logger = logging.getLogger(__name__)
+
+try:
+    deferred_balances = os.environ["deferred_balances"].lower() in ("1", "true", "yes")
+except KeyError:
+    deferred_balances = False
+
+try:
+    settle_interval = float(os.environ["settle_interval"])
+except KeyError:
+    settle_interval = 2.0
+
+try:
+    checkpoint_interval = int(os.environ["checkpoint_interval"])
+except KeyError:
+    checkpoint_interval = 100
+
+_stop_worker = threading.Event()
+_worker: threading.Thread | None = None
+
+
+def mark_dirty(session: Session, transaction: Transaction, from_ordinal: int):
+    # merge with any pending watermark so the account is recomputed once from the lowest ordinal; the caller commits
+    statement = select(BalanceWatermark).where(BalanceWatermark.account_id == transaction.account_id)
+    watermark = session.exec(statement.with_for_update()).first()
+    if watermark:
+        watermark.from_ordinal = min(watermark.from_ordinal, from_ordinal)
+    else:
+        watermark = BalanceWatermark(
+            account_id=transaction.account_id,
+            user_id=transaction.user_id,
+            from_ordinal=from_ordinal,
+            marked_date=datetime.datetime.utcnow(),
+        )
+    session.add(watermark)
+
+
+def recalculate_running_balances(session: Session, account_id: uuid.UUID, from_ordinal: int):
+    statement = select(Transaction).where(Transaction.account_id == account_id)
+    statement = statement.where(Transaction.ordinal < from_ordinal)
+    statement = statement.order_by(col(Transaction.ordinal).desc())
+    anchor = session.exec(statement).first()
+
+    statement = select(Transaction).where(Transaction.account_id == account_id)
+    statement = statement.where(Transaction.ordinal >= from_ordinal)
+    statement = statement.order_by(
+        col(Transaction.transaction_date).asc(),
+        col(Transaction.ordinal).asc(),
+        col(Transaction.created_date).asc(),
+    )
+    transactions = session.exec(statement).all()
+
+    if anchor:
+        ordinal, running_balance = anchor.ordinal, anchor.running_balance
+    else:
+        ordinal, running_balance = periods.opening_balance(session, account_id)
+    for transaction in transactions:
+        ordinal += 1
+        running_balance += transaction.amount
+        if transaction.ordinal != ordinal or transaction.running_balance != running_balance:
+            transaction.ordinal = ordinal
+            transaction.running_balance = running_balance
+            session.add(transaction)
+    record_checkpoints(session, account_id, from_ordinal, transactions)
+
+
+def record_checkpoints(session: Session, account_id: uuid.UUID, from_ordinal: int, transactions: list[Transaction]):
+    # every rewritten tail replaces its checkpoints; the caller commits
+    statement = delete(BalanceCheckpoint).where(BalanceCheckpoint.account_id == account_id)
+    session.execute(statement.where(BalanceCheckpoint.ordinal >= from_ordinal))
+    for transaction in transactions:
+        if transaction.ordinal >= from_ordinal and transaction.ordinal % checkpoint_interval == 0:
+            session.add(BalanceCheckpoint(
+                account_id=account_id,
+                ordinal=transaction.ordinal,
+                transaction_date=transaction.transaction_date,
+                running_balance=transaction.running_balance,
+                user_id=transaction.user_id,
+            ))
+
+
+def balance_as_of(session: Session, user: User, account_id: uuid.UUID, as_of: datetime.date) -> AccountBalance:
+    # checkpoints at or past a pending watermark were taken from balances that are about to change
+    watermark = dirty_watermarks(session, user).get(account_id) if deferred_balances else None
+
+    statement = select(BalanceCheckpoint).where(BalanceCheckpoint.account_id == account_id)
+    statement = statement.where(BalanceCheckpoint.transaction_date <= as_of)
+    if watermark is not None:
+        statement = statement.where(BalanceCheckpoint.ordinal < watermark)
+    checkpoint = session.exec(statement.order_by(col(BalanceCheckpoint.ordinal).desc()).limit(1)).first()
+
+    statement = select(BalanceCheckpoint.ordinal).where(BalanceCheckpoint.account_id == account_id)
+    statement = statement.where(BalanceCheckpoint.transaction_date > as_of)
+    if watermark is not None:
+        statement = statement.where(BalanceCheckpoint.ordinal < watermark)
+    next_ordinal = session.exec(statement.order_by(col(BalanceCheckpoint.ordinal).asc()).limit(1)).first()
+
+    ordinal, balance = (checkpoint.ordinal, checkpoint.running_balance) if checkpoint else (0, 0.0)
+    # the remainder is at most checkpoint_interval rows, split between the hot and archive tables
+    for model in (Transaction, ArchivedTransaction):
+        statement = select(func.coalesce(func.sum(model.amount), 0.0)).where(model.account_id == account_id)
+        statement = statement.where(model.ordinal > ordinal)
+        statement = statement.where(model.transaction_date <= as_of)
+        if next_ordinal is not None:
+            statement = statement.where(model.ordinal < next_ordinal)
+        balance += session.exec(statement).one()
+    return AccountBalance(account_id=account_id, as_of=as_of, balance=balance, stale=watermark is not None)
+
+
+def settle_account(session: Session, account_id: uuid.UUID):
+    # the same lock a close takes, so a settlement never rewrites rows being archived
+    periods.lock_account(session, account_id)
+    statement = select(BalanceWatermark).where(BalanceWatermark.account_id == account_id)
+    watermark = session.exec(statement.with_for_update()).first()
+    if not watermark:
+        return
+    recalculate_running_balances(session, account_id, watermark.from_ordinal)
+    session.delete(watermark)
+    session.commit()
+
+
+def settle_dirty_accounts():
+    for engine in engines.values():
+        with Session(engine) as session:
+            statement = select(BalanceWatermark.account_id).order_by(col(BalanceWatermark.marked_date).asc())
+            account_ids = session.exec(statement).all()
+            for account_id in account_ids:
+                # one account that keeps failing must not hold up every account marked after it
+                try:
+                    settle_account(session, account_id)
+                except Exception:
+                    session.rollback()
+                    logger.exception("Settling running balances for account %s failed", account_id)
+
+
+def dirty_watermarks(session: Session, user: User) -> dict[uuid.UUID, int]:
+    statement = select(BalanceWatermark).where(BalanceWatermark.user_id == user.id)
+    return {watermark.account_id: watermark.from_ordinal for watermark in session.exec(statement).all()}
+
+
+def flag_stale(session: Session, user: User, transactions: list[Transaction]) -> list[Transaction | ReadTransaction]:
+    if not deferred_balances:
+        return transactions
+    watermarks = dirty_watermarks(session, user)
+    flagged = []
+    for transaction in transactions:
+        stale = is_stale(watermarks, transaction.account_id, transaction.ordinal)
+        flagged.append(ReadTransaction.from_orm(transaction, update={"stale": stale}))
+    return flagged
+
+
+def is_stale(watermarks: dict[uuid.UUID, int], account_id: uuid.UUID, ordinal: int) -> bool:
+    watermark = watermarks.get(account_id)
+    return watermark is not None and ordinal >= watermark
+
+
+def _run_worker():
+    while not _stop_worker.wait(settle_interval):
+        try:
+            settle_dirty_accounts()
+        except Exception:
+            logger.exception("Settling running balances failed")
+
+
+def start_settlement_worker():
+    global _worker
+    if not deferred_balances or _worker is not None:
+        return
+    _stop_worker.clear()
+    _worker = threading.Thread(target=_run_worker, name="balance-settlement", daemon=True)
+    _worker.start()
+
+
+def stop_settlement_worker():
+    global _worker
+    if _worker is None:
+        return
+    _stop_worker.set()
+    _worker.join()
+    _worker = None
+    # drain whatever was marked between the last pass and shutdown
+    settle_dirty_accounts()
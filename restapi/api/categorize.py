@@ -0,0 +1,179 @@
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import update
+from sqlmodel import Session, select, col, func
+
+from restapi.api import changes, events
+from restapi.api.schemas import BaseTransaction, CategoryRule, Transaction, TransactionType, User
+
+try:
+    rule_cache_size = int(os.environ["rule_cache_size"])
+except KeyError:
+    rule_cache_size = 1000
+
+try:
+    recategorize_batch_size = int(os.environ["recategorize_batch_size"])
+except KeyError:
+    recategorize_batch_size = 5000
+
+
+class SubstringMatcher:
+    """Finds every pattern contained in a text with one compiled regex scan."""
+
+    def __init__(self, patterns: list[str]):
+        patterns = sorted({pattern.lower() for pattern in patterns}, key=len, reverse=True)
+        # a lookahead reports the longest pattern at every offset; any other pattern matching at that
+        # offset is a prefix of it, so the prefixes are worked out once here
+        self.regex = re.compile(f"(?=({'|'.join(map(re.escape, patterns))}))") if patterns else None
+        self.prefixes = {pattern: {other for other in patterns if pattern.startswith(other)} for pattern in patterns}
+
+    def find(self, text: str | None) -> set[str]:
+        found = set()
+        if self.regex is None or not text:
+            return found
+        for match in self.regex.finditer(text.lower()):
+            found |= self.prefixes[match.group(1)]
+        return found
+
+
+class RuleMatcher:
+    """A user's active rules compiled for bulk matching; the first matching rule by priority wins."""
+
+    def __init__(self, rules: list[CategoryRule]):
+        self.rules = sorted(rules, key=lambda rule: (-rule.priority, str(rule.id)))
+        self.memo = SubstringMatcher([rule.memo_contains for rule in self.rules if rule.memo_contains])
+        self.description = SubstringMatcher(
+            [rule.description_contains for rule in self.rules if rule.description_contains]
+        )
+        # each rule is indexed under its memo pattern, else its description pattern, else checked on every row
+        self.by_memo: dict[str, list[int]] = {}
+        self.by_description: dict[str, list[int]] = {}
+        self.unindexed: list[int] = []
+        for position, rule in enumerate(self.rules):
+            if rule.memo_contains:
+                self.by_memo.setdefault(rule.memo_contains.lower(), []).append(position)
+            elif rule.description_contains:
+                self.by_description.setdefault(rule.description_contains.lower(), []).append(position)
+            else:
+                self.unindexed.append(position)
+
+    def category_for(
+            self,
+            memo: str | None,
+            description: str | None,
+            amount: float,
+            transaction_type: TransactionType | str,
+    ) -> uuid.UUID | None:
+        memo_hits = self.memo.find(memo)
+        description_hits = self.description.find(description)
+        candidates = list(self.unindexed)
+        for pattern in memo_hits:
+            candidates.extend(self.by_memo.get(pattern, ()))
+        for pattern in description_hits:
+            candidates.extend(self.by_description.get(pattern, ()))
+        for position in sorted(candidates):
+            rule = self.rules[position]
+            if rule.description_contains and rule.description_contains.lower() not in description_hits:
+                continue
+            if rule.min_amount is not None and amount < rule.min_amount:
+                continue
+            if rule.max_amount is not None and amount > rule.max_amount:
+                continue
+            if rule.transaction_type is not None and rule.transaction_type != transaction_type:
+                continue
+            return rule.category_id
+        return None
+
+
+# user id -> (rules signature, compiled matcher), oldest first; request threads share it under the lock
+_matchers: OrderedDict[uuid.UUID, tuple[tuple, RuleMatcher]] = OrderedDict()
+_matchers_lock = threading.Lock()
+
+
+def rules_signature(session: Session, user: User) -> tuple:
+    # every rule write moves the count or the latest updated_date, in this worker or any other
+    statement = select(func.count(CategoryRule.id), func.max(CategoryRule.updated_date))
+    statement = statement.where(CategoryRule.user_id == user.id)
+    return tuple(session.exec(statement).one())
+
+
+def matcher_for_user(session: Session, user: User) -> RuleMatcher:
+    signature = rules_signature(session, user)
+    with _matchers_lock:
+        cached = _matchers.get(user.id)
+        if cached and cached[0] == signature:
+            _matchers.move_to_end(user.id)
+            return cached[1]
+    # plain rows rather than entities, so the cached matcher outlives this session
+    statement = select(
+        CategoryRule.id,
+        CategoryRule.category_id,
+        CategoryRule.memo_contains,
+        CategoryRule.description_contains,
+        CategoryRule.min_amount,
+        CategoryRule.max_amount,
+        CategoryRule.transaction_type,
+        CategoryRule.priority,
+    )
+    statement = statement.where(CategoryRule.user_id == user.id).where(CategoryRule.active == True)
+    matcher = RuleMatcher(session.execute(statement).all())
+    with _matchers_lock:
+        _matchers[user.id] = (signature, matcher)
+        if len(_matchers) > rule_cache_size:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def categorize(session: Session, user: User, transaction: BaseTransaction) -> uuid.UUID | None:
+    matcher = matcher_for_user(session, user)
+    return matcher.category_for(
+        transaction.memo, transaction.description, transaction.amount, transaction.transaction_type
+    )
+
+
+def recategorize(session: Session, user: User, statement) -> tuple[int, int, int]:
+    matcher = matcher_for_user(session, user)
+    statement = statement.with_only_columns(
+        Transaction.id,
+        Transaction.memo,
+        Transaction.description,
+        Transaction.amount,
+        Transaction.transaction_type,
+        Transaction.category_id,
+    ).order_by(col(Transaction.id).asc())
+
+    # plain rows in batches, then one UPDATE per target category per batch
+    scanned = matched = updated = 0
+    moves: dict[uuid.UUID, list[uuid.UUID]] = {}
+    result = session.execute(statement.execution_options(yield_per=recategorize_batch_size))
+    for rows in result.partitions():
+        for row in rows:
+            scanned += 1
+            category_id = matcher.category_for(row.memo, row.description, row.amount, row.transaction_type)
+            if category_id is None:
+                continue
+            matched += 1
+            if category_id != row.category_id:
+                moves.setdefault(category_id, []).append(row.id)
+    if not moves:
+        return scanned, matched, updated
+
+    version = changes.next_sync_version(session, user.id)
+    for category_id, transaction_ids in moves.items():
+        for start in range(0, len(transaction_ids), recategorize_batch_size):
+            batch = transaction_ids[start:start + recategorize_batch_size]
+            update_statement = update(Transaction).where(Transaction.user_id == user.id)
+            update_statement = update_statement.where(col(Transaction.id).in_(batch))
+            update_statement = update_statement.values(category_id=category_id, sync_version=version)
+            session.execute(update_statement.execution_options(synchronize_session=False))
+            updated += len(batch)
+    # the bulk updates never reach the flush, so stream subscribers get one batch event to resync from
+    events.queue_events(session, user.id, [
+        {"type": "transactions.recategorized", "sync_version": version, "count": updated},
+    ])
+    session.commit()
+    return scanned, matched, updated
@@ -0,0 +1,88 @@
+import uuid
+
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, col
+
+from restapi.api.schemas import Account, Category, Bill, Transaction, SyncCursor, SyncChanges, User, \
+    ArchivedTransaction
+
+synced_models = (Account, Category, Bill, Transaction)
+
+upsert_dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def create_cursor(session: Session, user_id: uuid.UUID):
+    # two first writes for a user can both miss the cursor, so the second insert must be a no-op rather than a conflict
+    insert = upsert_dialects[session.get_bind(inspect(SyncCursor)).dialect.name]
+    statement = insert(SyncCursor).values(user_id=user_id, version=0)
+    session.execute(statement.on_conflict_do_nothing(index_elements=["user_id"]))
+
+
+def next_sync_version(session: Session, user_id: uuid.UUID) -> int:
+    # the row lock orders concurrent writers for a user, so versions become visible in increasing order
+    statement = select(SyncCursor).where(SyncCursor.user_id == user_id).with_for_update()
+    cursor = session.exec(statement).first()
+    if not cursor:
+        create_cursor(session, user_id)
+        cursor = session.exec(statement).first()
+    cursor.version += 1
+    session.add(cursor)
+    return cursor.version
+
+
+@event.listens_for(Session, "before_flush")
+def stamp_sync_versions(session: Session, flush_context, instances):
+    changed: dict[uuid.UUID, list] = {}
+    for instance in list(session.new) + list(session.dirty):
+        if not isinstance(instance, synced_models):
+            continue
+        if instance not in session.new and not session.is_modified(instance):
+            continue
+        changed.setdefault(instance.user_id, []).append(instance)
+    with session.no_autoflush:
+        for user_id, instances in changed.items():
+            version = next_sync_version(session, user_id)
+            for instance in instances:
+                instance.sync_version = version
+
+
+def current_sync_version(session: Session, user: User) -> int:
+    cursor = session.exec(select(SyncCursor).where(SyncCursor.user_id == user.id)).first()
+    return cursor.version if cursor else 0
+
+
+def changes_since(session: Session, user: User, since: int, limit: int) -> SyncChanges:
+    current = current_sync_version(session, user)
+    upto = current
+
+    # cap the page on transactions, the only table that grows without bound, but never split a version
+    statement = select(Transaction.sync_version).where(Transaction.user_id == user.id)
+    statement = statement.where(Transaction.sync_version > since)
+    statement = statement.order_by(col(Transaction.sync_version).asc())
+    first_version = session.exec(statement.limit(1)).first()
+    next_version = session.exec(statement.offset(limit).limit(1)).first()
+    if next_version is not None:
+        upto = max(next_version - 1, first_version)
+
+    def changed(model):
+        statement = select(model).where(model.user_id == user.id)
+        statement = statement.where(model.sync_version > since)
+        statement = statement.where(model.sync_version <= upto)
+        statement = statement.order_by(col(model.sync_version).asc())
+        return session.exec(statement).all()
+
+    # a closed period moves rows to the archive under a new version; their ids tell clients to drop them
+    statement = select(ArchivedTransaction.id).where(ArchivedTransaction.user_id == user.id)
+    statement = statement.where(ArchivedTransaction.sync_version > since)
+    statement = statement.where(ArchivedTransaction.sync_version <= upto)
+
+    return SyncChanges(
+        sync_token=upto,
+        has_more=upto < current,
+        accounts=changed(Account),
+        categories=changed(Category),
+        bills=changed(Bill),
+        transactions=changed(Transaction),
+        archived_transaction_ids=session.exec(statement).all(),
+    )
@@ -1,17 +1,167 @@
+import bisect
+import hashlib
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.pool import QueuePool
 from sqlmodel import create_engine, Session, SQLModel
 import os
 
+from restapi.api.schemas import UserDirectory
+
 try:
     postgres_url = os.environ["postgres_url"]
 except KeyError:
     postgres_url = "postgresql://localhost/duckledger"
-engine = create_engine(postgres_url)
+
+# comma separated name=url pairs; the names place users on the hash ring, so keep them stable
+try:
+    shard_urls = dict(pair.strip().split("=", 1) for pair in os.environ["shard_urls"].split(",") if pair.strip())
+except KeyError:
+    shard_urls = {"shard0": postgres_url}
+
+try:
+    directory_url = os.environ["directory_url"]
+except KeyError:
+    directory_url = next(iter(shard_urls.values()))
+
+try:
+    query_cache_size = int(os.environ["query_cache_size"])
+except KeyError:
+    query_cache_size = 1000
+
+# set to false where the schema is managed outside the API
+try:
+    create_tables = os.environ["create_tables"].lower() not in ("0", "false", "no")
+except KeyError:
+    create_tables = True
+
+# seconds for a pool wait sample to lose half its weight, so the average recovers once load drops
+pool_wait_half_life = 1.0
+pool_wait = {"average": 0.0, "max": 0.0, "at": time.monotonic()}
+
+
+def pool_wait_seconds() -> float:
+    elapsed = time.monotonic() - pool_wait["at"]
+    return pool_wait["average"] * 0.5 ** (elapsed / pool_wait_half_life)
+
+
+class TimedQueuePool(QueuePool):
+    """Records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.monotonic() - started
+            pool_wait["average"] = pool_wait_seconds() * 0.8 + waited * 0.2
+            pool_wait["max"] = max(pool_wait["max"], waited)
+            pool_wait["at"] = time.monotonic()
+
+
+def build_engine(url: str):
+    return create_engine(url, query_cache_size=query_cache_size, poolclass=TimedQueuePool)
+
+
+engines = {name: build_engine(url) for name, url in shard_urls.items()}
+default_shard = next(iter(engines))
+engine = engines[default_shard]
+directory_engine = next((engines[name] for name, url in shard_urls.items() if url == directory_url), None)
+if directory_engine is None:
+    directory_engine = build_engine(directory_url)
+
+statement_cache = {"hits": 0, "misses": 0, "uncached": 0}
+
+
+def count_statement_cache(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    if context.cache_hit is CACHE_HIT:
+        statement_cache["hits"] += 1
+    elif context.cache_hit is CACHE_MISS:
+        statement_cache["misses"] += 1
+    else:
+        statement_cache["uncached"] += 1
+
+
+for _engine in {*engines.values(), directory_engine}:
+    event.listen(_engine, "after_cursor_execute", count_statement_cache)
+
+
+def statement_cache_stats() -> dict:
+    return {**statement_cache, "size": query_cache_size}
+
+
+def pool_stats() -> dict:
+    return {
+        "wait_seconds": round(pool_wait_seconds(), 4),
+        "max_wait_seconds": round(pool_wait["max"], 4),
+        "checked_out": {name: shard_engine.pool.checkedout() for name, shard_engine in engines.items()},
+    }
+
+
+class HashRing:
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        self._ring = sorted((self._hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas))
+        self._keys = [key for key, node in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, key: uuid.UUID) -> str:
+        index = bisect.bisect(self._keys, self._hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+ring = HashRing(list(engines))
+
+
+def shard_for_user(user_id: uuid.UUID) -> str:
+    return ring.node_for(user_id)
+
+
+class ShardSession(Session):
+    """Sends the user directory to the directory database and everything else to the routed shard."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if mapper is not None and mapper.class_ is UserDirectory:
+            return directory_engine
+        return engines[self.info.get("shard", default_shard)]
+
+
+def use_shard(session: Session, shard: str):
+    session.info["shard"] = shard
+
+
+def use_user_shard(session: Session, user_id: uuid.UUID):
+    use_shard(session, shard_for_user(user_id))
 
 
 def create_session():
-    with Session(engine) as session:
+    with ShardSession() as session:
         yield session
 
 
+tables_ready = False
+
+
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    # the server runner creates tables once before forking, so its workers skip the DDL round trips
+    global tables_ready
+    if tables_ready or not create_tables:
+        return
+    shard_tables = [table for table in SQLModel.metadata.sorted_tables if table is not UserDirectory.__table__]
+    for shard_engine in engines.values():
+        SQLModel.metadata.create_all(shard_engine, tables=shard_tables)
+    SQLModel.metadata.create_all(directory_engine, tables=[UserDirectory.__table__])
+    tables_ready = True
+
+
+def dispose_engines():
+    # pooled connections must not be shared across a fork
+    for shard_engine in {*engines.values(), directory_engine}:
+        shard_engine.dispose()
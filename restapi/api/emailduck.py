@@ -1,13 +1,20 @@
 import os
-import smtplib
 
-smtp_username = os.environ["smtp_username"]
-smtp_password = os.environ["smtp_password"]
-smtp_server = os.environ["smtp_server"]
-smtp_port = int(os.environ["smtp_port"])
+
+# read when the first email is sent, so workers that never send one boot without any SMTP settings
+def smtp_settings() -> tuple[str, str, str, int]:
+    return (
+        os.environ["smtp_username"],
+        os.environ["smtp_password"],
+        os.environ["smtp_server"],
+        int(os.environ["smtp_port"]),
+    )
 
 
 def send_password_reset_email(token: str, email_address: str):
+    import smtplib
+
+    smtp_username, smtp_password, smtp_server, smtp_port = smtp_settings()
 
     sender = "Duck Ledger <mail@duckledger.com>"
     receiver = email_address
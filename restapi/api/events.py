@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+import uuid
+
+from sqlalchemy import event, inspect
+from sqlmodel import Session
+
+from restapi.api.schemas import Transaction
+
+try:
+    event_queue_size = int(os.environ["event_queue_size"])
+except KeyError:
+    event_queue_size = 100
+
+
+class LocalBroker:
+    """In-process fan-out of ledger events to the subscribers of each user."""
+
+    def __init__(self, max_queued: int = event_queue_size):
+        self.max_queued = max_queued
+        self._subscribers: dict[uuid.UUID, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: uuid.UUID) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id: uuid.UUID, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.difference_update({subscriber for subscriber in subscribers if subscriber[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, user_id: uuid.UUID, events: list[dict]):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(_enqueue, queue, events)
+
+
+def _enqueue(queue: asyncio.Queue, events: list[dict]):
+    for ledger_event in events:
+        try:
+            queue.put_nowait(ledger_event)
+        except asyncio.QueueFull:
+            # a slow client gets told to resync instead of an unbounded backlog
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync"})
+            return
+
+
+broker = LocalBroker()
+
+
+def set_broker(new_broker):
+    global broker
+    broker = new_broker
+
+
+def transaction_events(transaction: Transaction, created: bool) -> list[dict]:
+    data = {
+        "id": str(transaction.id),
+        "account_id": str(transaction.account_id),
+        "sync_version": transaction.sync_version,
+    }
+    events = [{"type": "transaction.created" if created else "transaction.updated", **data}]
+    if created and transaction.bill_id:
+        events.append({"type": "bill.materialized", "bill_id": str(transaction.bill_id), **data})
+    return events
+
+
+# rewriting a tail of running balances is reported once per account as balance.changed
+balance_attributes = {"running_balance", "ordinal", "sync_version", "updated_date"}
+
+
+def changed_attributes(instance) -> set[str]:
+    return {attribute.key for attribute in inspect(instance).attrs if attribute.history.has_changes()}
+
+
+@event.listens_for(Session, "after_flush")
+def collect_events(session: Session, flush_context):
+    pending: dict[uuid.UUID, dict] = session.info.setdefault("ledger_events", {})
+    for instance in list(session.new) + list(session.dirty):
+        if not isinstance(instance, Transaction):
+            continue
+        created = instance in session.new
+        changed = set() if created else changed_attributes(instance)
+        if not created and not changed:
+            continue
+        events = pending.setdefault(instance.user_id, {})
+        if created or changed - balance_attributes:
+            for ledger_event in transaction_events(instance, created):
+                events.setdefault((ledger_event["type"], ledger_event["id"]), ledger_event)
+        if created or "running_balance" in changed:
+            events[("balance.changed", str(instance.account_id))] = {
+                "type": "balance.changed",
+                "account_id": str(instance.account_id),
+                "sync_version": instance.sync_version,
+            }
+
+
+def queue_events(session: Session, user_id: uuid.UUID, ledger_events: list[dict]):
+    # for writes the flush never sees, such as bulk statements; published with the rest on commit
+    pending = session.info.setdefault("ledger_events", {}).setdefault(user_id, {})
+    for ledger_event in ledger_events:
+        pending[(ledger_event["type"], ledger_event.get("id") or ledger_event.get("account_id"))] = ledger_event
+
+
+@event.listens_for(Session, "after_commit")
+def publish_events(session: Session):
+    pending = session.info.pop("ledger_events", {})
+    for user_id, events in pending.items():
+        broker.publish(user_id, list(events.values()))
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_events(session: Session):
+    session.info.pop("ledger_events", None)
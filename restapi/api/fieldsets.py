@@ -0,0 +1,57 @@
+from fastapi import HTTPException, status, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlmodel import Session
+from sqlmodel.sql.expression import Select, SelectOfScalar
+
+fields_query = Query(
+    default=None,
+    description="Comma separated columns to return instead of the full object, e.g. id,amount,transaction_date",
+)
+
+
+def parse_fields(fields: str | None, allowed: tuple[str, ...]) -> list[str] | None:
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(allowed)}",
+        )
+    return names
+
+
+def projected_rows(
+        session: Session,
+        statement: Select | SelectOfScalar,
+        model,
+        names: list[str],
+        params: dict | None = None,
+) -> list[dict]:
+    # plain column rows, so no entity is hydrated and no relationship is loaded
+    statement = statement.with_only_columns(*[getattr(model, name) for name in names])
+    return [dict(row._mapping) for row in session.execute(statement, params)]
+
+
+def rows_response(content: list[dict] | dict) -> JSONResponse:
+    return JSONResponse(content=jsonable_encoder(content))
+
+
+def projected_response(session: Session, statement: Select | SelectOfScalar, model, names: list[str]) -> JSONResponse:
+    return rows_response(projected_rows(session, statement, model, names))
+
+
+def projected_detail(
+        session: Session,
+        statement: Select | SelectOfScalar,
+        model,
+        names: list[str],
+        not_found: str,
+        params: dict | None = None,
+) -> JSONResponse:
+    rows = projected_rows(session, statement.limit(1), model, names, params)
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found)
+    return rows_response(rows[0])
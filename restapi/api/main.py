@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from restapi.api.routers import accounts, categories, transactions, auth, bills
+from restapi.api.routers import accounts, categories, transactions, auth, bills, sync, events, periods, metrics, \
+    transfers, reconciliation, rules, dashboard
 
+from restapi.api.admission import AdmissionMiddleware
 from restapi.api.database import create_db_and_tables
+from restapi.api.balances import start_settlement_worker, stop_settlement_worker
 
 app = FastAPI(title="Duck Ledger")
 
@@ -11,19 +14,32 @@ origins = [
     "http://localhost:61577",
 ]
 
+# added before CORS so rejected requests still carry the CORS headers
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "Retry-After"],
 )
 
 app.add_event_handler("startup", create_db_and_tables)
+app.add_event_handler("startup", start_settlement_worker)
+app.add_event_handler("shutdown", stop_settlement_worker)
 app.include_router(auth.router)
 app.include_router(accounts.router)
 app.include_router(categories.router)
+app.include_router(rules.router)
 app.include_router(transactions.router)
 app.include_router(bills.router)
+app.include_router(transfers.router)
+app.include_router(sync.router)
+app.include_router(events.router)
+app.include_router(periods.router)
+app.include_router(reconciliation.router)
+app.include_router(dashboard.router)
+app.include_router(metrics.router)
 
 
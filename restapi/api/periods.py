@@ -0,0 +1,127 @@
+import datetime
+import uuid
+
+from fastapi import HTTPException, status
+from sqlalchemy import insert, delete, bindparam, literal
+from sqlmodel import Session, select, col
+
+from restapi.api import changes, events
+from restapi.api.schemas import Account, Transaction, ArchivedTransaction, PeriodClose, User
+
+# closing, reopening and every write into a period take the account row lock first, so a write cannot land
+# in a year while that year is being archived
+account_lock_statement = select(Account.id).where(Account.id == bindparam("account_id")).with_for_update()
+
+
+def lock_account(session: Session, account_id: uuid.UUID):
+    # held until the caller commits or rolls back
+    session.exec(account_lock_statement, params={"account_id": account_id}).first()
+
+
+def latest_close(session: Session, account_id: uuid.UUID) -> PeriodClose | None:
+    statement = select(PeriodClose).where(PeriodClose.account_id == account_id)
+    statement = statement.order_by(col(PeriodClose.year).desc())
+    return session.exec(statement.limit(1)).first()
+
+
+def opening_balance(session: Session, account_id: uuid.UUID) -> tuple[int, float]:
+    # the ordinal and running balance the hot table continues from
+    close = latest_close(session, account_id)
+    if close:
+        return close.ordinal, close.running_balance
+    return 0, 0.0
+
+
+def ensure_period_open(session: Session, account_id: uuid.UUID, transaction_date: datetime.date):
+    if isinstance(transaction_date, datetime.datetime):
+        transaction_date = transaction_date.date()
+    lock_account(session, account_id)
+    close = latest_close(session, account_id)
+    if close and transaction_date <= close.closed_through:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Period closed through {close.closed_through}, reopen {close.year} first",
+        )
+
+
+def move_rows(session: Session, source, target, where, sync_version: int):
+    # bulk statements skip the flush hook, so the moved rows are stamped here for the change feed
+    columns = [column.name for column in target.__table__.columns]
+    rows = select(*[
+        literal(sync_version).label(name) if name == "sync_version" else source.__table__.c[name] for name in columns
+    ]).where(*where)
+    session.execute(insert(target.__table__).from_select(columns, rows))
+    session.execute(delete(source.__table__).where(*where))
+
+
+def period_event(period_close: PeriodClose, event_type: str, sync_version: int) -> dict:
+    return {
+        "type": event_type,
+        "account_id": str(period_close.account_id),
+        "year": period_close.year,
+        "sync_version": sync_version,
+    }
+
+
+def close_period(session: Session, user: User, account_id: uuid.UUID, year: int) -> PeriodClose:
+    lock_account(session, account_id)
+    close = latest_close(session, account_id)
+    if close and year <= close.year:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Period closed through {close.year}")
+    if year >= datetime.date.today().year:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only past years can be closed")
+
+    closed_through = datetime.date(year, 12, 31)
+    statement = select(Transaction).where(Transaction.account_id == account_id)
+    statement = statement.where(Transaction.transaction_date <= closed_through)
+    statement = statement.order_by(col(Transaction.ordinal).desc())
+    last_transaction = session.exec(statement.limit(1)).first()
+    if last_transaction:
+        ordinal, running_balance = last_transaction.ordinal, last_transaction.running_balance
+    else:
+        ordinal, running_balance = opening_balance(session, account_id)
+
+    # the archived rows carry the new version, which is how sync clients learn they left the ledger
+    sync_version = changes.next_sync_version(session, user.id)
+    move_rows(session, Transaction, ArchivedTransaction, [
+        Transaction.account_id == account_id,
+        Transaction.transaction_date <= closed_through,
+    ], sync_version)
+    period_close = PeriodClose(
+        account_id=account_id,
+        user_id=user.id,
+        year=year,
+        closed_through=closed_through,
+        ordinal=ordinal,
+        running_balance=running_balance,
+        closed_date=datetime.datetime.utcnow(),
+    )
+    session.add(period_close)
+    events.queue_events(session, user.id, [period_event(period_close, "period.closed", sync_version)])
+    session.commit()
+    session.refresh(period_close)
+    return period_close
+
+
+def reopen_period(session: Session, account_id: uuid.UUID, year: int) -> PeriodClose:
+    lock_account(session, account_id)
+    statement = select(PeriodClose).where(PeriodClose.account_id == account_id)
+    statement = statement.order_by(col(PeriodClose.year).desc())
+    closes = session.exec(statement.limit(2)).all()
+    if not closes or closes[0].year != year:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Only the most recently closed period can be reopened",
+        )
+    period_close = closes[0]
+
+    where = [ArchivedTransaction.account_id == account_id]
+    if len(closes) > 1:
+        where.append(ArchivedTransaction.transaction_date > closes[1].closed_through)
+    # restored rows get a version past anything a sync client has seen, so they are sent again
+    sync_version = changes.next_sync_version(session, period_close.user_id)
+    move_rows(session, ArchivedTransaction, Transaction, where, sync_version)
+    events.queue_events(session, period_close.user_id, [period_event(period_close, "period.reopened", sync_version)])
+    session.delete(period_close)
+    session.commit()
+    return period_close
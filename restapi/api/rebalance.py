@@ -0,0 +1,70 @@
+"""Move users whose hash ring placement changed onto their new shard.
+
+Run offline, with the API stopped, after adding or removing entries in shard_urls:
+
+    python -m restapi.api.rebalance [--dry-run]
+"""
+import argparse
+import uuid
+
+from sqlalchemy import select, insert, delete
+from sqlmodel import SQLModel
+
+from restapi.api.database import engines, shard_for_user, create_db_and_tables
+from restapi.api.schemas import User, UserDirectory
+
+
+def user_tables():
+    # parents before children, so inserts satisfy foreign keys and deletes run in reverse
+    tables = [User.__table__]
+    for table in SQLModel.metadata.sorted_tables:
+        if table is not UserDirectory.__table__ and "user_id" in table.c:
+            tables.append(table)
+    return tables
+
+
+def user_filter(table, user_id: uuid.UUID):
+    return table.c.id == user_id if table is User.__table__ else table.c.user_id == user_id
+
+
+def move_user(user_id: uuid.UUID, source: str, target: str) -> int:
+    tables = user_tables()
+    moved = 0
+    with engines[source].begin() as source_connection:
+        with engines[target].begin() as target_connection:
+            for table in tables:
+                rows = source_connection.execute(select(table).where(user_filter(table, user_id))).mappings().all()
+                if rows:
+                    target_connection.execute(insert(table), [dict(row) for row in rows])
+                    moved += len(rows)
+        # the target has committed before anything is removed from the source
+        for table in reversed(tables):
+            source_connection.execute(delete(table).where(user_filter(table, user_id)))
+    return moved
+
+
+def rebalance(dry_run: bool = False):
+    for source in engines:
+        with engines[source].connect() as connection:
+            user_ids = connection.execute(select(User.__table__.c.id)).scalars().all()
+        for user_id in user_ids:
+            target = shard_for_user(user_id)
+            if target == source:
+                continue
+            if dry_run:
+                print(f"{user_id}: {source} -> {target}")
+                continue
+            moved = move_user(user_id, source, target)
+            print(f"{user_id}: {source} -> {target} ({moved} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only list the users that would move")
+    args = parser.parse_args()
+    create_db_and_tables()
+    rebalance(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
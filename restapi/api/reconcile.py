@@ -0,0 +1,180 @@
+import bisect
+import datetime
+import difflib
+import os
+import re
+import uuid
+
+from sqlalchemy import update, or_
+from sqlmodel import Session, select, col
+
+from restapi.api import balances, changes, events
+from restapi.api.schemas import Transaction, User, Statement, StatementLine, StatementMatch, StatementReconciliation
+
+try:
+    reconcile_window_days = int(os.environ["reconcile_window_days"])
+except KeyError:
+    reconcile_window_days = 3
+
+
+def cents(amount: float) -> int:
+    return round(amount * 100)
+
+
+def normalize_memo(memo: str | None) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", (memo or "").lower()))
+
+
+def memo_similarity(line_memo: str, transaction_memo: str) -> float:
+    if not line_memo or not transaction_memo:
+        return 0.0
+    return round(difflib.SequenceMatcher(None, line_memo, transaction_memo).ratio(), 3)
+
+
+class LedgerIndex:
+    """Hashes ledger entries by token and by amount, each amount bucket sorted by date for window lookups."""
+
+    def __init__(self, transactions: list[Transaction]):
+        self.by_token = {
+            transaction.transaction_token: transaction for transaction in transactions if transaction.transaction_token
+        }
+        self.by_amount: dict[int, list[tuple[datetime.date, int, Transaction]]] = {}
+        for position, transaction in enumerate(transactions):
+            self.by_amount.setdefault(cents(transaction.amount), []).append(
+                (transaction.transaction_date, position, transaction)
+            )
+        for bucket in self.by_amount.values():
+            bucket.sort(key=lambda entry: entry[:2])
+        self.memos = {transaction.id: normalize_memo(transaction.memo) for transaction in transactions}
+        self.taken: set[uuid.UUID] = set()
+
+    def take_token(self, token: str | None) -> Transaction | None:
+        transaction = self.by_token.get(token) if token else None
+        if transaction is None or transaction.id in self.taken:
+            return None
+        self.taken.add(transaction.id)
+        return transaction
+
+    def take_closest(self, line: StatementLine, window: int) -> tuple[Transaction, float] | None:
+        bucket = self.by_amount.get(cents(line.amount))
+        if not bucket:
+            return None
+        low = bisect.bisect_left(bucket, (line.transaction_date - datetime.timedelta(days=window),))
+        high = bisect.bisect_right(bucket, (line.transaction_date + datetime.timedelta(days=window), len(bucket) + 1))
+        line_memo = normalize_memo(line.memo)
+        best = None
+        for transaction_date, position, transaction in bucket[low:high]:
+            if transaction.id in self.taken:
+                continue
+            similarity = memo_similarity(line_memo, self.memos[transaction.id])
+            rank = (abs((transaction_date - line.transaction_date).days), -similarity, position)
+            if best is None or rank < best[0]:
+                best = (rank, transaction, similarity)
+        if best is None:
+            return None
+        self.taken.add(best[1].id)
+        return best[1], best[2]
+
+
+def ledger_candidates(session: Session, user: User, account_id: uuid.UUID, statement: Statement, window: int):
+    window_delta = datetime.timedelta(days=window)
+    cmd = select(Transaction).where(Transaction.user_id == user.id)
+    cmd = cmd.where(Transaction.account_id == account_id)
+    cmd = cmd.where(Transaction.active == True)
+    cmd = cmd.where(Transaction.transaction_date >= statement.start_date - window_delta)
+    cmd = cmd.where(Transaction.transaction_date <= statement.end_date + window_delta)
+    # entries in the margins that an earlier statement already claimed cannot match this one
+    cmd = cmd.where(or_(
+        Transaction.reconciled == False,
+        col(Transaction.transaction_date).between(statement.start_date, statement.end_date),
+    ))
+    cmd = cmd.order_by(col(Transaction.ordinal).asc())
+    return session.exec(cmd).all()
+
+
+def match_statement(transactions: list[Transaction], lines: list[StatementLine], window: int):
+    index = LedgerIndex(transactions)
+    matched: list[StatementMatch] = []
+    unmatched: list[int] = []
+
+    def record(position: int, transaction: Transaction, matched_on: str, similarity: float):
+        matched.append(StatementMatch(
+            line=position,
+            transaction_id=transaction.id,
+            matched_on=matched_on,
+            days_apart=abs((transaction.transaction_date - lines[position].transaction_date).days),
+            memo_similarity=similarity,
+        ))
+
+    # exact token matches first, so fuzzy matching cannot claim an entry another line names outright
+    for position, line in enumerate(lines):
+        transaction = index.take_token(line.transaction_token)
+        if transaction:
+            similarity = memo_similarity(normalize_memo(line.memo), index.memos[transaction.id])
+            record(position, transaction, "token", similarity)
+        else:
+            unmatched.append(position)
+
+    missing: list[int] = []
+    for position in sorted(unmatched, key=lambda position: (lines[position].transaction_date, position)):
+        found = index.take_closest(lines[position], window)
+        if found:
+            record(position, found[0], "amount", found[1])
+        else:
+            missing.append(position)
+
+    matched.sort(key=lambda match: match.line)
+    return matched, sorted(missing), index.taken
+
+
+def mark_reconciled(session: Session, user: User, account_id: uuid.UUID, transaction_ids: list[uuid.UUID]):
+    # one statement for every match; the bulk update bypasses the flush hooks, so stamp the sync version
+    # and queue the stream event here
+    version = changes.next_sync_version(session, user.id)
+    statement = update(Transaction).where(Transaction.user_id == user.id)
+    statement = statement.where(col(Transaction.id).in_(transaction_ids))
+    statement = statement.values(reconciled=True, sync_version=version)
+    session.execute(statement.execution_options(synchronize_session=False))
+    events.queue_events(session, user.id, [{
+        "type": "transactions.reconciled",
+        "account_id": str(account_id),
+        "sync_version": version,
+        "count": len(transaction_ids),
+    }])
+
+
+def reconcile_statement(
+        session: Session,
+        user: User,
+        account_id: uuid.UUID,
+        statement: Statement,
+        mark: bool = True,
+) -> StatementReconciliation:
+    window = reconcile_window_days
+    transactions = ledger_candidates(session, user, account_id, statement, window)
+    matched, missing, taken = match_statement(transactions, statement.lines, window)
+    extra = [
+        transaction for transaction in transactions
+        if transaction.id not in taken and statement.start_date <= transaction.transaction_date <= statement.end_date
+    ]
+
+    ledger = balances.balance_as_of(session, user, account_id, statement.end_date)
+    difference = None
+    if statement.closing_balance is not None:
+        difference = round(statement.closing_balance - ledger.balance, 2)
+
+    reconciliation = StatementReconciliation(
+        matched=matched,
+        missing=[statement.lines[position] for position in missing],
+        extra=extra,
+        closing_balance=statement.closing_balance,
+        ledger_balance=ledger.balance,
+        difference=difference,
+        balanced=None if difference is None else difference == 0,
+        stale=ledger.stale,
+    )
+    # built before the commit, which would expire the extra entries it reports
+    if mark and matched:
+        mark_reconciled(session, user, account_id, [match.transaction_id for match in matched])
+        session.commit()
+    return reconciliation
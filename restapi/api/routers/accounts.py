@@ -1,7 +1,10 @@
+import datetime
+
 from fastapi.routing import APIRouter
 from sqlmodel import Session, select
 from fastapi import Depends, status, HTTPException, Query
-from restapi.api.schemas import Account, ReadAccount, CreateAccount, UpdateAccount, User
+from restapi.api import balances, fieldsets
+from restapi.api.schemas import Account, ReadAccount, CreateAccount, UpdateAccount, User, AccountBalance
 from restapi.api.database import create_session
 from restapi.api.routers.auth import get_current_active_user
 import uuid
@@ -9,6 +12,8 @@ import uuid
 
 router = APIRouter(prefix="/accounts", tags=["accounts"])
 
+account_fields = ("id", "name", "active")
+
 
 @router.post("/", response_model=ReadAccount)
 def create_account(
@@ -30,10 +35,15 @@ def get_accounts(
         user: User = Depends(get_current_active_user),
         offset: int = 0,
         limit: int = Query(default=100, lte=100),
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, account_fields)
     cmd = select(Account).where(Account.user_id == user.id)
-    cmd.offset(offset)
-    cmd.limit(limit)
+    cmd = cmd.order_by(Account.name, Account.id)
+    cmd = cmd.offset(offset)
+    cmd = cmd.limit(limit)
+    if names:
+        return fieldsets.projected_response(session, cmd, Account, names)
     accounts = session.exec(cmd).all()
     return accounts
 
@@ -54,8 +64,13 @@ def get_account(
         *,
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
-        account_id: uuid.UUID):
-    account = session.exec(select(Account).where(Account.id == account_id).where(Account.user_id == user.id)).first()
+        account_id: uuid.UUID,
+        fields: str | None = fieldsets.fields_query):
+    names = fieldsets.parse_fields(fields, account_fields)
+    cmd = select(Account).where(Account.id == account_id).where(Account.user_id == user.id)
+    if names:
+        return fieldsets.projected_detail(session, cmd, Account, names, "Account not found")
+    account = session.exec(cmd).first()
     if account:
         return account
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
@@ -81,3 +96,18 @@ def update_account(
     session.commit()
     session.refresh(account)
     return account
+
+
+@router.get("/{account_id}/balance", response_model=AccountBalance)
+def get_account_balance(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+        as_of: datetime.date | None = Query(default=None),
+):
+    cmd = select(Account).where(Account.id == account_id).where(Account.user_id == user.id)
+    account = session.exec(cmd).first()
+    if not account:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+    return balances.balance_as_of(session, user, account.id, as_of or datetime.date.today())
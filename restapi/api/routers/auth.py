@@ -1,5 +1,6 @@
 from datetime import timedelta, datetime
 import secrets
+import uuid
 from restapi.api import emailduck
 from fastapi import Depends, HTTPException, status
 from fastapi.responses import Response
@@ -8,9 +9,11 @@ from fastapi.routing import APIRouter
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel, Field
-from restapi.api.schemas import User, RefreshToken
+from restapi.api.schemas import User, RefreshToken, UserDirectory
+from sqlalchemy import bindparam, delete
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from restapi.api.database import create_session
+from restapi.api.database import create_session, use_user_shard
 
 
 class Token(BaseModel):
@@ -71,6 +74,15 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 router = APIRouter(tags=["authentication"])
 
+# built once so every authenticated request reuses the compiled lookups
+user_by_username_statement = select(User).where(User.username == bindparam("username"))
+user_by_email_statement = select(User).where(User.email == bindparam("email"))
+user_by_id_statement = select(User).where(User.id == bindparam("user_id"))
+user_by_reset_token_statement = select(User).where(User.reset_token == bindparam("reset_token"))
+refresh_token_statement = select(RefreshToken).where(RefreshToken.token == bindparam("token"))
+directory_by_username_statement = select(UserDirectory).where(UserDirectory.username == bindparam("username"))
+directory_by_email_statement = select(UserDirectory).where(UserDirectory.email == bindparam("email"))
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -80,8 +92,22 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+def locate_user(session: Session, username: str | None = None, email: str | None = None) -> User | None:
+    # route the session to the user's shard through the global directory; users registered before the
+    # directory existed are listed once by the offline backfill (python -m restapi.api.backfill directory)
+    if username is not None:
+        statement, params = directory_by_username_statement, {"username": username}
+    else:
+        statement, params = directory_by_email_statement, {"email": email}
+    entry = session.exec(statement, params=params).first()
+    if not entry:
+        return None
+    use_user_shard(session, entry.user_id)
+    return session.exec(user_by_id_statement, params={"user_id": entry.user_id}).first()
+
+
 def authenticate_user(session: Session, username: str, password: str):
-    user = session.exec(select(User).where(User.username == username)).one()
+    user = locate_user(session, username=username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -89,7 +115,7 @@ def authenticate_user(session: Session, username: str, password: str):
     return user
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(create_session)):
+def get_user_for_token(session: Session, token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -101,14 +127,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         if username is None:
             raise credentials_exception
         # token_data = TokenData(username=username) ?
+        user_id: str | None = payload.get("uid")
     except JWTError:
         raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
+    if user_id:
+        use_user_shard(session, uuid.UUID(user_id))
+        user = session.exec(user_by_username_statement, params={"username": username}).first()
+    else:
+        user = locate_user(session, username=username)
     if user is None:
         raise credentials_exception
     return user
 
 
+async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(create_session)):
+    return get_user_for_token(session, token)
+
+
 async def get_current_active_user(user: User = Depends(get_current_user)):
     if not user.active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
@@ -126,9 +161,9 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def create_refresh_token(user_id: int, expires_delta: timedelta | None = None) -> (str, RefreshToken):
+def create_refresh_token(user_id: uuid.UUID, expires_delta: timedelta | None = None) -> (str, RefreshToken):
     token_secret = secrets.token_urlsafe(32)
-    token_data = {"sub": token_secret}
+    token_data = {"sub": token_secret, "uid": str(user_id)}
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
@@ -141,16 +176,34 @@ def create_refresh_token(user_id: int, expires_delta: timedelta | None = None) -
 
 @router.post("/register", response_model=RegisterResponse)
 def register_account(*, session: Session = Depends(create_session), registration: RegisterUser):
-    username_user = session.exec(select(User).where(User.username == registration.username)).all()
+    username_user = locate_user(session, username=registration.username)
     if username_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username in use")
-    email_user = session.exec(select(User).where(User.email == registration.email)).all()
+    email_user = locate_user(session, email=registration.email)
     if email_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email in use")
     hashed_password = get_password_hash(registration.password)
     user = User(username=registration.username, email=registration.email, hashed_password=hashed_password)
+    use_user_shard(session, user.id)
+    # the shard and the directory are separate databases, so the user is committed first and the directory
+    # entry second; a user without an entry cannot log in, and one that loses the race for its name is removed.
+    # A crash between the two commits leaves the user unlisted: the directory backfill lists it if its name is
+    # still free, and the orphans sweep removes it if another user has taken the name since
+    entry = UserDirectory(user_id=user.id, username=user.username, email=user.email)
     session.add(user)
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username or email in use")
+    session.add(entry)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        session.execute(delete(User.__table__).where(User.__table__.c.id == entry.user_id))
+        session.commit()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username or email in use")
     response = RegisterResponse(success=True)
     return response
 
@@ -165,7 +218,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
+    access_token = create_access_token(data={"sub": user.username, "uid": str(user.id)}, expires_delta=access_token_expires)
     refresh_token_str,  refresh_token = create_refresh_token(user_id=user.id)
     session.add(refresh_token)
     session.commit()
@@ -176,33 +229,40 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 async def refresh_access_token(*, session: Session = Depends(create_session), token_data: RefreshAccessToken):
     payload: dict = jwt.decode(token_data.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
     token: str = payload.get("sub")
-    cmd = select(RefreshToken).where(RefreshToken.token == token)
+    if payload.get("uid"):
+        use_user_shard(session, uuid.UUID(payload["uid"]))
     try:
-        refresh_token = session.exec(cmd).one()
+        refresh_token = session.exec(refresh_token_statement, params={"token": token}).one()
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token invalid")
 
-    cmd = select(User).where(User.id == refresh_token.user_id)
-    user = session.exec(cmd).first()
+    user = session.exec(user_by_id_statement, params={"user_id": refresh_token.user_id}).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token invalid")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
+    access_token = create_access_token(data={"sub": user.username, "uid": str(user.id)}, expires_delta=access_token_expires)
     token_response = AccessToken(access_token=access_token)
     return token_response
 
 
+def reset_token_user_id(token: str) -> uuid.UUID | None:
+    user_id, _, secret = token.partition(".")
+    try:
+        return uuid.UUID(user_id) if secret else None
+    except ValueError:
+        return None
+
+
 @router.post("/send_reset_email")
 def reset_password_email(
         *,
         session: Session = Depends(create_session),
         reset_email: ResetEmail
 ):
-    cmd = select(User).where(User.email == reset_email.email)
-    user = session.exec(cmd).first()
+    user = locate_user(session, email=reset_email.email)
     if not user:
         return Response(status_code=status.HTTP_200_OK)
-    token = secrets.token_urlsafe(32)
+    token = f"{user.id}.{secrets.token_urlsafe(32)}"
     user.reset_token = token
     session.add(user)
     session.commit()
@@ -217,7 +277,13 @@ def reset_password(
         session: Session = Depends(create_session),
         password_reset: ResetPassword,
 ):
-    user = session.exec(select(User).where(User.reset_token == password_reset.token)).first()
+    # the token leads with its user id, so the directory says which shard holds it
+    user = None
+    user_id = reset_token_user_id(password_reset.token)
+    entry = session.get(UserDirectory, user_id) if user_id else None
+    if entry:
+        use_user_shard(session, entry.user_id)
+        user = session.exec(user_by_reset_token_statement, params={"reset_token": password_reset.token}).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
     user.hashed_password = get_password_hash(password_reset.password)
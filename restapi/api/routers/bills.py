@@ -3,6 +3,7 @@ import uuid
 from fastapi.routing import APIRouter
 from sqlmodel import Session, select, col
 from fastapi import Depends, status, HTTPException, Query
+from restapi.api import fieldsets
 from restapi.api.schemas import Bill, User, ReadBill, CreateBill, UpdateBill
 from restapi.api.database import create_session
 from restapi.api.routers.auth import get_current_active_user
@@ -10,6 +11,8 @@ from restapi.api.routers.auth import get_current_active_user
 
 router = APIRouter(prefix="/bills", tags=["bills"])
 
+bill_fields = ("id", "name", "amount", "due_date", "description", "auto", "payment_account", "active")
+
 
 @router.get("/", response_model=list[ReadBill])
 def get_bills(
@@ -20,17 +23,21 @@ def get_bills(
         limit: int = Query(default=100, lte=100),
         name: str | None = Query(default=None),
         active: bool | None = Query(default=None),
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, bill_fields)
     cmd = select(Bill).where(Bill.user_id == user.id)
     if name:
-        cmd.where(col(Bill.name).contains(name))
-    if active:
-        cmd.where(Bill.active == active)
+        cmd = cmd.where(col(Bill.name).contains(name))
+    if active is not None:
+        cmd = cmd.where(Bill.active == active)
     else:
-        cmd.where(Bill.active == True)
+        cmd = cmd.where(Bill.active == True)
+    cmd = cmd.order_by(Bill.due_date, Bill.id)
     cmd = cmd.offset(offset)
     cmd = cmd.limit(limit)
-    cmd = cmd.order_by(Bill.due_date)
+    if names:
+        return fieldsets.projected_response(session, cmd, Bill, names)
     bills = session.exec(cmd).all()
     return bills
 
@@ -54,10 +61,14 @@ def get_bill(
         *,
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
-        bill_id: uuid.UUID
+        bill_id: uuid.UUID,
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, bill_fields)
     cmd = select(Bill).where(Bill.user == user)
     cmd = cmd.where(Bill.id == bill_id)
+    if names:
+        return fieldsets.projected_detail(session, cmd, Bill, names, "Bill not found")
     bill = session.exec(cmd).first()
     if bill:
         return bill
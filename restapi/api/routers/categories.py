@@ -5,12 +5,15 @@ from sqlmodel import Session, select, col
 from restapi.api.database import create_session
 from fastapi import Depends, HTTPException, status, Query
 
+from restapi.api import fieldsets
 from restapi.api.schemas import Category, CreateCategory, ReadCategory, User, UpdateCategory
 from restapi.api.routers.auth import get_current_active_user
 
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
+category_fields = ("id", "name", "active")
+
 
 @router.post("/", response_model=ReadCategory)
 def create_category(
@@ -33,17 +36,22 @@ def get_categories(
         offset: int = 0,
         limit: int = Query(default=100, lte=100),
         active: bool | None = Query(default=None),
-        name: str | None = Query(default=None)
+        name: str | None = Query(default=None),
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, category_fields)
     cmd = select(Category).where(Category.user_id == user.id)
-    cmd.offset(offset)
-    cmd.limit(limit)
-    if active:
-        cmd.where(Category.active == active)
+    if active is not None:
+        cmd = cmd.where(Category.active == active)
     else:
-        cmd.where(Category.active is True)
+        cmd = cmd.where(Category.active == True)
     if name:
-        cmd.where(col(Category.name).contains(name))
+        cmd = cmd.where(col(Category.name).contains(name))
+    cmd = cmd.order_by(Category.name, Category.id)
+    cmd = cmd.offset(offset)
+    cmd = cmd.limit(limit)
+    if names:
+        return fieldsets.projected_response(session, cmd, Category, names)
     categories = session.exec(cmd).all()
     return categories
 
@@ -64,9 +72,13 @@ def get_category(
         *,
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
-        category_id: uuid.UUID
+        category_id: uuid.UUID,
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, category_fields)
     cmd = select(Category).where(Category.user_id == user.id).where(Category.id == category_id)
+    if names:
+        return fieldsets.projected_detail(session, cmd, Category, names, "Category not found")
     category = session.exec(cmd).first()
     if category:
         return category
@@ -0,0 +1,140 @@
+import calendar
+import datetime
+import os
+import uuid
+
+from fastapi.routing import APIRouter
+from sqlalchemy import column, inspect, true, union_all, values
+from sqlmodel import Session, select, col
+from fastapi import Depends, Query
+from restapi.api import balances
+from restapi.api.schemas import Account, Bill, Category, Dashboard, DashboardAccount, DashboardTransaction, \
+    PeriodClose, Transaction, UpcomingBill, User
+from restapi.api.database import create_session
+from restapi.api.routers.auth import get_current_active_user
+
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+# SQLite refuses a compound select of more than 500 branches, so accounts are read in batches below that
+try:
+    recent_branches_per_statement = int(os.environ["recent_branches_per_statement"])
+except KeyError:
+    recent_branches_per_statement = 200
+
+
+def next_due_date(due_day: int, today: datetime.date) -> datetime.date:
+    # bills fall due on a day of the month, moved back to the last day in shorter months
+    year, month = today.year, today.month
+    if due_day < today.day:
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime.date(year, month, min(due_day, calendar.monthrange(year, month)[1]))
+
+
+recent_columns = (
+    Transaction.id,
+    Transaction.memo,
+    Transaction.amount,
+    Transaction.transaction_date,
+    Transaction.transaction_type,
+    Transaction.running_balance,
+    Transaction.ordinal,
+    Transaction.account_id,
+    Transaction.category_id,
+    Transaction.bill_id,
+    Transaction.transfer_id,
+)
+
+
+def newest_for_account(user: User, account_id):
+    # reads only the top of the (account_id, ordinal) index; id settles duplicate ordinals the same way every time
+    statement = select(*recent_columns).where(Transaction.user_id == user.id)
+    statement = statement.where(Transaction.account_id == account_id)
+    return statement.order_by(col(Transaction.ordinal).desc(), col(Transaction.id).asc())
+
+
+def recent_transactions(session: Session, user: User, account_ids: list[uuid.UUID], recent: int):
+    # the newest rows of every account in as few statements as the dialect allows; the first row carries the balance
+    if session.get_bind(inspect(Transaction)).dialect.name == "postgresql":
+        accounts = values(column("id", Account.__table__.c.id.type), name="accounts").data(
+            [(account_id,) for account_id in account_ids]
+        )
+        newest = newest_for_account(user, accounts.c.id).limit(recent).lateral("newest")
+        statements = [(newest, select(newest).select_from(accounts.join(newest, true())))]
+    else:
+        # no LATERAL, so one limited branch per account, and one statement per batch of branches
+        statements = []
+        for start in range(0, len(account_ids), recent_branches_per_statement):
+            branches = [
+                newest_for_account(user, account_id).limit(recent).subquery()
+                for account_id in account_ids[start:start + recent_branches_per_statement]
+            ]
+            newest = union_all(*[select(branch) for branch in branches]).subquery("newest")
+            statements.append((newest, select(newest)))
+    by_account: dict[uuid.UUID, list] = {}
+    for newest, statement in statements:
+        statement = statement.order_by(newest.c.account_id, newest.c.ordinal.desc(), newest.c.id.asc())
+        for row in session.execute(statement):
+            by_account.setdefault(row.account_id, []).append(row)
+    return by_account
+
+
+def closing_balances(session: Session, account_ids: list[uuid.UUID]) -> dict[uuid.UUID, float]:
+    # accounts whose whole history is archived continue from their latest close
+    statement = select(PeriodClose).where(col(PeriodClose.account_id).in_(account_ids))
+    statement = statement.order_by(col(PeriodClose.year).asc())
+    return {close.account_id: close.running_balance for close in session.exec(statement).all()}
+
+
+def upcoming_bills(session: Session, user: User, days: int) -> list[UpcomingBill]:
+    today = datetime.date.today()
+    horizon = today + datetime.timedelta(days=days)
+    statement = select(Bill).where(Bill.user_id == user.id).where(Bill.active == True)
+    upcoming = []
+    for bill in session.exec(statement).all():
+        due = next_due_date(bill.due_date, today)
+        if due <= horizon:
+            upcoming.append(UpcomingBill(**bill.dict(), next_due_date=due))
+    upcoming.sort(key=lambda bill: (bill.next_due_date, bill.name))
+    return upcoming
+
+
+@router.get("/", response_model=Dashboard)
+def get_dashboard(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        recent: int = Query(default=5, ge=1, le=50, description="Most recent transactions returned per account"),
+        bill_days: int = Query(default=31, ge=0, le=366, description="How far ahead to list bills falling due"),
+):
+    cmd = select(Account).where(Account.user_id == user.id).where(Account.active == True)
+    accounts = session.exec(cmd.order_by(Account.name, Account.id)).all()
+    account_ids = [account.id for account in accounts]
+
+    transactions = recent_transactions(session, user, account_ids, recent) if account_ids else {}
+    archived_only = [account_id for account_id in account_ids if account_id not in transactions]
+    closes = closing_balances(session, archived_only) if archived_only else {}
+    watermarks = balances.dirty_watermarks(session, user) if balances.deferred_balances else {}
+
+    dashboard_accounts = []
+    for account in accounts:
+        rows = transactions.get(account.id, [])
+        watermark = watermarks.get(account.id)
+        dashboard_accounts.append(DashboardAccount(
+            id=account.id,
+            name=account.name,
+            balance=rows[0].running_balance if rows else closes.get(account.id, 0.0),
+            stale=watermark is not None,
+            recent_transactions=[
+                DashboardTransaction(**row._mapping, stale=watermark is not None and row.ordinal >= watermark)
+                for row in rows
+            ],
+        ))
+
+    cmd = select(Category).where(Category.user_id == user.id).where(Category.active == True)
+    categories = session.exec(cmd.order_by(Category.name, Category.id)).all()
+    return Dashboard(
+        accounts=dashboard_accounts,
+        categories=categories,
+        upcoming_bills=upcoming_bills(session, user, bill_days),
+    )
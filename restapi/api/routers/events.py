@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+import uuid
+
+from fastapi.routing import APIRouter
+from fastapi import Depends, Request, Query, Cookie, HTTPException, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from restapi.api import events
+from restapi.api.database import ShardSession
+from restapi.api.routers.auth import get_user_for_token
+
+try:
+    keepalive_interval = float(os.environ["event_keepalive_interval"])
+except KeyError:
+    keepalive_interval = 15.0
+
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# a browser EventSource cannot set an Authorization header, so the stream also takes the token as
+# an access_token query parameter or cookie; the header still wins when a client can send it
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+
+def stream_token(
+        header_token: str | None = Depends(optional_oauth2_scheme),
+        query_token: str | None = Query(default=None, alias="access_token"),
+        cookie_token: str | None = Cookie(default=None, alias="access_token"),
+) -> str:
+    token = header_token or query_token or cookie_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return token
+
+
+async def stream_events(request: Request, user_id: uuid.UUID):
+    queue = events.broker.subscribe(user_id)
+    try:
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            try:
+                ledger_event = await asyncio.wait_for(queue.get(), timeout=keepalive_interval)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {ledger_event['type']}\ndata: {json.dumps(ledger_event)}\n\n"
+    finally:
+        events.broker.unsubscribe(user_id, queue)
+
+
+@router.get("/", response_class=StreamingResponse)
+def get_events(request: Request, token: str = Depends(stream_token)):
+    # authenticate with a short-lived session so an open stream does not pin a pooled connection
+    with ShardSession() as session:
+        user = get_user_for_token(session, token)
+        user_id = user.id
+    return StreamingResponse(
+        stream_events(request, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
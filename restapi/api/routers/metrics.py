@@ -0,0 +1,15 @@
+from fastapi.routing import APIRouter
+from restapi.api.admission import admission_stats
+from restapi.api.database import statement_cache_stats, pool_stats
+
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/")
+def get_metrics():
+    return {
+        "statement_cache": statement_cache_stats(),
+        "pool": pool_stats(),
+        "admission": admission_stats(),
+    }
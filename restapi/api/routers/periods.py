@@ -0,0 +1,85 @@
+import datetime
+import uuid
+
+from fastapi.routing import APIRouter
+from sqlmodel import Session, select, col
+from fastapi import Depends, HTTPException, status, Query
+from restapi.api import balances, periods
+from restapi.api.schemas import Account, ArchivedTransaction, ClosePeriod, PeriodClose, ReadArchivedTransaction, \
+    ReadPeriodClose, User
+from restapi.api.database import create_session
+from restapi.api.routers.auth import get_current_active_user
+
+
+router = APIRouter(prefix="/accounts/{account_id}", tags=["periods"])
+
+
+def get_user_account(session: Session, user: User, account_id: uuid.UUID) -> Account:
+    cmd = select(Account).where(Account.user_id == user.id)
+    cmd = cmd.where(Account.id == account_id)
+    account = session.exec(cmd).first()
+    if not account:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+    return account
+
+
+@router.get("/closings", response_model=list[ReadPeriodClose])
+def get_closings(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+):
+    cmd = select(PeriodClose).where(PeriodClose.user_id == user.id)
+    cmd = cmd.where(PeriodClose.account_id == account_id)
+    cmd = cmd.order_by(col(PeriodClose.year).asc())
+    return session.exec(cmd).all()
+
+
+@router.post("/close", response_model=ReadPeriodClose)
+def close_period(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+        close: ClosePeriod,
+):
+    account = get_user_account(session, user, account_id)
+    # the checkpoint must be taken from settled running balances
+    balances.settle_account(session, account.id)
+    return periods.close_period(session, user, account.id, close.year)
+
+
+@router.post("/reopen", response_model=ReadPeriodClose)
+def reopen_period(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+        close: ClosePeriod,
+):
+    account = get_user_account(session, user, account_id)
+    return periods.reopen_period(session, account.id, close.year)
+
+
+@router.get("/archive", response_model=list[ReadArchivedTransaction])
+def get_archived_transactions(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+        start_date: datetime.date | None = Query(default=None),
+        end_date: datetime.date | None = Query(default=None),
+        offset: int = 0,
+        limit: int = Query(default=100, lte=100),
+):
+    cmd = select(ArchivedTransaction).where(ArchivedTransaction.user_id == user.id)
+    cmd = cmd.where(ArchivedTransaction.account_id == account_id)
+    if start_date is not None:
+        cmd = cmd.where(ArchivedTransaction.transaction_date >= start_date)
+    if end_date is not None:
+        cmd = cmd.where(ArchivedTransaction.transaction_date <= end_date)
+    cmd = cmd.order_by(col(ArchivedTransaction.ordinal).desc(), col(ArchivedTransaction.id).asc())
+    cmd = cmd.offset(offset)
+    cmd = cmd.limit(limit)
+    return session.exec(cmd).all()
@@ -0,0 +1,32 @@
+import uuid
+
+from fastapi.routing import APIRouter
+from sqlmodel import Session
+from fastapi import Depends, HTTPException, status, Query
+from restapi.api import periods, reconcile
+from restapi.api.schemas import Statement, StatementReconciliation, User
+from restapi.api.database import create_session
+from restapi.api.routers.auth import get_current_active_user
+from restapi.api.routers.periods import get_user_account
+
+
+router = APIRouter(prefix="/accounts/{account_id}", tags=["reconciliation"])
+
+
+@router.post("/reconcile", response_model=StatementReconciliation)
+def reconcile_statement(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID,
+        statement: Statement,
+        mark: bool = Query(default=True, description="Flag matched transactions as reconciled"),
+):
+    if statement.end_date < statement.start_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Statement ends before it starts")
+    account = get_user_account(session, user, account_id)
+    if mark:
+        # only marking writes; a dry run may compare against a closed year
+        for statement_date in (statement.start_date, statement.end_date):
+            periods.ensure_period_open(session, account.id, statement_date)
+    return reconcile.reconcile_statement(session, user, account.id, statement, mark=mark)
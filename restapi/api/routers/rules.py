@@ -0,0 +1,95 @@
+import datetime
+import uuid
+
+from fastapi.routing import APIRouter
+from sqlmodel import Session, select, col
+from fastapi import Depends, status, HTTPException, Query
+from restapi.api import categorize
+from restapi.api.schemas import Category, CategoryRule, CreateCategoryRule, ReadCategoryRule, UpdateCategoryRule, \
+    RecategorizeResult, Transaction, TransactionFilters, User
+from restapi.api.database import create_session
+from restapi.api.routers.auth import get_current_active_user
+from restapi.api.routers.transactions import transaction_filters, filter_transactions_statement
+
+
+router = APIRouter(prefix="/rules", tags=["rules"])
+
+
+def ensure_user_category(session: Session, user: User, category_id: uuid.UUID):
+    cmd = select(Category.id).where(Category.user_id == user.id).where(Category.id == category_id)
+    if session.exec(cmd).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+
+
+@router.post("/", response_model=ReadCategoryRule)
+def create_rule(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        rule: CreateCategoryRule,
+):
+    ensure_user_category(session, user, rule.category_id)
+    db_rule = CategoryRule.from_orm(rule, update={"user_id": user.id, "updated_date": datetime.datetime.utcnow()})
+    session.add(db_rule)
+    session.commit()
+    session.refresh(db_rule)
+    return db_rule
+
+
+@router.get("/", response_model=list[ReadCategoryRule])
+def get_rules(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        offset: int = 0,
+        limit: int = Query(default=100, lte=100),
+        active: bool | None = Query(default=None),
+):
+    cmd = select(CategoryRule).where(CategoryRule.user_id == user.id)
+    if active is not None:
+        cmd = cmd.where(CategoryRule.active == active)
+    cmd = cmd.order_by(col(CategoryRule.priority).desc(), col(CategoryRule.id).asc())
+    cmd = cmd.offset(offset)
+    cmd = cmd.limit(limit)
+    return session.exec(cmd).all()
+
+
+@router.patch("/{rule_id}", response_model=ReadCategoryRule)
+def update_rule(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        rule_id: uuid.UUID,
+        rule_update: UpdateCategoryRule,
+):
+    cmd = select(CategoryRule).where(CategoryRule.user_id == user.id).where(CategoryRule.id == rule_id)
+    rule = session.exec(cmd).first()
+    if not rule:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rule not found")
+    update_dict = rule_update.dict(exclude_unset=True)
+    if update_dict.get("category_id") is not None:
+        ensure_user_category(session, user, update_dict["category_id"])
+    for key, value in update_dict.items():
+        setattr(rule, key, value)
+    # the new updated_date is what tells every worker to recompile this user's matcher
+    rule.updated_date = datetime.datetime.utcnow()
+    session.add(rule)
+    session.commit()
+    session.refresh(rule)
+    return rule
+
+
+@router.post("/recategorize", response_model=RecategorizeResult)
+def recategorize_transactions(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        account_id: uuid.UUID | None = Query(default=None),
+        filters: TransactionFilters = Depends(transaction_filters),
+):
+    cmd = select(Transaction).where(Transaction.user_id == user.id)
+    if account_id is not None:
+        cmd = cmd.where(Transaction.account_id == account_id)
+    cmd = filter_transactions_statement(cmd, filters)
+    scanned, matched, updated = categorize.recategorize(session, user, cmd)
+    return RecategorizeResult(scanned=scanned, matched=matched, updated=updated)
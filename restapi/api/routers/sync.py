@@ -0,0 +1,21 @@
+from fastapi.routing import APIRouter
+from sqlmodel import Session
+from fastapi import Depends, Query
+from restapi.api.changes import changes_since
+from restapi.api.schemas import User, SyncChanges
+from restapi.api.database import create_session
+from restapi.api.routers.auth import get_current_active_user
+
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get("/", response_model=SyncChanges)
+def get_changes(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        since: int = Query(default=0, ge=0),
+        limit: int = Query(default=1000, gt=0, lte=5000),
+):
+    return changes_since(session, user, since, limit)
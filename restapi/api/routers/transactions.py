@@ -3,12 +3,16 @@ import uuid
 
 from fastapi.routing import APIRouter
 from sqlmodel import Session, select, func, col
-from fastapi import Depends, HTTPException, status, Query
+from fastapi import Depends, HTTPException, status, Query, Response
 from sqlmodel.sql.expression import Select, SelectOfScalar
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
+from restapi.api import balances, categorize, fieldsets, periods
 from restapi.api.database import create_session
 from restapi.api.schemas import Transaction, CreateTransaction, ReadTransaction, CreateAccountTransaction, Account, User, \
-    UpdateTransaction
+    UpdateTransaction, TransactionFilters, TransactionType
 from restapi.api.routers.auth import get_current_active_user
 
 accounts_router = APIRouter(
@@ -23,66 +27,267 @@ transactions_router = APIRouter(
 
 router = APIRouter()
 
+transaction_fields = (
+    "id", "memo", "amount", "transaction_date", "transaction_type", "description", "transaction_token",
+    "running_balance", "ordinal", "active", "account_id", "category_id", "bill_id", "created_date", "updated_date",
+    "transfer_id", "reconciled",
+)
+
+# hot statements are built once with bound parameters so each request reuses the same
+# construct and its compiled form from the engine's statement cache
+transaction_count_statement = (
+    select(func.count(Transaction.id))
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.account_id == bindparam("account_id"))
+)
+
+previous_transaction_statement = (
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.account_id == bindparam("account_id"))
+    .where(Transaction.transaction_date <= bindparam("transaction_date"))
+    .where(Transaction.id != bindparam("transaction_id"))
+    .order_by(col(Transaction.ordinal).desc())
+    .limit(1)
+)
+
+last_transaction_before_statement = (
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.account_id == bindparam("account_id"))
+    .where(Transaction.ordinal < bindparam("ordinal"))
+    .where(Transaction.id != bindparam("transaction_id"))
+    .order_by(col(Transaction.ordinal).desc())
+    .limit(1)
+)
+
+future_transactions_statement = (
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.account_id == bindparam("account_id"))
+    .where(Transaction.ordinal >= bindparam("ordinal"))
+    .where(Transaction.id != bindparam("transaction_id"))
+    .order_by(col(Transaction.ordinal).asc(), col(Transaction.id).asc())
+)
+
+transaction_by_token_statement = (
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.account_id == bindparam("account_id"))
+    .where(Transaction.transaction_token == bindparam("transaction_token"))
+)
+
+user_transaction_statement = (
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.id == bindparam("transaction_id"))
+)
+
+user_account_statement = (
+    select(Account)
+    .where(Account.user_id == bindparam("user_id"))
+    .where(Account.id == bindparam("account_id"))
+)
+
+
+def load_transaction_relationships(statement: Select | SelectOfScalar):
+    return statement.options(
+        selectinload(Transaction.account),
+        selectinload(Transaction.category),
+        selectinload(Transaction.bill),
+    )
+
 
 def sort_transactions_statement(statement: Select | SelectOfScalar):
     statement = statement.order_by(col(Transaction.transaction_date).asc())
     statement = statement.order_by(col(Transaction.amount).asc())
     statement = statement.order_by(col(Transaction.running_balance).desc())
+    statement = statement.order_by(col(Transaction.id).asc())
+    return statement
+
+
+def transaction_filters(
+        start_date: datetime.date | None = Query(default=None),
+        end_date: datetime.date | None = Query(default=None),
+        category_id: uuid.UUID | None = Query(default=None),
+        bill_id: uuid.UUID | None = Query(default=None),
+        transaction_type: TransactionType | None = Query(default=None),
+        min_amount: float | None = Query(default=None),
+        max_amount: float | None = Query(default=None),
+        active: bool | None = Query(default=None),
+) -> TransactionFilters:
+    return TransactionFilters(
+        start_date=start_date,
+        end_date=end_date,
+        category_id=category_id,
+        bill_id=bill_id,
+        transaction_type=transaction_type,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        active=active,
+    )
+
+
+def filter_transactions_statement(statement: Select | SelectOfScalar, filters: TransactionFilters):
+    if filters.start_date is not None:
+        statement = statement.where(Transaction.transaction_date >= filters.start_date)
+    if filters.end_date is not None:
+        statement = statement.where(Transaction.transaction_date <= filters.end_date)
+    if filters.category_id is not None:
+        statement = statement.where(Transaction.category_id == filters.category_id)
+    if filters.bill_id is not None:
+        statement = statement.where(Transaction.bill_id == filters.bill_id)
+    if filters.transaction_type is not None:
+        statement = statement.where(Transaction.transaction_type == filters.transaction_type)
+    if filters.min_amount is not None:
+        statement = statement.where(Transaction.amount >= filters.min_amount)
+    if filters.max_amount is not None:
+        statement = statement.where(Transaction.amount <= filters.max_amount)
+    if filters.active is not None:
+        statement = statement.where(Transaction.active == filters.active)
     return statement
 
 
+def count_transactions(session: Session, statement: Select | SelectOfScalar) -> int:
+    statement = statement.with_only_columns(func.count(Transaction.id)).order_by(None)
+    return session.exec(statement).one()
+
+
 def transaction_count_for_account(session: Session, user: User, transaction: Transaction):
-    statement = select(func.count(Transaction.id))
-    statement = statement.where(Transaction.user_id == user.id)
-    statement = statement.where(Transaction.account_id == transaction.account_id)
-    transactions_for_account = session.exec(statement).one()
+    params = {"user_id": user.id, "account_id": transaction.account_id}
+    transactions_for_account = session.exec(transaction_count_statement, params=params).one()
     return transactions_for_account
 
 
 def get_previous_transaction(session: Session, user: User, transaction: Transaction):
-    statement = select(Transaction)
-    statement = statement.where(Transaction.user_id == user.id)
-    statement = statement.where(Transaction.account_id == transaction.account_id)
-    statement = statement.where(Transaction.transaction_date <= transaction.transaction_date)
-    statement = statement.where(Transaction.id != transaction.id)
-    statement = statement.order_by(col(Transaction.ordinal).desc())
-    transactions = session.exec(statement).all()
-    if len(transactions) > 0:
-        return transactions[0]
+    params = {
+        "user_id": user.id,
+        "account_id": transaction.account_id,
+        "transaction_date": transaction.transaction_date,
+        "transaction_id": transaction.id,
+    }
+    return session.exec(previous_transaction_statement, params=params).first()
+
+
+def place_transaction(session: Session, user: User, transaction: Transaction) -> bool:
+    # sets the ordinal and running balance a new transaction slots in at; True when it is the account's first
+    transactions_for_account = transaction_count_for_account(session, user, transaction)
+    opening_ordinal, opening_balance = periods.opening_balance(session, transaction.account_id)
+    # are there any transactions for this day?
+    previous_transaction = get_previous_transaction(session, user, transaction) if transactions_for_account else None
+    if previous_transaction:
+        transaction.ordinal = previous_transaction.ordinal + 1
+        transaction.running_balance = previous_transaction.running_balance + transaction.amount
     else:
-        return None
+        transaction.ordinal = opening_ordinal + 1
+        transaction.running_balance = opening_balance + transaction.amount
+    return transactions_for_account == 0
 
 
-def update_future_transactions(session: Session, user: User, transaction: Transaction, previous_ordinal: int | None = None):
-    if previous_ordinal:
-        if transaction.ordinal > previous_ordinal:
-            ordinal = previous_ordinal
-            statement = select(Transaction)
-            statement = statement.where(Transaction.user_id == user.id)
-            statement = statement.where(Transaction.account_id == transaction.account_id)
-            statement = statement.where(Transaction.ordinal < ordinal)
-            statement = statement.order_by(col(Transaction.ordinal).asc())
-            transaction = session.exec(statement).first()
-
-    statement = select(Transaction)
-    statement = statement.where(Transaction.user_id == user.id)
-    statement = statement.where(Transaction.account_id == transaction.account_id)
-    # statement = statement.where(Transaction.transaction_date > transaction.transaction_date)
-    statement = statement.where(Transaction.ordinal > transaction.ordinal)
-    statement = statement.order_by(col(Transaction.ordinal).asc())
-    transactions = session.exec(statement).all()
-
-    previous_transaction = None
+def recompute_future_transactions(
+        session: Session,
+        user: User,
+        transaction: Transaction,
+        previous_ordinal: int | None = None,
+):
+    # renumbers everything from the lowest ordinal the transaction entered or left; the caller commits
+    placed_ordinal = transaction.ordinal
+    from_ordinal = placed_ordinal if previous_ordinal is None else min(previous_ordinal, placed_ordinal)
+    params = {
+        "user_id": user.id,
+        "account_id": transaction.account_id,
+        "ordinal": from_ordinal,
+        "transaction_id": transaction.id,
+    }
+    anchor = session.exec(last_transaction_before_statement, params=params).first()
+    tail = session.exec(future_transactions_statement, params=params).all()
+
+    # the other rows keep their order; the transaction goes ahead of the one that held its slot
+    position = next((i for i, row in enumerate(tail) if row.ordinal >= placed_ordinal), len(tail))
+    transactions = [*tail[:position], transaction, *tail[position:]]
+
+    if anchor:
+        ordinal, running_balance = anchor.ordinal, anchor.running_balance
+    else:
+        ordinal, running_balance = periods.opening_balance(session, transaction.account_id)
     for future_transaction in transactions:
-        if previous_transaction is None:
-            future_transaction.ordinal = transaction.ordinal + 1
-            future_transaction.running_balance = transaction.running_balance + future_transaction.amount
-        else:
-            future_transaction.ordinal = previous_transaction.ordinal + 1
-            future_transaction.running_balance = previous_transaction.running_balance + future_transaction.amount
-        session.add(future_transaction)
-        previous_transaction = future_transaction
-    session.commit()
+        ordinal += 1
+        running_balance += future_transaction.amount
+        if future_transaction.ordinal != ordinal or future_transaction.running_balance != running_balance:
+            future_transaction.ordinal = ordinal
+            future_transaction.running_balance = running_balance
+            session.add(future_transaction)
+    balances.record_checkpoints(session, transaction.account_id, from_ordinal, transactions)
+
+
+def get_transaction_by_token(session: Session, user: User, transaction: Transaction | CreateTransaction):
+    if not transaction.transaction_token:
+        return None
+    params = {
+        "user_id": user.id,
+        "account_id": transaction.account_id,
+        "transaction_token": transaction.transaction_token,
+    }
+    return session.exec(transaction_by_token_statement, params=params).first()
+
+
+def write_transaction(session: Session, user: User, transaction: Transaction, first_for_account: bool):
+    # the row and its tail rewrite or watermark are flushed together; the caller commits them as one
+    session.add(transaction)
+    session.flush()
+    if first_for_account:
+        # nothing after it to move
+        balances.record_checkpoints(session, transaction.account_id, transaction.ordinal, [transaction])
+    elif balances.deferred_balances:
+        balances.mark_dirty(session, transaction, transaction.ordinal)
+    else:
+        recompute_future_transactions(session, user, transaction)
+
+
+def save_new_transaction(session: Session, user: User, transaction: Transaction, first_for_account: bool):
+    try:
+        write_transaction(session, user, transaction, first_for_account)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        existing_transaction = get_transaction_by_token(session, user, transaction)
+        if existing_transaction is None:
+            raise
+        return existing_transaction
+    session.refresh(transaction)
+    return transaction
+
+
+def projected_transaction_rows(
+        session: Session,
+        user: User,
+        statement: Select | SelectOfScalar,
+        names: list[str],
+        params: dict | None = None,
+) -> list[dict]:
+    if not (balances.deferred_balances and "running_balance" in names):
+        return fieldsets.projected_rows(session, statement, Transaction, names, params)
+    # stale qualifies a projected running balance, and needs each row's account and ordinal whether asked for or not
+    selected = list(dict.fromkeys([*names, "account_id", "ordinal"]))
+    rows = fieldsets.projected_rows(session, statement, Transaction, selected, params)
+    watermarks = balances.dirty_watermarks(session, user)
+    return [
+        {**{name: row[name] for name in names}, "stale": balances.is_stale(watermarks, row["account_id"], row["ordinal"])}
+        for row in rows
+    ]
+
+
+def project_transactions(
+        session: Session,
+        user: User,
+        statement: Select | SelectOfScalar,
+        names: list[str],
+        response: Response,
+):
+    projected = fieldsets.rows_response(projected_transaction_rows(session, user, statement, names))
+    if "X-Total-Count" in response.headers:
+        projected.headers["X-Total-Count"] = response.headers["X-Total-Count"]
+    return projected
 
 
 @transactions_router.post("/", response_model=ReadTransaction)
@@ -92,6 +297,14 @@ def create_transaction(
         user: User = Depends(get_current_active_user),
         transaction: CreateTransaction,
 ):
+    # retried imports are answered from the token index without touching running balances
+    existing_transaction = get_transaction_by_token(session, user, transaction)
+    if existing_transaction:
+        return existing_transaction
+    if transaction.category_id is None:
+        transaction.category_id = categorize.categorize(session, user, transaction)
+        if transaction.category_id is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No category given and no rule matched")
     update_fields = {
         "user_id": user.id,
         "created_date": datetime.datetime.utcnow(),
@@ -100,41 +313,14 @@ def create_transaction(
         "running_balance": transaction.amount,
     }
     transaction = Transaction.from_orm(transaction, update=update_fields)
-    # are there any transactions for this account?
-    transactions_for_account = transaction_count_for_account(session, user, transaction)
-
-    if transactions_for_account == 0:
-        # this is the first transaction for the account
-        # just push it in
-        transaction.ordinal = 1
-        transaction.running_balance = transaction.amount
-
-        session.add(transaction)
-        session.commit()
-        session.refresh(transaction)
-
-        return transaction
-    # are there any transactions for this day?
-    previous_transaction = get_previous_transaction(session, user, transaction)
-    if previous_transaction:
-        transaction.ordinal = previous_transaction.ordinal + 1,
-        transaction.running_balance = previous_transaction.running_balance + transaction.amount
+    periods.ensure_period_open(session, transaction.account_id, transaction.transaction_date)
+    first_for_account = place_transaction(session, user, transaction)
 
-        session.add(transaction)
-        session.commit()
-        session.refresh(transaction)
-    else:
-        transaction.ordinal = 1
-        transaction.running_balance = transaction.amount
-
-        session.add(transaction)
-        session.commit()
-        session.refresh(transaction)
-
-    # future days?
-    update_future_transactions(session, user, transaction)
-
-    return transaction
+    saved_transaction = save_new_transaction(session, user, transaction, first_for_account)
+    if saved_transaction is not transaction:
+        # a concurrent retry inserted it first and already updated the tail
+        return saved_transaction
+    return balances.flag_stale(session, user, [transaction])[0]
 
 
 @transactions_router.get("/{transaction_id}", response_model=ReadTransaction)
@@ -142,13 +328,19 @@ def get_transaction(
         *,
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
-        transaction_id: uuid.UUID
+        transaction_id: uuid.UUID,
+        fields: str | None = fieldsets.fields_query,
 ):
-    cmd = select(Transaction).where(Transaction.id == transaction_id)
-    cmd = cmd.where(Transaction.user_id == user.id)
-    transaction = session.exec(cmd).first()
+    names = fieldsets.parse_fields(fields, transaction_fields)
+    params = {"user_id": user.id, "transaction_id": transaction_id}
+    if names:
+        rows = projected_transaction_rows(session, user, user_transaction_statement.limit(1), names, params)
+        if not rows:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+        return fieldsets.rows_response(rows[0])
+    transaction = session.exec(user_transaction_statement, params=params).first()
     if transaction:
-        return transaction
+        return balances.flag_stale(session, user, [transaction])[0]
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
 
 
@@ -160,39 +352,42 @@ def update_transaction(
         transaction_id: uuid.UUID,
         transaction_update: UpdateTransaction,
 ):
-    cmd = select(Transaction).where(Transaction.user == user)
-    cmd = cmd.where(Transaction.id == transaction_id)
-    transaction = session.exec(cmd).first()
+    params = {"user_id": user.id, "transaction_id": transaction_id}
+    transaction = session.exec(user_transaction_statement, params=params).first()
     if not transaction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
     previous_ordinal = transaction.ordinal
     update_dict = transaction_update.dict(exclude_unset=True)
+    if update_dict.get("transaction_date") is not None:
+        periods.ensure_period_open(session, transaction.account_id, update_dict["transaction_date"])
+    elif "transaction_date" in update_dict or "amount" in update_dict:
+        # the tail rewrite below must not interleave with a close archiving that tail
+        periods.lock_account(session, transaction.account_id)
     for key, value in update_dict.items():
         setattr(transaction, key, value)
     if "transaction_date" in update_dict.keys() or "amount" in update_dict.keys():
         previous_transaction = get_previous_transaction(session, user, transaction)
         if previous_transaction:
-            transaction.ordinal = previous_transaction.ordinal + 1,
+            transaction.ordinal = previous_transaction.ordinal + 1
             transaction.running_balance = previous_transaction.running_balance + transaction.amount
-
-            session.add(transaction)
-            session.commit()
-            session.refresh(transaction)
         else:
-            transaction.ordinal = 1
-            transaction.running_balance = transaction.amount
-
-            session.add(transaction)
-            session.commit()
-            session.refresh(transaction)
-
-        # future days?
-        update_future_transactions(session, user, transaction, previous_ordinal)
-    else:
+            opening_ordinal, opening_balance = periods.opening_balance(session, transaction.account_id)
+            transaction.ordinal = opening_ordinal + 1
+            transaction.running_balance = opening_balance + transaction.amount
         session.add(transaction)
+
+        # future days? the row goes out in the same commit as its tail rewrite or watermark
+        if balances.deferred_balances:
+            balances.mark_dirty(session, transaction, min(previous_ordinal, transaction.ordinal))
+        else:
+            recompute_future_transactions(session, user, transaction, previous_ordinal)
         session.commit()
         session.refresh(transaction)
+        return balances.flag_stale(session, user, [transaction])[0]
 
+    session.add(transaction)
+    session.commit()
+    session.refresh(transaction)
     return transaction
 
 
@@ -201,16 +396,27 @@ def get_transactions(
         *,
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
+        response: Response,
         offset: int = 0,
         limit: int = Query(default=100, lte=100),
+        filters: TransactionFilters = Depends(transaction_filters),
+        count: bool = Query(default=False),
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, transaction_fields)
     cmd = select(Transaction)
     cmd = cmd.where(Transaction.user_id == user.id)
+    cmd = filter_transactions_statement(cmd, filters)
+    if count:
+        response.headers["X-Total-Count"] = str(count_transactions(session, cmd))
     cmd = sort_transactions_statement(cmd)
     cmd = cmd.offset(offset)
     cmd = cmd.limit(limit)
+    if names:
+        return project_transactions(session, user, cmd, names, response)
+    cmd = load_transaction_relationships(cmd)
     transactions = session.exec(cmd).all()
-    return transactions
+    return balances.flag_stale(session, user, transactions)
 
 
 @accounts_router.post(
@@ -224,9 +430,8 @@ def create_transaction_for_account(
         account_id: uuid.UUID,
         transaction: CreateAccountTransaction
 ):
-    cmd = select(Account).where(Account.user == user)
-    cmd = cmd.where(Account.id == account_id)
-    account = session.exec(cmd).first()
+    params = {"user_id": user.id, "account_id": account_id}
+    account = session.exec(user_account_statement, params=params).first()
     if not account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
     transaction = CreateTransaction(**transaction.dict(), account_id=account.id)
@@ -243,16 +448,30 @@ def get_transactions_for_account(
         session: Session = Depends(create_session),
         user: User = Depends(get_current_active_user),
         account_id: uuid.UUID,
+        response: Response,
         offset: int = 0,
-        limit: int = Query(default=100, lte=100)
+        limit: int = Query(default=100, lte=100),
+        settle: bool = Query(default=False),
+        filters: TransactionFilters = Depends(transaction_filters),
+        count: bool = Query(default=False),
+        fields: str | None = fieldsets.fields_query,
 ):
+    names = fieldsets.parse_fields(fields, transaction_fields)
+    if settle and account_id in balances.dirty_watermarks(session, user):
+        balances.settle_account(session, account_id)
     cmd = select(Transaction).where(Transaction.user_id == user.id)
     cmd = cmd.where(Transaction.account_id == account_id)
-    cmd = cmd.order_by(col(Transaction.ordinal).desc())
+    cmd = filter_transactions_statement(cmd, filters)
+    if count:
+        response.headers["X-Total-Count"] = str(count_transactions(session, cmd))
+    cmd = cmd.order_by(col(Transaction.ordinal).desc(), col(Transaction.id).asc())
     cmd = cmd.offset(offset)
     cmd = cmd.limit(limit)
+    if names:
+        return project_transactions(session, user, cmd, names, response)
+    cmd = load_transaction_relationships(cmd)
     transactions = session.exec(cmd).all()
-    return transactions
+    return balances.flag_stale(session, user, transactions)
 
 
 router.include_router(accounts_router)
@@ -0,0 +1,125 @@
+import datetime
+import uuid
+
+from fastapi.routing import APIRouter
+from sqlmodel import Session, select, col
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from restapi.api import balances, periods
+from restapi.api.database import create_session
+from restapi.api.schemas import Account, Transaction, TransactionType, User, CreateTransfer, ReadTransfer
+from restapi.api.routers import transactions
+from restapi.api.routers.auth import get_current_active_user
+
+router = APIRouter(prefix="/transfers", tags=["transfers"])
+
+# every transfer locks its two accounts in id order, so opposite transfers between the same accounts cannot deadlock
+transfer_accounts_statement = (
+    select(Account)
+    .where(Account.user_id == bindparam("user_id"))
+    .where(col(Account.id).in_(bindparam("account_ids", expanding=True)))
+    .order_by(col(Account.id).asc())
+    .with_for_update()
+)
+
+# the withdrawal is the negative leg, so it sorts first
+transfer_legs_statement = transactions.load_transaction_relationships(
+    select(Transaction)
+    .where(Transaction.user_id == bindparam("user_id"))
+    .where(Transaction.transfer_id == bindparam("transfer_id"))
+    .order_by(col(Transaction.amount).asc())
+)
+
+
+def read_transfer(session: Session, user: User, transfer_id: uuid.UUID) -> ReadTransfer | None:
+    legs = session.exec(transfer_legs_statement, params={"user_id": user.id, "transfer_id": transfer_id}).all()
+    if len(legs) != 2:
+        return None
+    withdrawal, deposit = balances.flag_stale(session, user, legs)
+    return ReadTransfer(transfer_id=transfer_id, withdrawal=withdrawal, deposit=deposit)
+
+
+def existing_transfer(session: Session, user: User, transfer: CreateTransfer) -> ReadTransfer | None:
+    # a retried transfer is answered from its withdrawal's token
+    if not transfer.transaction_token:
+        return None
+    params = {
+        "user_id": user.id,
+        "account_id": transfer.from_account_id,
+        "transaction_token": transfer.transaction_token,
+    }
+    existing_transaction = session.exec(transactions.transaction_by_token_statement, params=params).first()
+    if existing_transaction is None or existing_transaction.transfer_id is None:
+        return None
+    return read_transfer(session, user, existing_transaction.transfer_id)
+
+
+@router.post("/", response_model=ReadTransfer)
+def create_transfer(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        transfer: CreateTransfer,
+):
+    if transfer.from_account_id == transfer.to_account_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transfer needs two different accounts")
+    replayed_transfer = existing_transfer(session, user, transfer)
+    if replayed_transfer:
+        return replayed_transfer
+
+    account_ids = sorted([transfer.from_account_id, transfer.to_account_id])
+    accounts = session.exec(transfer_accounts_statement, params={"user_id": user.id, "account_ids": account_ids}).all()
+    if len(accounts) != 2:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+    for account_id in account_ids:
+        periods.ensure_period_open(session, account_id, transfer.transaction_date)
+
+    transfer_id = uuid.uuid4()
+    now = datetime.datetime.utcnow()
+    legs = [
+        Transaction(
+            memo=transfer.memo,
+            amount=amount,
+            transaction_date=transfer.transaction_date,
+            transaction_type=TransactionType.Transfer,
+            description=transfer.description,
+            transaction_token=transfer.transaction_token,
+            created_date=now,
+            updated_date=now,
+            running_balance=amount,
+            ordinal=0,
+            account_id=account_id,
+            category_id=transfer.category_id,
+            user_id=user.id,
+            transfer_id=transfer_id,
+        )
+        for account_id, amount in ((transfer.from_account_id, -transfer.amount), (transfer.to_account_id, transfer.amount))
+    ]
+    # both legs and both rewritten tails go out in one commit, so a failure leaves neither account changed
+    try:
+        for leg in legs:
+            first_for_account = transactions.place_transaction(session, user, leg)
+            transactions.write_transaction(session, user, leg, first_for_account)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        replayed_transfer = existing_transfer(session, user, transfer)
+        if replayed_transfer is None:
+            raise
+        return replayed_transfer
+    return read_transfer(session, user, transfer_id)
+
+
+@router.get("/{transfer_id}", response_model=ReadTransfer)
+def get_transfer(
+        *,
+        session: Session = Depends(create_session),
+        user: User = Depends(get_current_active_user),
+        transfer_id: uuid.UUID,
+):
+    transfer = read_transfer(session, user, transfer_id)
+    if transfer is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transfer not found")
+    return transfer
@@ -1,5 +1,6 @@
 import datetime
 import enum
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 import uuid
 
@@ -19,6 +20,10 @@ class BaseAccount(SQLModel):
 
 
 class Account(BaseAccount, table=True):
+    __table_args__ = (
+        Index("ix_account_user_sync_version", "user_id", "sync_version"),
+    )
+
     id: uuid.UUID = Field(
         primary_key=True,
         default_factory=uuid.uuid4,
@@ -26,6 +31,7 @@ class Account(BaseAccount, table=True):
         nullable=False
     )
     active: bool = Field(default=True)
+    sync_version: int = Field(default=0)
 
     user_id: uuid.UUID = Field(foreign_key="user.id")
     transactions: list["Transaction"] = Relationship(back_populates="account")
@@ -50,6 +56,10 @@ class BaseCategory(SQLModel):
 
 
 class Category(BaseCategory, table=True):
+    __table_args__ = (
+        Index("ix_category_user_sync_version", "user_id", "sync_version"),
+    )
+
     id: uuid.UUID = Field(
         primary_key=True,
         default_factory=uuid.uuid4,
@@ -57,6 +67,7 @@ class Category(BaseCategory, table=True):
         nullable=False
     )
     active: bool = Field(default=True)
+    sync_version: int = Field(default=0)
 
     user_id: uuid.UUID = Field(foreign_key="user.id")
     transactions: list["Transaction"] = Relationship(back_populates="category")
@@ -86,6 +97,15 @@ class BaseTransaction(SQLModel):
 
 
 class Transaction(BaseTransaction, table=True):
+    __table_args__ = (
+        Index("ix_transaction_user_date", "user_id", "transaction_date", "id"),
+        Index("ix_transaction_account_ordinal", "account_id", "ordinal"),
+        Index("ix_transaction_category_date", "category_id", "transaction_date"),
+        Index("ix_transaction_bill_date", "bill_id", "transaction_date"),
+        Index("ux_transaction_account_token", "account_id", "transaction_token", unique=True),
+        Index("ix_transaction_user_sync_version", "user_id", "sync_version"),
+    )
+
     id: uuid.UUID = Field(
         primary_key=True,
         default_factory=uuid.uuid4,
@@ -98,11 +118,14 @@ class Transaction(BaseTransaction, table=True):
     active: bool = Field(default=True)
     running_balance: float
     ordinal: int
+    sync_version: int = Field(default=0)
 
     account_id: uuid.UUID = Field(foreign_key="account.id")
     category_id: uuid.UUID = Field(foreign_key="category.id")
     user_id: uuid.UUID = Field(foreign_key="user.id")
     bill_id: uuid.UUID | None = Field(default=None, foreign_key="bill.id")
+    transfer_id: uuid.UUID | None = Field(default=None, index=True)
+    reconciled: bool = Field(default=False)
     account: Account = Relationship(back_populates="transactions")
     category: Category = Relationship(back_populates="transactions")
     user: "User" = Relationship(back_populates="transactions")
@@ -120,14 +143,26 @@ class UpdateTransaction(SQLModel):
     bill_id: uuid.UUID | None
 
 
+class TransactionFilters(SQLModel):
+    start_date: datetime.date | None
+    end_date: datetime.date | None
+    category_id: uuid.UUID | None
+    bill_id: uuid.UUID | None
+    transaction_type: TransactionType | None
+    min_amount: float | None
+    max_amount: float | None
+    active: bool | None
+
+
 class CreateTransaction(BaseTransaction):
     account_id: uuid.UUID
-    category_id: uuid.UUID
+    # left out, the user's categorization rules pick it
+    category_id: uuid.UUID | None = Field(default=None)
     bill_id: uuid.UUID | None = Field(default=None)
 
 
 class CreateAccountTransaction(BaseTransaction):
-    category_id: uuid.UUID
+    category_id: uuid.UUID | None = Field(default=None)
 
 
 class BaseUser(SQLModel):
@@ -163,6 +198,10 @@ class BaseBill(SQLModel):
 
 
 class Bill(BaseBill, table=True):
+    __table_args__ = (
+        Index("ix_bill_user_sync_version", "user_id", "sync_version"),
+    )
+
     id: uuid.UUID = Field(
         primary_key=True,
         default_factory=uuid.uuid4,
@@ -170,6 +209,7 @@ class Bill(BaseBill, table=True):
         nullable=False
     )
     active: bool = Field(default=True)
+    sync_version: int = Field(default=0)
 
     user_id: uuid.UUID = Field(foreign_key="user.id")
     user: User = Relationship(back_populates="bills")
@@ -197,11 +237,31 @@ class UpdateBill(SQLModel):
 class ReadTransaction(BaseTransaction):
     id: uuid.UUID
     running_balance: float
+    stale: bool = False
+    transfer_id: uuid.UUID | None
+    reconciled: bool = False
     account: Account
     category: Category
     bill: Bill | None
 
 
+class CreateTransfer(SQLModel):
+    from_account_id: uuid.UUID
+    to_account_id: uuid.UUID
+    amount: float = Field(gt=0)
+    transaction_date: datetime.date
+    memo: str
+    description: str | None
+    transaction_token: str | None
+    category_id: uuid.UUID
+
+
+class ReadTransfer(SQLModel):
+    transfer_id: uuid.UUID
+    withdrawal: ReadTransaction
+    deposit: ReadTransaction
+
+
 class RefreshToken(SQLModel, table=True):
     id: uuid.UUID = Field(
         primary_key=True,
@@ -213,3 +273,243 @@ class RefreshToken(SQLModel, table=True):
     user_id: uuid.UUID
     active: bool = Field(default=True)
     valid_until: datetime.datetime
+
+
+class BalanceWatermark(SQLModel, table=True):
+    account_id: uuid.UUID = Field(
+        primary_key=True,
+        foreign_key="account.id",
+        nullable=False
+    )
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True)
+    from_ordinal: int
+    marked_date: datetime.datetime
+
+
+class SyncCursor(SQLModel, table=True):
+    user_id: uuid.UUID = Field(
+        primary_key=True,
+        foreign_key="user.id",
+        nullable=False
+    )
+    version: int = Field(default=0)
+
+
+class SyncChanges(SQLModel):
+    sync_token: int
+    has_more: bool = False
+    accounts: list[Account]
+    categories: list[Category]
+    bills: list[Bill]
+    transactions: list[Transaction]
+    archived_transaction_ids: list[uuid.UUID] = []
+
+
+class PeriodClose(SQLModel, table=True):
+    id: uuid.UUID = Field(
+        primary_key=True,
+        default_factory=uuid.uuid4,
+        index=True,
+        nullable=False
+    )
+    year: int
+    closed_through: datetime.date
+    ordinal: int
+    running_balance: float
+    closed_date: datetime.datetime
+
+    account_id: uuid.UUID = Field(foreign_key="account.id", index=True)
+    user_id: uuid.UUID = Field(foreign_key="user.id")
+
+
+class ClosePeriod(SQLModel):
+    year: int
+
+
+class ReadPeriodClose(SQLModel):
+    account_id: uuid.UUID
+    year: int
+    closed_through: datetime.date
+    ordinal: int
+    running_balance: float
+
+
+class ArchivedTransaction(BaseTransaction, table=True):
+    __table_args__ = (
+        Index("ix_archivedtransaction_account_date", "account_id", "transaction_date"),
+    )
+
+    id: uuid.UUID = Field(
+        primary_key=True,
+        nullable=False
+    )
+    created_date: datetime.datetime
+    updated_date: datetime.datetime
+    transaction_date: datetime.date
+    active: bool
+    running_balance: float
+    ordinal: int
+    sync_version: int
+
+    account_id: uuid.UUID = Field(foreign_key="account.id")
+    category_id: uuid.UUID = Field(foreign_key="category.id")
+    user_id: uuid.UUID = Field(foreign_key="user.id")
+    bill_id: uuid.UUID | None = Field(default=None, foreign_key="bill.id")
+    transfer_id: uuid.UUID | None
+    reconciled: bool = Field(default=False)
+
+
+class ReadArchivedTransaction(BaseTransaction):
+    id: uuid.UUID
+    running_balance: float
+    ordinal: int
+    active: bool
+    account_id: uuid.UUID
+    category_id: uuid.UUID
+    bill_id: uuid.UUID | None
+    transfer_id: uuid.UUID | None
+    reconciled: bool = False
+
+
+class UserDirectory(SQLModel, table=True):
+    user_id: uuid.UUID = Field(primary_key=True, nullable=False)
+    username: str = Field(unique=True, index=True)
+    email: str = Field(unique=True, index=True)
+
+
+class BalanceCheckpoint(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_balancecheckpoint_account_date", "account_id", "transaction_date", "ordinal"),
+    )
+
+    account_id: uuid.UUID = Field(
+        primary_key=True,
+        foreign_key="account.id",
+        nullable=False
+    )
+    ordinal: int = Field(primary_key=True, nullable=False)
+    transaction_date: datetime.date
+    running_balance: float
+    user_id: uuid.UUID = Field(foreign_key="user.id")
+
+
+class AccountBalance(SQLModel):
+    account_id: uuid.UUID
+    as_of: datetime.date
+    balance: float
+    stale: bool = False
+
+
+class StatementLine(SQLModel):
+    transaction_date: datetime.date
+    amount: float
+    memo: str = ""
+    transaction_token: str | None
+
+
+class Statement(SQLModel):
+    start_date: datetime.date
+    end_date: datetime.date
+    closing_balance: float | None
+    lines: list[StatementLine]
+
+
+class StatementMatch(SQLModel):
+    line: int
+    transaction_id: uuid.UUID
+    matched_on: str
+    days_apart: int
+    memo_similarity: float
+
+
+class StatementReconciliation(SQLModel):
+    matched: list[StatementMatch]
+    missing: list[StatementLine]
+    extra: list[Transaction]
+    closing_balance: float | None
+    ledger_balance: float
+    difference: float | None
+    balanced: bool | None
+    stale: bool = False
+
+
+class BaseCategoryRule(SQLModel):
+    category_id: uuid.UUID
+    memo_contains: str | None
+    description_contains: str | None
+    min_amount: float | None
+    max_amount: float | None
+    transaction_type: TransactionType | None
+    priority: int = Field(default=0)
+
+
+class CategoryRule(BaseCategoryRule, table=True):
+    id: uuid.UUID = Field(
+        primary_key=True,
+        default_factory=uuid.uuid4,
+        index=True,
+        nullable=False
+    )
+    active: bool = Field(default=True)
+    updated_date: datetime.datetime
+
+    category_id: uuid.UUID = Field(foreign_key="category.id")
+    user_id: uuid.UUID = Field(foreign_key="user.id", index=True)
+
+
+class CreateCategoryRule(BaseCategoryRule):
+    pass
+
+
+class ReadCategoryRule(BaseCategoryRule):
+    id: uuid.UUID
+    active: bool
+
+
+class UpdateCategoryRule(SQLModel):
+    category_id: uuid.UUID | None
+    memo_contains: str | None
+    description_contains: str | None
+    min_amount: float | None
+    max_amount: float | None
+    transaction_type: TransactionType | None
+    priority: int | None
+    active: bool | None
+
+
+class RecategorizeResult(SQLModel):
+    scanned: int
+    matched: int
+    updated: int
+
+
+class DashboardTransaction(SQLModel):
+    id: uuid.UUID
+    memo: str
+    amount: float
+    transaction_date: datetime.date
+    transaction_type: TransactionType
+    running_balance: float
+    category_id: uuid.UUID
+    bill_id: uuid.UUID | None
+    transfer_id: uuid.UUID | None
+    stale: bool = False
+
+
+class DashboardAccount(SQLModel):
+    id: uuid.UUID
+    name: str
+    balance: float
+    stale: bool = False
+    recent_transactions: list[DashboardTransaction]
+
+
+class UpcomingBill(BaseBill):
+    id: uuid.UUID
+    next_due_date: datetime.date
+
+
+class Dashboard(SQLModel):
+    accounts: list[DashboardAccount]
+    categories: list[ReadCategory]
+    upcoming_bills: list[UpcomingBill]
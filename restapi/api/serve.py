@@ -0,0 +1,201 @@
+"""Production entry point: import the app once, then fork workers that share it and one listening socket.
+
+    python -m restapi.api.serve [--host 0.0.0.0] [--port 8080] [--workers N]
+    python -m restapi.api.serve --measure
+
+One worker per CPU is the default, and web_concurrency or --workers overrides it. The event broker and
+the admission limits live in each process, so with more than one worker a ledger event only reaches the
+streams held by the worker that committed it, and every worker admits its own share of requests. Put sticky
+routing per user in front, or run a single worker where clients cannot live with that.
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import resource
+import signal
+import socket
+import time
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+try:
+    web_concurrency = int(os.environ["web_concurrency"])
+except KeyError:
+    web_concurrency = 0
+
+try:
+    graceful_timeout = float(os.environ["graceful_timeout"])
+except KeyError:
+    graceful_timeout = 25.0
+
+# a worker that exits sooner than this after it started is crash-looping, and its replacement waits
+try:
+    min_worker_uptime = float(os.environ["min_worker_uptime"])
+except KeyError:
+    min_worker_uptime = 5.0
+
+try:
+    max_respawn_delay = float(os.environ["max_respawn_delay"])
+except KeyError:
+    max_respawn_delay = 30.0
+
+_forked_at: float | None = None
+
+
+def memory_usage() -> dict:
+    # pss splits pages shared with the parent between the processes using them, so it shows what preloading saves
+    usage = {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    usage[f"{name.lower()}_kb"] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def preload() -> tuple:
+    started = time.perf_counter()
+    from restapi.api.main import app
+    from restapi.api.database import create_db_and_tables, dispose_engines
+    imported = time.perf_counter()
+    create_db_and_tables()
+    dispose_engines()
+    finished = time.perf_counter()
+    timings = {
+        "import_seconds": round(imported - started, 4),
+        "create_tables_seconds": round(finished - imported, 4),
+        "preload_seconds": round(finished - started, 4),
+    }
+    return app, timings
+
+
+def report_worker_ready():
+    if _forked_at is not None:
+        ready = round(time.perf_counter() - _forked_at, 4)
+        logger.info("worker %s ready in %ss %s", os.getpid(), ready, memory_usage())
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket):
+    global _forked_at
+    _forked_at = time.perf_counter()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # uvicorn turns SIGTERM into a drain: stop accepting, finish in flight requests, run shutdown handlers
+    config = uvicorn.Config(app, proxy_headers=True, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(app, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock)
+        except BaseException:
+            logger.exception("worker %s failed", os.getpid())
+            code = 1
+        os._exit(code)
+    return pid
+
+
+def respawn_delay(previous_delay: float, uptime: float) -> float:
+    # doubles while workers keep dying young, so a broken deploy does not fork as fast as it can
+    if uptime >= min_worker_uptime:
+        return 0.0
+    return min(max(previous_delay * 2, 0.5), max_respawn_delay)
+
+
+def supervise(app, sock: socket.socket, workers: int):
+    # pid -> when it was started
+    children = {spawn(app, sock): time.monotonic() for _ in range(workers)}
+    # when each pending replacement is due, soonest first
+    respawns: list[float] = []
+    delay = 0.0
+    # holds the drain deadline once a stop signal arrives
+    stopping: list[float] = []
+
+    def stop(signum, frame):
+        if stopping:
+            return
+        stopping.append(time.monotonic() + graceful_timeout)
+        respawns.clear()
+        logger.info("draining %s workers", len(children))
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children or respawns:
+        while respawns and respawns[0] <= time.monotonic():
+            respawns.pop(0)
+            children[spawn(app, sock)] = time.monotonic()
+        pid, status = 0, 0
+        if children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                continue
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                logger.warning("workers did not drain within %ss, killing %s", graceful_timeout, sorted(children))
+                for child in children:
+                    os.kill(child, signal.SIGKILL)
+                stopping[0] = float("inf")
+            time.sleep(0.1)
+            continue
+        uptime = time.monotonic() - children.pop(pid)
+        if not stopping:
+            delay = respawn_delay(delay, uptime)
+            logger.warning(
+                "worker %s exited with status %s after %.1fs, starting a replacement in %ss", pid, status, uptime, delay
+            )
+            bisect.insort(respawns, time.monotonic() + delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--workers", type=int, default=web_concurrency or os.cpu_count() or 1,
+        help="worker processes; each has its own event broker and admission limits",
+    )
+    parser.add_argument("--measure", action="store_true", help="print cold start time and memory as JSON and exit")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(levelname)s:     %(message)s")
+    logger.setLevel(logging.INFO)
+
+    app, timings = preload()
+    if args.measure:
+        print(json.dumps({**timings, **memory_usage()}))
+        return
+
+    logger.info("preloaded in %ss %s, starting %s workers", timings["preload_seconds"], memory_usage(), args.workers)
+    if args.workers > 1:
+        logger.warning("ledger events and admission limits are per worker, see python -m restapi.api.serve --help")
+    app.add_event_handler("startup", report_worker_ready)
+    sock = bind_socket(args.host, args.port)
+    supervise(app, sock, args.workers)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1 @@
-podman run -d --name duck-ledger-api --env-file .\.env -p 8080:8080 localhost/ledger-duck-api:latest
\ No newline at end of file
+podman run -d --name duck-ledger-api --env-file .\.env --stop-timeout 30 -p 8080:8080 localhost/ledger-duck-api:latest
\ No newline at end of file
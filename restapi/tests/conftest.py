@@ -0,0 +1,278 @@
+import datetime
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+
+for key, value in {
+    "smtp_username": "tester",
+    "smtp_password": "tester",
+    "smtp_server": "localhost",
+    "smtp_port": "25",
+}.items():
+    os.environ.setdefault(key, value)
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session, create_engine
+
+from restapi.api import balances
+from restapi.api.database import create_session
+from restapi.api.main import app
+from restapi.api.routers.auth import create_access_token, create_refresh_token, get_password_hash
+from restapi.api.schemas import User, Account, Category, Bill, Transaction, TransactionType, CategoryRule, \
+    UserDirectory
+
+SEED_ACCOUNTS = 3
+SEED_CATEGORIES = 150
+SEED_BILLS = 150
+SEED_TRANSACTIONS_PER_ACCOUNT = 150
+
+
+@dataclass
+class QueryStats:
+    statements: list[str] = field(default_factory=list)
+    rows: int = 0
+    seconds: float = 0.0
+
+
+class CountingCursor:
+    """Counts the rows fetched through a DBAPI cursor, whatever kind of statement or result reads them."""
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryRecorder:
+    def __init__(self, engine):
+        self.engine = engine
+        self.stats: QueryStats | None = None
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.stats is not None:
+            self.stats.statements.append(statement)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # the result reads its rows from context.cursor, so the wrapper sees every row the database returns
+        if self.stats is not None and context is not None and cursor.description is not None:
+            context.cursor = CountingCursor(cursor, self.stats)
+
+    def session(self):
+        with Session(self.engine) as session:
+            yield session
+
+    def measure(self, call):
+        self.stats = QueryStats()
+        started = time.perf_counter()
+        try:
+            response = call()
+        finally:
+            self.stats.seconds = time.perf_counter() - started
+        stats, self.stats = self.stats, None
+        return response, stats
+
+
+@pytest.fixture(scope="session")
+def engine(tmp_path_factory):
+    try:
+        url = os.environ["test_database_url"]
+    except KeyError:
+        url = f"sqlite:///{tmp_path_factory.mktemp('db') / 'ledger.sqlite'}"
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    SQLModel.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def seed(engine):
+    with Session(engine) as session:
+        user = User(username="budgetuser", email="budget@duckledger.test", hashed_password=get_password_hash("Passw0rd"))
+        session.add_all([user, UserDirectory(user_id=user.id, username=user.username, email=user.email)])
+        session.commit()
+        session.refresh(user)
+
+        accounts = [Account(name=f"Account {i:03}", user_id=user.id) for i in range(SEED_ACCOUNTS)]
+        categories = [Category(name=f"Category {i:03}", user_id=user.id) for i in range(SEED_CATEGORIES)]
+        bills = [
+            Bill(name=f"Bill {i:03}", amount=10 + i, due_date=i % 28 + 1, user_id=user.id)
+            for i in range(SEED_BILLS)
+        ]
+        session.add_all(accounts + categories + bills)
+        session.commit()
+
+        start = datetime.date(2023, 1, 1)
+        now = datetime.datetime.utcnow()
+        for account in accounts:
+            running_balance = 0.0
+            for i in range(SEED_TRANSACTIONS_PER_ACCOUNT):
+                amount = float(i % 17 - 8)
+                running_balance += amount
+                session.add(Transaction(
+                    memo=f"Memo {i}",
+                    amount=amount,
+                    transaction_date=start + datetime.timedelta(days=i),
+                    transaction_type=TransactionType.Debit,
+                    created_date=now,
+                    updated_date=now,
+                    running_balance=running_balance,
+                    ordinal=i + 1,
+                    account_id=account.id,
+                    category_id=categories[i % SEED_CATEGORIES].id,
+                    bill_id=bills[i % SEED_BILLS].id if i % 3 == 0 else None,
+                    user_id=user.id,
+                ))
+
+        # one transfer between the first two accounts after everything else; every account ends on the same balance
+        transfer_id = uuid.uuid4()
+        transfer_date = start + datetime.timedelta(days=SEED_TRANSACTIONS_PER_ACCOUNT)
+        for account, amount in ((accounts[0], -25.0), (accounts[1], 25.0)):
+            session.add(Transaction(
+                memo="Transfer",
+                amount=amount,
+                transaction_date=transfer_date,
+                transaction_type=TransactionType.Transfer,
+                created_date=now,
+                updated_date=now,
+                running_balance=running_balance + amount,
+                ordinal=SEED_TRANSACTIONS_PER_ACCOUNT + 1,
+                account_id=account.id,
+                category_id=categories[0].id,
+                user_id=user.id,
+                transfer_id=transfer_id,
+            ))
+        rule = CategoryRule(category_id=categories[1].id, memo_contains="coffee", user_id=user.id, updated_date=now)
+        refresh_token_str, refresh_token = create_refresh_token(user_id=user.id)
+        session.add_all([rule, refresh_token])
+        session.commit()
+
+        transaction = session.exec(
+            Transaction.__table__.select().where(Transaction.account_id == accounts[0].id).limit(1)
+        ).first()
+        return {
+            "user": user.username,
+            "user_id": str(user.id),
+            "account_id": str(accounts[0].id),
+            "other_account_id": str(accounts[1].id),
+            "closing_account_id": str(accounts[2].id),
+            "category_id": str(categories[0].id),
+            "bill_id": str(bills[0].id),
+            "transaction_id": str(transaction.id),
+            "transfer_id": str(transfer_id),
+            "rule_id": str(rule.id),
+            "refresh_token": refresh_token_str,
+        }
+
+
+@pytest.fixture(scope="session")
+def recorder(engine):
+    return QueryRecorder(engine)
+
+
+@pytest.fixture(scope="session")
+def client(recorder, seed):
+    app.dependency_overrides[create_session] = recorder.session
+    client = TestClient(app)
+    token = create_access_token(data={"sub": seed["user"], "uid": seed["user_id"]}, expires_delta=datetime.timedelta(hours=1))
+    client.headers["Authorization"] = f"Bearer {token}"
+    yield client
+    app.dependency_overrides.clear()
+
+
+class LedgerClient:
+    """An API client for a user of its own, so tests that write do not move the seeded budgets."""
+
+    def __init__(self, client: TestClient, user_id: uuid.UUID, category_id: uuid.UUID):
+        self.client = client
+        self.user_id = user_id
+        self.category_id = str(category_id)
+
+    def create_account(self, name: str = "Checking") -> str:
+        response = self.client.post("/accounts/", json={"name": name})
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    def create_transaction(self, account_id: str, transaction_date: str, amount: float, **fields) -> dict:
+        body = {
+            "memo": f"{transaction_date} {amount}",
+            "amount": amount,
+            "transaction_date": transaction_date,
+            "transaction_type": "debit",
+            "category_id": self.category_id,
+            **fields,
+        }
+        response = self.client.post(f"/accounts/{account_id}/transactions/", json=body)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def ledger(self, account_id: str) -> list[tuple[str, int, float]]:
+        # (date, ordinal, running balance) oldest first
+        params = {"fields": "transaction_date,ordinal,running_balance", "limit": 100}
+        response = self.client.get(f"/accounts/{account_id}/transactions/", params=params)
+        assert response.status_code == 200, response.text
+        rows = [(row["transaction_date"], row["ordinal"], row["running_balance"]) for row in response.json()]
+        return sorted(rows, key=lambda row: row[1])
+
+    @staticmethod
+    def expected_ledger(rows: list[tuple[str, float]]) -> list[tuple[str, int, float]]:
+        # what ledger() should read for (date, amount) rows written in any order, same-day rows in write order
+        ledger, running_balance = [], 0.0
+        for ordinal, (transaction_date, amount) in enumerate(sorted(rows, key=lambda row: row[0]), start=1):
+            running_balance += amount
+            ledger.append((transaction_date, ordinal, running_balance))
+        return ledger
+
+
+@pytest.fixture(scope="session")
+def password_hash():
+    return get_password_hash("Passw0rd")
+
+
+@pytest.fixture
+def ledger(engine, client, password_hash):
+    name = uuid.uuid4().hex[:12]
+    with Session(engine) as session:
+        user = User(username=f"user{name}", email=f"{name}@duckledger.test", hashed_password=password_hash)
+        category = Category(name="General", user_id=user.id)
+        session.add_all([user, UserDirectory(user_id=user.id, username=user.username, email=user.email)])
+        session.commit()
+        session.add(category)
+        session.commit()
+        user_id, category_id = user.id, category.id
+    user_client = TestClient(app)
+    token = create_access_token(data={"sub": f"user{name}", "uid": str(user_id)}, expires_delta=datetime.timedelta(hours=1))
+    user_client.headers["Authorization"] = f"Bearer {token}"
+    return LedgerClient(user_client, user_id, category_id)
+
+
+@pytest.fixture
+def deferred(engine, monkeypatch):
+    # settle against the test database rather than the configured shards
+    monkeypatch.setattr(balances, "deferred_balances", True)
+    monkeypatch.setattr(balances, "engines", {"test": engine})
@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+
+import pytest
+
+from restapi.api import admission
+from restapi.api.admission import AdmissionMiddleware
+from restapi.api.routers.auth import create_access_token
+
+
+class GatedApp:
+    """Answers 200, holding each request until the gate opens."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope, receive, send):
+        self.started += 1
+        await self.gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+def bearer(user: str) -> list[tuple[bytes, bytes]]:
+    token = create_access_token(data={"sub": user, "uid": user}, expires_delta=datetime.timedelta(minutes=5))
+    return [(b"authorization", f"Bearer {token}".encode())]
+
+
+async def call(middleware, method: str, path: str, headers=()) -> tuple[int, dict[bytes, bytes]]:
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers), "client": ("10.0.0.1", 5000)}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    await middleware(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"])
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(admission, "buckets", {})
+    monkeypatch.setattr(admission, "in_flight", {name: 0 for name, method, pattern in admission.expensive_routes})
+    monkeypatch.setattr(admission, "client_in_flight", {})
+    monkeypatch.setattr(admission, "counters", {"admitted": 0, "rate_limited": 0, "concurrency_limited": 0, "shed": 0})
+    monkeypatch.setattr(admission, "pool_wait_seconds", lambda: 0.0)
+    return monkeypatch
+
+
+def test_a_client_past_its_burst_gets_429_with_retry_after(limits):
+    limits.setattr(admission, "rate_limit_burst", 2.0)
+    limits.setattr(admission, "rate_limit_per_second", 0.5)
+    app = GatedApp()
+    app.gate.set()
+    middleware = AdmissionMiddleware(app)
+
+    async def run():
+        return [await call(middleware, "GET", "/accounts/", bearer("alice")) for _ in range(3)] + [
+            await call(middleware, "GET", "/accounts/", bearer("bob"))
+        ]
+
+    responses = asyncio.run(run())
+    assert [status for status, headers in responses] == [200, 200, 429, 200]
+    # a whole token refills in two seconds at half a token per second
+    assert responses[2][1][b"retry-after"] == b"2"
+    assert admission.counters["rate_limited"] == 1
+
+
+def test_writes_are_capped_per_client_and_per_process(limits):
+    limits.setattr(admission, "write_concurrency", 2)
+    limits.setattr(admission, "global_write_concurrency", 3)
+    app = GatedApp()
+    middleware = AdmissionMiddleware(app)
+
+    async def run():
+        held = [
+            asyncio.create_task(call(middleware, "POST", "/transactions/", bearer(user)))
+            for user in ("alice", "alice")
+        ]
+        await asyncio.sleep(0)
+        # alice is at her cap, bob is not
+        alice_status, alice_headers = await call(middleware, "POST", "/transfers/", bearer("alice"))
+        held.append(asyncio.create_task(call(middleware, "POST", "/transfers/", bearer("bob"))))
+        await asyncio.sleep(0)
+        # the process is at its cap for everyone
+        carol_status, carol_headers = await call(middleware, "POST", "/transactions/", bearer("carol"))
+        # other route groups and reads are not held up by transaction writes
+        close_status = asyncio.create_task(call(middleware, "POST", "/accounts/a/close", bearer("alice")))
+        await asyncio.sleep(0)
+        app.gate.set()
+        finished = [status for status, headers in await asyncio.gather(*held, close_status)]
+        return alice_status, alice_headers, carol_status, finished
+
+    alice_status, alice_headers, carol_status, finished = asyncio.run(run())
+    assert alice_status == 503
+    assert alice_headers[b"retry-after"] == b"1"
+    assert carol_status == 503
+    assert finished == [200, 200, 200, 200]
+    assert app.started == 4
+    assert admission.client_in_flight == {}
+    assert admission.in_flight["transaction_write"] == 0
+
+
+def test_load_is_shed_while_the_pool_wait_is_high(limits):
+    limits.setattr(admission, "pool_wait_threshold", 0.5)
+    limits.setattr(admission, "pool_wait_seconds", lambda: 2.4)
+    app = GatedApp()
+    app.gate.set()
+    middleware = AdmissionMiddleware(app)
+
+    status, headers = asyncio.run(call(middleware, "GET", "/accounts/", bearer("alice")))
+    assert status == 503
+    assert headers[b"retry-after"] == b"3"
+    assert app.started == 0
+    assert admission.counters["shed"] == 1
+
+
+def test_metrics_are_never_throttled(limits):
+    limits.setattr(admission, "pool_wait_seconds", lambda: 10.0)
+    limits.setattr(admission, "rate_limit_burst", 0.0)
+    app = GatedApp()
+    app.gate.set()
+    middleware = AdmissionMiddleware(app)
+
+    statuses = asyncio.run(call(middleware, "GET", "/metrics/"))
+    assert statuses[0] == 200
+    assert admission.counters == {"admitted": 0, "rate_limited": 0, "concurrency_limited": 0, "shed": 0}
@@ -0,0 +1,187 @@
+import datetime
+import uuid
+
+from sqlmodel import SQLModel, Session, create_engine, select, func
+
+from restapi.api import backfill, balances
+from restapi.api.schemas import BalanceWatermark, BalanceCheckpoint, Transaction, ArchivedTransaction, User, \
+    Account, Category, TransactionType
+
+ROWS = [
+    ("2023-01-01", 10), ("2023-01-04", -3), ("2023-01-04", 7), ("2023-01-09", 30), ("2023-01-12", -12),
+    ("2023-01-15", 5), ("2023-01-20", 1), ("2023-01-28", 40), ("2023-02-02", -9), ("2023-02-10", 4),
+]
+
+
+def watermark_for(engine, account_id: str) -> int | None:
+    with Session(engine) as session:
+        statement = select(BalanceWatermark).where(BalanceWatermark.account_id == uuid.UUID(account_id))
+        watermark = session.exec(statement).first()
+        return watermark.from_ordinal if watermark else None
+
+
+def summed_balance(engine, account_id: str, as_of: datetime.date) -> float:
+    # every row on or before the date, hot and archived, with no checkpoint involved
+    total = 0.0
+    with Session(engine) as session:
+        for model in (Transaction, ArchivedTransaction):
+            statement = select(func.coalesce(func.sum(model.amount), 0.0))
+            statement = statement.where(model.account_id == uuid.UUID(account_id), model.transaction_date <= as_of)
+            total += session.exec(statement).one()
+    return total
+
+
+def assert_balances_match(engine, account_id: str, first: str = "2022-12-31", last: str = "2023-02-12"):
+    as_of, last = datetime.date.fromisoformat(first), datetime.date.fromisoformat(last)
+    with Session(engine) as session:
+        user = session.exec(select(User).join(Account).where(Account.id == uuid.UUID(account_id))).one()
+        while as_of <= last:
+            balance = balances.balance_as_of(session, user, uuid.UUID(account_id), as_of)
+            assert balance.balance == summed_balance(engine, account_id, as_of), as_of
+            as_of += datetime.timedelta(days=1)
+
+
+def checkpoint_ordinals(engine, account_id: str) -> list[int]:
+    with Session(engine) as session:
+        statement = select(BalanceCheckpoint.ordinal).where(BalanceCheckpoint.account_id == uuid.UUID(account_id))
+        return sorted(session.exec(statement).all())
+
+
+def test_back_dated_writes_merge_into_one_watermark(ledger, deferred, engine):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2023-01-01", 10), ("2023-01-05", 20), ("2023-01-09", 30)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    balances.settle_dirty_accounts()
+    assert watermark_for(engine, account_id) is None
+
+    ledger.create_transaction(account_id, "2023-01-07", 5)
+    assert watermark_for(engine, account_id) == 3
+    ledger.create_transaction(account_id, "2023-01-03", 1)
+    assert watermark_for(engine, account_id) == 2
+    ledger.create_transaction(account_id, "2023-01-08", 2)
+    assert watermark_for(engine, account_id) == 2
+
+
+def test_rows_past_the_watermark_read_as_stale_until_settled(ledger, deferred, engine):
+    account_id = ledger.create_account()
+    rows = [("2023-01-01", 10), ("2023-01-05", 20), ("2023-01-09", 30)]
+    for transaction_date, amount in rows:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    balances.settle_dirty_accounts()
+    created = ledger.create_transaction(account_id, "2023-01-03", 5)
+    assert created["stale"]
+
+    listed = ledger.client.get(f"/accounts/{account_id}/transactions/").json()
+    stale = {row["transaction_date"]: row["stale"] for row in listed}
+    assert stale == {"2023-01-01": False, "2023-01-03": True, "2023-01-05": True, "2023-01-09": True}
+
+    settled = ledger.client.get(f"/accounts/{account_id}/transactions/", params={"settle": True}).json()
+    assert not [row for row in settled if row["stale"]]
+    assert watermark_for(engine, account_id) is None
+    assert ledger.ledger(account_id) == ledger.expected_ledger(rows + [("2023-01-03", 5)])
+
+
+def test_a_failing_account_does_not_block_the_others(ledger, deferred, engine, monkeypatch):
+    failing_id, healthy_id = ledger.create_account("Failing"), ledger.create_account("Healthy")
+    for account_id in (failing_id, healthy_id):
+        ledger.create_transaction(account_id, "2023-01-05", 20)
+        ledger.create_transaction(account_id, "2023-01-01", 10)
+
+    recalculate = balances.recalculate_running_balances
+
+    def fail_one(session, account_id, from_ordinal):
+        if account_id == uuid.UUID(failing_id):
+            raise RuntimeError("corrupt tail")
+        recalculate(session, account_id, from_ordinal)
+
+    monkeypatch.setattr(balances, "recalculate_running_balances", fail_one)
+    balances.settle_dirty_accounts()
+    assert watermark_for(engine, failing_id) == 1
+    assert watermark_for(engine, healthy_id) is None
+    assert ledger.ledger(healthy_id) == ledger.expected_ledger([("2023-01-01", 10), ("2023-01-05", 20)])
+
+
+def test_stopping_the_worker_drains_pending_watermarks(ledger, deferred, engine, monkeypatch):
+    monkeypatch.setattr(balances, "settle_interval", 3600.0)
+    account_id = ledger.create_account()
+    balances.start_settlement_worker()
+    try:
+        ledger.create_transaction(account_id, "2023-01-05", 20)
+        ledger.create_transaction(account_id, "2023-01-01", 10)
+        assert watermark_for(engine, account_id) == 1
+    finally:
+        balances.stop_settlement_worker()
+    assert watermark_for(engine, account_id) is None
+    assert ledger.ledger(account_id) == ledger.expected_ledger([("2023-01-01", 10), ("2023-01-05", 20)])
+
+
+def test_balance_as_of_matches_a_full_sum_across_checkpoints(ledger, engine, monkeypatch):
+    monkeypatch.setattr(balances, "checkpoint_interval", 3)
+    account_id = ledger.create_account()
+    # written out of order, so back-dated inserts move checkpoints along the way
+    for transaction_date, amount in ROWS[5:] + ROWS[:5]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    assert checkpoint_ordinals(engine, account_id) == [3, 6, 9]
+    assert_balances_match(engine, account_id)
+
+
+def test_balance_as_of_matches_a_full_sum_after_archiving(ledger, engine, monkeypatch):
+    monkeypatch.setattr(balances, "checkpoint_interval", 3)
+    account_id = ledger.create_account()
+    rows = [(f"2022-{transaction_date[5:]}", amount) for transaction_date, amount in ROWS[:6]] + ROWS[6:]
+    for transaction_date, amount in rows:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2022}).status_code == 200
+    assert_balances_match(engine, account_id, first="2021-12-31")
+
+
+def test_balance_as_of_skips_checkpoints_past_a_stale_watermark(ledger, deferred, engine, monkeypatch):
+    monkeypatch.setattr(balances, "checkpoint_interval", 3)
+    account_id = ledger.create_account()
+    for transaction_date, amount in ROWS[:8]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    balances.settle_dirty_accounts()
+    for transaction_date, amount in ROWS[8:] + [("2023-01-02", 100), ("2023-01-10", -50)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    assert watermark_for(engine, account_id) == 2
+
+    response = ledger.client.get(f"/accounts/{account_id}/balance", params={"as_of": "2023-01-10"})
+    assert response.json()["stale"]
+    assert_balances_match(engine, account_id)
+    balances.settle_dirty_accounts()
+    assert_balances_match(engine, account_id)
+
+
+def test_the_checkpoint_backfill_covers_existing_accounts(tmp_path, monkeypatch, password_hash):
+    engine = create_engine(f"sqlite:///{tmp_path / 'backfill.sqlite'}")
+    SQLModel.metadata.create_all(engine)
+    now = datetime.datetime.utcnow()
+    with Session(engine) as session:
+        # two accounts written before checkpoints existed, one with a pending watermark
+        user = User(username="backfilluser", email="backfill@duckledger.test", hashed_password=password_hash)
+        accounts = [Account(name="Settled", user_id=user.id), Account(name="Stale", user_id=user.id)]
+        category = Category(name="General", user_id=user.id)
+        session.add_all([user, category, *accounts])
+        session.flush()
+        for account in accounts:
+            running_balance = 0.0
+            for ordinal, (transaction_date, amount) in enumerate(ROWS, start=1):
+                running_balance += amount
+                session.add(Transaction(
+                    memo="Imported", amount=amount, transaction_date=datetime.date.fromisoformat(transaction_date),
+                    transaction_type=TransactionType.Debit, created_date=now, updated_date=now,
+                    running_balance=running_balance, ordinal=ordinal,
+                    account_id=account.id, category_id=category.id, user_id=user.id,
+                ))
+        session.add(BalanceWatermark(account_id=accounts[1].id, user_id=user.id, from_ordinal=5, marked_date=now))
+        session.commit()
+        account_id, stale_id = str(accounts[0].id), str(accounts[1].id)
+
+    monkeypatch.setattr(balances, "checkpoint_interval", 3)
+    monkeypatch.setattr(backfill, "engines", {"test": engine})
+    assert backfill.backfill_checkpoints() == 4
+    assert backfill.backfill_checkpoints() == 0
+    assert checkpoint_ordinals(engine, account_id) == [3, 6, 9]
+    assert checkpoint_ordinals(engine, stale_id) == [3]
+    assert_balances_match(engine, account_id)
+    engine.dispose()
@@ -0,0 +1,155 @@
+import uuid
+
+from sqlmodel import Session
+
+from restapi.api import categorize, events
+from restapi.api.categorize import RuleMatcher, SubstringMatcher
+from restapi.api.schemas import Category, CategoryRule, Transaction, TransactionType
+
+
+def rule(**fields) -> CategoryRule:
+    return CategoryRule(id=uuid.uuid4(), category_id=uuid.uuid4(), **fields)
+
+
+def test_substring_matcher_finds_overlapping_and_nested_patterns():
+    matcher = SubstringMatcher(["coffee", "Coffee Shop", "shop", "hop", "tea"])
+    assert matcher.find("Corner COFFEE SHOP #12") == {"coffee", "coffee shop", "shop", "hop"}
+    assert matcher.find("teashop") == {"tea", "shop", "hop"}
+    assert matcher.find("groceries") == set()
+    assert matcher.find(None) == set()
+
+
+def test_substring_matcher_without_patterns_finds_nothing():
+    assert SubstringMatcher([]).find("anything") == set()
+
+
+def test_the_highest_priority_matching_rule_wins():
+    low, high = rule(memo_contains="coffee"), rule(memo_contains="coffee shop", priority=5)
+    matcher = RuleMatcher([low, high])
+    assert matcher.category_for("Coffee Shop", None, -4.5, TransactionType.Debit) == high.category_id
+    assert matcher.category_for("Coffee beans", None, -12, TransactionType.Debit) == low.category_id
+    assert matcher.category_for("Tea", None, -3, TransactionType.Debit) is None
+
+
+def test_equal_priorities_fall_back_to_the_rule_id():
+    first, second = sorted([rule(memo_contains="fuel"), rule(memo_contains="fuel")], key=lambda rule: str(rule.id))
+    matcher = RuleMatcher([second, first])
+    assert matcher.category_for("Fuel", None, -40, TransactionType.Debit) == first.category_id
+
+
+def test_every_condition_of_a_rule_must_hold():
+    both = rule(memo_contains="amazon", description_contains="prime", priority=3)
+    bounded = rule(memo_contains="amazon", min_amount=-50, max_amount=-10, priority=2)
+    credit = rule(memo_contains="amazon", transaction_type=TransactionType.Deposit, priority=1)
+    matcher = RuleMatcher([both, bounded, credit])
+    assert matcher.category_for("AMAZON", "Prime membership", -139, TransactionType.Debit) == both.category_id
+    assert matcher.category_for("AMAZON", "Books", -20, TransactionType.Debit) == bounded.category_id
+    assert matcher.category_for("AMAZON", None, 25, TransactionType.Deposit) == credit.category_id
+    assert matcher.category_for("AMAZON", None, -200, TransactionType.Debit) is None
+
+
+def test_rules_without_a_memo_match_on_description_or_amount_alone():
+    by_description = rule(description_contains="payroll", priority=1)
+    by_amount = rule(min_amount=1000)
+    matcher = RuleMatcher([by_description, by_amount])
+    assert matcher.category_for("Deposit", "ACME PAYROLL", 900, TransactionType.Deposit) == by_description.category_id
+    assert matcher.category_for("Deposit", None, 2500, TransactionType.Deposit) == by_amount.category_id
+    assert matcher.category_for("Deposit", None, 50, TransactionType.Deposit) is None
+
+
+
+def new_category(engine, ledger, name: str) -> str:
+    with Session(engine) as session:
+        category = Category(name=name, user_id=ledger.user_id)
+        session.add(category)
+        session.commit()
+        return str(category.id)
+
+
+def create_rule(ledger, **fields) -> dict:
+    response = ledger.client.post("/rules/", json=fields)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def uncategorized(ledger, account_id: str, memo: str):
+    body = {"memo": memo, "amount": -4.5, "transaction_date": "2024-01-02", "transaction_type": "debit"}
+    return ledger.client.post(f"/accounts/{account_id}/transactions/", json=body)
+
+
+def category_of(engine, transaction: dict) -> str:
+    with Session(engine) as session:
+        return str(session.get(Transaction, uuid.UUID(transaction["id"])).category_id)
+
+
+def test_rules_are_created_listed_and_patched(ledger, engine):
+    groceries = new_category(engine, ledger, "Groceries")
+    low = create_rule(ledger, category_id=groceries, memo_contains="market")
+    high = create_rule(ledger, category_id=ledger.category_id, memo_contains="farmers market", priority=5)
+    assert low["active"] is True
+
+    listed = ledger.client.get("/rules/").json()
+    assert [rule["id"] for rule in listed] == [high["id"], low["id"]]
+
+    response = ledger.client.patch(f"/rules/{low['id']}", json={"active": False, "priority": 9})
+    assert response.status_code == 200, response.text
+    assert (response.json()["active"], response.json()["priority"]) == (False, 9)
+    assert [rule["id"] for rule in ledger.client.get("/rules/", params={"active": True}).json()] == [high["id"]]
+    assert [rule["id"] for rule in ledger.client.get("/rules/", params={"active": False}).json()] == [low["id"]]
+
+    assert ledger.client.post("/rules/", json={"category_id": str(uuid.uuid4())}).status_code == 404
+    assert ledger.client.patch(f"/rules/{uuid.uuid4()}", json={"priority": 1}).status_code == 404
+
+
+def test_a_transaction_without_a_category_takes_the_matching_rule(ledger, engine):
+    groceries = new_category(engine, ledger, "Groceries")
+    create_rule(ledger, category_id=groceries, memo_contains="market")
+    account_id = ledger.create_account()
+
+    response = uncategorized(ledger, account_id, "Corner Market")
+    assert response.status_code == 200, response.text
+    assert category_of(engine, response.json()) == groceries
+
+    response = uncategorized(ledger, account_id, "Bookshop")
+    assert response.status_code == 400
+    assert ledger.ledger(account_id) == [("2024-01-02", 1, -4.5)]
+
+
+def test_a_patched_rule_recompiles_the_cached_matcher(ledger, engine):
+    groceries, dining = new_category(engine, ledger, "Groceries"), new_category(engine, ledger, "Dining")
+    rule = create_rule(ledger, category_id=groceries, memo_contains="market")
+    account_id = ledger.create_account()
+    assert category_of(engine, uncategorized(ledger, account_id, "Corner Market").json()) == groceries
+    cached = categorize._matchers[ledger.user_id][1]
+
+    assert ledger.client.patch(f"/rules/{rule['id']}", json={"category_id": dining}).status_code == 200
+    assert category_of(engine, uncategorized(ledger, account_id, "Corner Market").json()) == dining
+    assert categorize._matchers[ledger.user_id][1] is not cached
+
+
+def test_recategorize_moves_matching_rows_and_reports_one_batch_event(ledger, engine, monkeypatch):
+    published = []
+    monkeypatch.setattr(events.broker, "publish", lambda user_id, ledger_events: published.extend(ledger_events))
+    groceries = new_category(engine, ledger, "Groceries")
+    account_id = ledger.create_account()
+    created = [
+        ledger.create_transaction(account_id, "2024-01-02", -4.5, memo=memo)
+        for memo in ("Corner Market", "Market Hall", "Bookshop")
+    ]
+    create_rule(ledger, category_id=groceries, memo_contains="market")
+    before = ledger.client.get("/sync/").json()["sync_token"]
+    published.clear()
+
+    response = ledger.client.post("/rules/recategorize", params={"account_id": account_id})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"scanned": 3, "matched": 2, "updated": 2}
+    with Session(engine) as session:
+        rows = [session.get(Transaction, uuid.UUID(transaction["id"])) for transaction in created]
+        assert [str(row.category_id) for row in rows] == [groceries, groceries, ledger.category_id]
+        assert rows[0].sync_version == rows[1].sync_version > before
+        assert rows[2].sync_version <= before
+    assert published == [{"type": "transactions.recategorized", "sync_version": rows[0].sync_version, "count": 2}]
+
+    # a second pass finds the rows already in place
+    response = ledger.client.post("/rules/recategorize", params={"account_id": account_id})
+    assert response.json() == {"scanned": 3, "matched": 2, "updated": 0}
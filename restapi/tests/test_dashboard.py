@@ -0,0 +1,110 @@
+import datetime
+
+from sqlmodel import Session
+
+from restapi.api import balances
+from restapi.api.routers.dashboard import next_due_date
+from restapi.api.schemas import Account, Bill
+
+
+def test_each_account_lists_its_newest_rows_and_balance(ledger):
+    checking, savings, empty = (ledger.create_account(name) for name in ("Checking", "Savings", "Unused"))
+    for transaction_date, amount in [("2023-01-01", 10), ("2023-01-05", 20), ("2023-01-09", 30)]:
+        ledger.create_transaction(checking, transaction_date, amount)
+    ledger.create_transaction(savings, "2023-01-02", 100)
+    # back-dated, so it is newest by neither date of entry nor position in the table
+    ledger.create_transaction(checking, "2023-01-03", 5)
+
+    response = ledger.client.get("/dashboard/", params={"recent": 2, "bill_days": 0})
+    assert response.status_code == 200, response.text
+    accounts = {account["id"]: account for account in response.json()["accounts"]}
+    recent = {
+        account_id: [(row["transaction_date"], row["running_balance"]) for row in account["recent_transactions"]]
+        for account_id, account in accounts.items()
+    }
+    assert recent == {
+        checking: [("2023-01-09", 65), ("2023-01-05", 35)],
+        savings: [("2023-01-02", 100)],
+        empty: [],
+    }
+    assert {account_id: account["balance"] for account_id, account in accounts.items()} == {
+        checking: 65, savings: 100, empty: 0,
+    }
+
+
+def test_bills_fall_due_on_their_day_clamped_to_short_months():
+    assert next_due_date(15, datetime.date(2023, 3, 10)) == datetime.date(2023, 3, 15)
+    assert next_due_date(10, datetime.date(2023, 3, 10)) == datetime.date(2023, 3, 10)
+    assert next_due_date(31, datetime.date(2023, 2, 10)) == datetime.date(2023, 2, 28)
+    assert next_due_date(31, datetime.date(2024, 2, 10)) == datetime.date(2024, 2, 29)
+    assert next_due_date(31, datetime.date(2023, 4, 1)) == datetime.date(2023, 4, 30)
+    # a day already passed moves to the next month, and December's into January
+    assert next_due_date(30, datetime.date(2023, 1, 31)) == datetime.date(2023, 2, 28)
+    assert next_due_date(5, datetime.date(2023, 12, 20)) == datetime.date(2024, 1, 5)
+
+
+def test_active_bills_due_within_the_horizon_are_listed_soonest_first(ledger, engine):
+    today = datetime.date.today()
+    with Session(engine) as session:
+        session.add_all([
+            Bill(name=f"Day {due_day}", amount=10, due_date=due_day, user_id=ledger.user_id)
+            for due_day in (1, 15, 28, 31)
+        ] + [Bill(name="Cancelled", amount=10, due_date=today.day, active=False, user_id=ledger.user_id)])
+        session.commit()
+
+    response = ledger.client.get("/dashboard/", params={"bill_days": 10})
+    assert response.status_code == 200, response.text
+    listed = [(bill["name"], bill["next_due_date"]) for bill in response.json()["upcoming_bills"]]
+    due = sorted((next_due_date(due_day, today), f"Day {due_day}") for due_day in (1, 15, 28, 31))
+    assert listed == [
+        (name, due_date.isoformat()) for due_date, name in due if due_date <= today + datetime.timedelta(days=10)
+    ]
+    assert all(0 <= (datetime.date.fromisoformat(due_date) - today).days <= 10 for name, due_date in listed)
+
+
+def test_an_account_with_only_archived_rows_shows_its_latest_close(ledger):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2022-06-01", 10), ("2023-03-01", 20)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    for year in (2022, 2023):
+        assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": year}).status_code == 200
+
+    account = ledger.client.get("/dashboard/").json()["accounts"][0]
+    assert (account["balance"], account["recent_transactions"]) == (30, [])
+
+
+def test_rows_past_the_watermark_are_stale_on_the_dashboard(ledger, deferred):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2023-01-01", 10), ("2023-01-05", 20)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    balances.settle_dirty_accounts()
+    assert ledger.client.get("/dashboard/").json()["accounts"][0]["stale"] is False
+
+    ledger.create_transaction(account_id, "2023-01-03", 5)
+    account = ledger.client.get("/dashboard/").json()["accounts"][0]
+    assert account["stale"] is True
+    # the tail is out of order until it is settled, so only the flags are compared
+    assert {row["transaction_date"]: row["stale"] for row in account["recent_transactions"]} == {
+        "2023-01-01": False, "2023-01-03": True, "2023-01-05": True,
+    }
+
+    balances.settle_dirty_accounts()
+    account = ledger.client.get("/dashboard/").json()["accounts"][0]
+    assert (account["stale"], account["balance"]) == (False, 35)
+    assert [(row["transaction_date"], row["stale"]) for row in account["recent_transactions"]] == [
+        ("2023-01-05", False), ("2023-01-03", False), ("2023-01-01", False),
+    ]
+
+
+def test_more_accounts_than_sqlite_can_union_are_read_in_batches(ledger, engine):
+    with Session(engine) as session:
+        session.add_all([Account(name=f"Envelope {i:03}", user_id=ledger.user_id) for i in range(600)])
+        session.commit()
+    account_id = ledger.create_account("Zulu")
+    ledger.create_transaction(account_id, "2023-01-01", 10)
+
+    response = ledger.client.get("/dashboard/", params={"recent": 1})
+    assert response.status_code == 200, response.text
+    accounts = response.json()["accounts"]
+    assert len(accounts) == 601
+    assert (accounts[-1]["name"], accounts[-1]["balance"], len(accounts[-1]["recent_transactions"])) == ("Zulu", 10, 1)
@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from restapi.api import events
+from restapi.api.main import app
+from restapi.api.routers.events import stream_token
+from restapi.api.schemas import Transaction, TransactionType
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published: list[tuple[uuid.UUID, list[dict]]] = []
+
+    def publish(self, user_id: uuid.UUID, ledger_events: list[dict]):
+        self.published.append((user_id, ledger_events))
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = RecordingBroker()
+    monkeypatch.setattr(events, "broker", broker)
+    return broker
+
+
+def new_transaction(ledger, account_id: str) -> Transaction:
+    now = datetime.datetime.utcnow()
+    return Transaction(
+        memo="Coffee",
+        amount=-4.5,
+        transaction_date=datetime.date(2023, 1, 1),
+        transaction_type=TransactionType.Debit,
+        created_date=now,
+        updated_date=now,
+        running_balance=-4.5,
+        ordinal=1,
+        account_id=uuid.UUID(account_id),
+        category_id=uuid.UUID(ledger.category_id),
+        user_id=ledger.user_id,
+    )
+
+
+def test_the_header_token_wins_over_the_query_and_cookie():
+    assert stream_token("header", "query", "cookie") == "header"
+    assert stream_token(None, "query", "cookie") == "query"
+    assert stream_token(None, None, "cookie") == "cookie"
+    with pytest.raises(HTTPException) as raised:
+        stream_token(None, None, None)
+    assert raised.value.status_code == 401
+
+
+def test_the_stream_rejects_a_request_without_a_token(client):
+    response = TestClient(app).get("/events/")
+    assert response.status_code == 401
+
+
+def test_events_are_collected_on_flush_and_published_on_commit(ledger, engine, broker):
+    account_id = ledger.create_account()
+    broker.published.clear()
+    with Session(engine) as session:
+        transaction = new_transaction(ledger, account_id)
+        session.add(transaction)
+        session.flush()
+        transaction_id = str(transaction.id)
+        assert broker.published == []
+        session.commit()
+
+    [(user_id, published)] = broker.published
+    assert user_id == ledger.user_id
+    assert [ledger_event["type"] for ledger_event in published] == ["transaction.created", "balance.changed"]
+    assert published[0]["id"] == transaction_id
+    assert published[1]["account_id"] == account_id
+
+
+def test_a_rollback_discards_the_collected_events(ledger, engine, broker):
+    account_id = ledger.create_account()
+    broker.published.clear()
+    with Session(engine) as session:
+        session.add(new_transaction(ledger, account_id))
+        session.flush()
+        assert session.info["ledger_events"]
+        session.rollback()
+        assert "ledger_events" not in session.info
+        session.commit()
+    assert broker.published == []
+
+
+def test_a_full_queue_is_replaced_by_a_resync():
+    async def fill():
+        broker = events.LocalBroker(max_queued=2)
+        user_id = uuid.uuid4()
+        queue = broker.subscribe(user_id)
+        broker.publish(user_id, [{"type": "transaction.created", "id": str(i)} for i in range(3)])
+        await asyncio.sleep(0)
+        broker.unsubscribe(user_id, queue)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    assert asyncio.run(fill()) == [{"type": "resync"}]
@@ -0,0 +1,57 @@
+import pytest
+from fastapi import HTTPException
+
+from restapi.api import balances
+from restapi.api.fieldsets import parse_fields
+from restapi.api.routers.transactions import transaction_fields
+
+
+def test_fields_are_trimmed_and_deduplicated_in_order():
+    assert parse_fields(None, transaction_fields) is None
+    assert parse_fields(" amount,id,,amount ", transaction_fields) == ["amount", "id"]
+
+
+@pytest.mark.parametrize("fields", ["amount,hashed_password", "", " , "])
+def test_unknown_or_empty_fields_are_rejected(fields):
+    with pytest.raises(HTTPException) as raised:
+        parse_fields(fields, transaction_fields)
+    assert raised.value.status_code == 400
+
+
+def test_a_projected_list_returns_only_the_asked_fields(ledger):
+    account_id = ledger.create_account()
+    created = ledger.create_transaction(account_id, "2023-01-01", 10)
+
+    response = ledger.client.get("/transactions/", params={"fields": "id,amount"})
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"id": created["id"], "amount": 10}]
+    response = ledger.client.get(f"/transactions/{created['id']}", params={"fields": "memo"})
+    assert response.json() == {"memo": created["memo"]}
+
+    response = ledger.client.get(f"/accounts/{account_id}/transactions/", params={"fields": "id,user_id"})
+    assert response.status_code == 400
+    assert "user_id" in response.json()["detail"]
+
+
+def test_projected_balances_carry_the_stale_flag_in_deferred_mode(ledger, deferred):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2023-01-01", 10), ("2023-01-05", 20)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    balances.settle_dirty_accounts()
+    created = ledger.create_transaction(account_id, "2023-01-03", 5)
+
+    params = {"fields": "transaction_date,running_balance"}
+    for path in ("/transactions/", f"/accounts/{account_id}/transactions/"):
+        rows = ledger.client.get(path, params=params).json()
+        assert {row["transaction_date"]: row["stale"] for row in rows} == {
+            "2023-01-01": False, "2023-01-03": True, "2023-01-05": True,
+        }
+        assert all(set(row) == {"transaction_date", "running_balance", "stale"} for row in rows)
+    assert ledger.client.get(f"/transactions/{created['id']}", params=params).json()["stale"] is True
+
+    # fields without a balance stay as slim as they were asked for
+    assert ledger.client.get(f"/transactions/{created['id']}", params={"fields": "id"}).json() == {"id": created["id"]}
+
+    balances.settle_dirty_accounts()
+    rows = ledger.client.get(f"/accounts/{account_id}/transactions/", params=params).json()
+    assert [row["stale"] for row in rows] == [False, False, False]
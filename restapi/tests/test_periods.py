@@ -0,0 +1,136 @@
+import uuid
+
+from sqlmodel import Session, select
+
+from restapi.api import events, periods
+from restapi.api.schemas import PeriodClose
+
+
+def archived(ledger, account_id: str) -> list[tuple[str, int, float]]:
+    response = ledger.client.get(f"/accounts/{account_id}/archive")
+    assert response.status_code == 200, response.text
+    rows = [(row["transaction_date"], row["ordinal"], row["running_balance"]) for row in response.json()]
+    return sorted(rows, key=lambda row: row[1])
+
+
+def test_closing_a_year_archives_it_and_the_ledger_continues(ledger):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2024-03-01", 10), ("2024-11-30", 20), ("2025-02-01", 30)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+
+    response = ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024})
+    assert response.status_code == 200, response.text
+    assert response.json()["ordinal"] == 2
+    assert response.json()["running_balance"] == 30
+    assert archived(ledger, account_id) == [("2024-03-01", 1, 10), ("2024-11-30", 2, 30)]
+    assert ledger.ledger(account_id) == [("2025-02-01", 3, 60)]
+
+    ledger.create_transaction(account_id, "2025-03-15", 5)
+    assert ledger.ledger(account_id) == [("2025-02-01", 3, 60), ("2025-03-15", 4, 65)]
+
+
+def test_a_closed_year_rejects_writes_and_a_second_close(ledger):
+    account_id = ledger.create_account()
+    ledger.create_transaction(account_id, "2024-06-01", 10)
+    created = ledger.create_transaction(account_id, "2025-02-01", 30)
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024}).status_code == 200
+
+    body = {"memo": "late", "amount": 1, "transaction_date": "2024-12-31", "transaction_type": "debit",
+            "category_id": ledger.category_id}
+    assert ledger.client.post(f"/accounts/{account_id}/transactions/", json=body).status_code == 409
+    moved = ledger.client.patch(f"/transactions/{created['id']}", json={"transaction_date": "2024-12-01T00:00:00"})
+    assert moved.status_code == 409
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024}).status_code == 409
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2023}).status_code == 409
+
+
+def test_only_past_years_can_be_closed(ledger):
+    account_id = ledger.create_account()
+    response = ledger.client.post(f"/accounts/{account_id}/close", json={"year": 9999})
+    assert response.status_code == 400
+
+
+def test_reopening_restores_the_archived_rows(ledger, engine):
+    account_id = ledger.create_account()
+    for transaction_date, amount in [("2023-05-01", 5), ("2024-03-01", 10), ("2025-02-01", 30)]:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2023}).status_code == 200
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024}).status_code == 200
+
+    # only the latest close can be undone
+    assert ledger.client.post(f"/accounts/{account_id}/reopen", json={"year": 2023}).status_code == 409
+    response = ledger.client.post(f"/accounts/{account_id}/reopen", json={"year": 2024})
+    assert response.status_code == 200, response.text
+    assert archived(ledger, account_id) == [("2023-05-01", 1, 5)]
+    assert ledger.ledger(account_id) == [("2024-03-01", 2, 15), ("2025-02-01", 3, 45)]
+
+    closings = ledger.client.get(f"/accounts/{account_id}/closings").json()
+    assert [closing["year"] for closing in closings] == [2023]
+    with Session(engine) as session:
+        assert periods.latest_close(session, uuid.UUID(account_id)).year == 2023
+
+    # the reopened year takes writes again
+    body = {"memo": "late", "amount": 1, "transaction_date": "2024-01-01", "transaction_type": "debit",
+            "category_id": ledger.category_id}
+    assert ledger.client.post(f"/accounts/{account_id}/transactions/", json=body).status_code == 200
+
+
+def test_a_close_takes_the_account_lock_first(ledger, engine, monkeypatch):
+    account_id = ledger.create_account()
+    locked = []
+    monkeypatch.setattr(periods, "lock_account", lambda session, account_id: locked.append(account_id))
+    ledger.create_transaction(account_id, "2024-03-01", 10)
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024}).status_code == 200
+    assert ledger.client.post(f"/accounts/{account_id}/reopen", json={"year": 2024}).status_code == 200
+    # settling before the close, the close itself and the reopen
+    assert len(locked) == 4
+    assert len({str(account_id) for account_id in locked}) == 1
+    with Session(engine) as session:
+        assert session.exec(select(PeriodClose).where(PeriodClose.user_id == ledger.user_id)).all() == []
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published: list[dict] = []
+
+    def publish(self, user_id: uuid.UUID, ledger_events: list[dict]):
+        self.published.extend(ledger_events)
+
+
+def test_sync_clients_see_rows_leave_and_return(ledger, monkeypatch):
+    broker = RecordingBroker()
+    monkeypatch.setattr(events, "broker", broker)
+    account_id = ledger.create_account()
+    archived_row = ledger.create_transaction(account_id, "2024-03-01", 10)
+    ledger.create_transaction(account_id, "2025-02-01", 30)
+    token = ledger.client.get("/sync/").json()["sync_token"]
+
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2024}).status_code == 200
+    changed = ledger.client.get("/sync/", params={"since": token}).json()
+    assert changed["archived_transaction_ids"] == [archived_row["id"]]
+    assert changed["transactions"] == []
+
+    assert ledger.client.post(f"/accounts/{account_id}/reopen", json={"year": 2024}).status_code == 200
+    restored = ledger.client.get("/sync/", params={"since": changed["sync_token"]}).json()
+    assert [row["id"] for row in restored["transactions"]] == [archived_row["id"]]
+    assert restored["archived_transaction_ids"] == []
+    assert restored["sync_token"] > changed["sync_token"]
+
+    period_events = [ledger_event for ledger_event in broker.published if ledger_event["type"].startswith("period.")]
+    assert [(ledger_event["type"], ledger_event["year"]) for ledger_event in period_events] == [
+        ("period.closed", 2024), ("period.reopened", 2024),
+    ]
+    assert [ledger_event["sync_version"] for ledger_event in period_events] == [
+        changed["sync_token"], restored["sync_token"],
+    ]
+
+
+def test_an_amount_change_takes_the_account_lock(ledger, monkeypatch):
+    account_id = ledger.create_account()
+    created = ledger.create_transaction(account_id, "2025-02-01", 30)
+    locked = []
+    monkeypatch.setattr(periods, "lock_account", lambda session, account_id: locked.append(account_id))
+    assert ledger.client.patch(f"/transactions/{created['id']}", json={"memo": "renamed"}).status_code == 200
+    assert locked == []
+    assert ledger.client.patch(f"/transactions/{created['id']}", json={"amount": 25}).status_code == 200
+    assert [str(account_id) for account_id in locked] == [account_id]
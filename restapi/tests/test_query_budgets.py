@@ -0,0 +1,136 @@
+from typing import NamedTuple
+
+import pytest
+
+
+class Budget(NamedTuple):
+    method: str
+    path: str
+    statements: int
+    rows: int
+    seconds: float
+    json: dict | None = None
+    data: dict | None = None
+
+
+# Authenticated calls include the one statement and one row get_current_user costs. Rows count every row the
+# database returns, whether it is loaded as an entity, a projected column or a scalar. Writes come last, so the
+# reads above them see the seeded data.
+BUDGETS = [
+    Budget("GET", "/accounts/", statements=2, rows=4, seconds=0.5),
+    Budget("GET", "/accounts/{account_id}", statements=2, rows=2, seconds=0.5),
+    Budget("PATCH", "/accounts/{account_id}", statements=3, rows=3, seconds=0.5, json={"name": "Account 000"}),
+    Budget("GET", "/categories/", statements=2, rows=101, seconds=0.5),
+    Budget("GET", "/categories/{category_id}", statements=2, rows=2, seconds=0.5),
+    Budget("PATCH", "/categories/{category_id}", statements=3, rows=3, seconds=0.5, json={"name": "Category 000"}),
+    Budget("GET", "/bills/", statements=2, rows=101, seconds=0.5),
+    Budget("GET", "/bills/{bill_id}", statements=2, rows=2, seconds=0.5),
+    Budget("PATCH", "/bills/{bill_id}", statements=3, rows=3, seconds=0.5, json={"amount": 10}),
+    Budget("GET", "/transactions/", statements=5, rows=160, seconds=1.0),
+    Budget("GET", "/transactions/{transaction_id}", statements=5, rows=5, seconds=0.5),
+    Budget("PATCH", "/transactions/{transaction_id}", statements=6, rows=6, seconds=0.5, json={"memo": "Memo 0"}),
+    Budget("GET", "/accounts/{account_id}/transactions/", statements=5, rows=240, seconds=1.0),
+    Budget(
+        "GET", "/accounts/{account_id}/transactions/?start_date=2023-02-01&end_date=2023-02-28&count=true",
+        statements=6, rows=70, seconds=0.5,
+    ),
+    Budget("GET", "/transactions/?fields=id,amount,transaction_date,running_balance", statements=2, rows=101, seconds=0.5),
+    Budget("GET", "/accounts/{account_id}/transactions/?fields=amount,running_balance", statements=2, rows=101, seconds=0.5),
+    Budget("GET", "/accounts/{account_id}/balance?as_of=2023-03-01", statements=6, rows=4, seconds=0.5),
+    Budget(
+        "POST", "/accounts/{account_id}/reconcile?mark=false", statements=9, rows=40, seconds=0.5,
+        json={
+            "start_date": "2023-02-01",
+            "end_date": "2023-02-28",
+            "closing_balance": 0,
+            "lines": [{"transaction_date": "2023-02-02", "amount": -8, "memo": "Memo 32"}],
+        },
+    ),
+    Budget("POST", "/rules/recategorize?start_date=2023-02-01", statements=4, rows=365, seconds=0.5),
+    Budget("GET", "/dashboard/?recent=5&bill_days=31", statements=5, rows=320, seconds=0.5),
+    Budget("GET", "/sync/?since=0&limit=100", statements=9, rows=410, seconds=1.0),
+    Budget("GET", "/transfers/{transfer_id}", statements=4, rows=6, seconds=0.5),
+    Budget("GET", "/rules/", statements=2, rows=2, seconds=0.5),
+    Budget("PATCH", "/rules/{rule_id}", statements=4, rows=3, seconds=0.5, json={"priority": 1}),
+    Budget("GET", "/accounts/{account_id}/closings", statements=2, rows=1, seconds=0.5),
+    Budget("GET", "/metrics/", statements=0, rows=0, seconds=0.5),
+    Budget("POST", "/token", statements=3, rows=2, seconds=1.0, data={"username": "budgetuser", "password": "Passw0rd"}),
+    Budget("POST", "/refresh", statements=2, rows=2, seconds=0.5, json={"refresh_token": "{refresh_token}"}),
+    Budget(
+        "POST", "/register", statements=4, rows=0, seconds=1.0,
+        json={"username": "budgetnewuser", "email": "new@duckledger.test", "password": "Passw0rdNew"},
+    ),
+    Budget("POST", "/accounts/", statements=5, rows=3, seconds=0.5, json={"name": "Account new"}),
+    Budget("POST", "/categories/", statements=5, rows=3, seconds=0.5, json={"name": "Category new"}),
+    Budget(
+        "POST", "/bills/", statements=5, rows=3, seconds=0.5,
+        json={"name": "Bill new", "amount": 10, "due_date": 1},
+    ),
+    Budget(
+        "POST", "/rules/", statements=4, rows=3, seconds=0.5,
+        json={"category_id": "{category_id}", "memo_contains": "tea"},
+    ),
+    # back-dated writes rewrite the running balances of every later row, the hotspot these budgets guard
+    Budget(
+        "POST", "/transactions/", statements=20, rows=146, seconds=1.0,
+        json={
+            "account_id": "{account_id}",
+            "category_id": "{category_id}",
+            "memo": "Back-dated",
+            "amount": 5,
+            "transaction_date": "2023-01-15",
+            "transaction_type": "debit",
+            "transaction_token": "budget-back-dated",
+        },
+    ),
+    Budget(
+        "POST", "/accounts/{account_id}/transactions/", statements=20, rows=116, seconds=1.0,
+        json={
+            "category_id": "{category_id}",
+            "memo": "Back-dated",
+            "amount": 5,
+            "transaction_date": "2023-02-15",
+            "transaction_type": "debit",
+        },
+    ),
+    Budget(
+        "POST", "/transfers/", statements=36, rows=175, seconds=1.0,
+        json={
+            "from_account_id": "{account_id}",
+            "to_account_id": "{other_account_id}",
+            "category_id": "{category_id}",
+            "memo": "Back-dated transfer",
+            "amount": 5,
+            "transaction_date": "2023-03-15",
+        },
+    ),
+    Budget("POST", "/accounts/{closing_account_id}/close", statements=13, rows=7, seconds=0.5, json={"year": 2023}),
+    Budget("GET", "/accounts/{closing_account_id}/archive", statements=2, rows=101, seconds=0.5),
+    Budget("POST", "/accounts/{closing_account_id}/reopen", statements=9, rows=5, seconds=0.5, json={"year": 2023}),
+]
+
+
+def format_body(body: dict | None, seed: dict) -> dict | None:
+    if body is None:
+        return None
+    return {key: value.format(**seed) if isinstance(value, str) else value for key, value in body.items()}
+
+
+@pytest.mark.parametrize("budget", BUDGETS, ids=lambda budget: f"{budget.method} {budget.path}")
+def test_query_budget(client, recorder, seed, budget):
+    path = budget.path.format(**seed)
+    json, data = format_body(budget.json, seed), format_body(budget.data, seed)
+    response, stats = recorder.measure(lambda: client.request(budget.method, path, json=json, data=data))
+    assert response.status_code == 200, response.text
+    assert len(stats.statements) <= budget.statements, "\n".join(stats.statements)
+    assert stats.rows <= budget.rows
+    assert stats.seconds <= budget.seconds
+
+
+@pytest.mark.parametrize("path", ["/accounts/", "/categories/", "/bills/", "/transactions/"])
+def test_list_endpoints_page(client, path):
+    first = client.get(path, params={"offset": 0, "limit": 2}).json()
+    second = client.get(path, params={"offset": 2, "limit": 2}).json()
+    assert len(first) <= 2
+    assert len(second) <= 2
+    assert not [row for row in first if row in second]
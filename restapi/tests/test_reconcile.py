@@ -0,0 +1,151 @@
+import datetime
+import uuid
+
+from restapi.api import events
+from restapi.api.reconcile import match_statement
+from restapi.api.schemas import StatementLine, Transaction, TransactionType
+
+WINDOW = 3
+
+
+def entry(day: int, amount: float, memo: str = "", token: str | None = None) -> Transaction:
+    return Transaction(
+        id=uuid.uuid4(),
+        memo=memo,
+        amount=amount,
+        transaction_date=datetime.date(2023, 3, day),
+        transaction_type=TransactionType.Debit,
+        transaction_token=token,
+    )
+
+
+def line(day: int, amount: float, memo: str = "", token: str | None = None) -> StatementLine:
+    return StatementLine(transaction_date=datetime.date(2023, 3, day), amount=amount, memo=memo, transaction_token=token)
+
+
+def matches(transactions: list[Transaction], lines: list[StatementLine]) -> dict[int, tuple[int, str]]:
+    # statement line -> (ledger position, how it matched)
+    matched, missing, taken = match_statement(transactions, lines, WINDOW)
+    positions = {transaction.id: position for position, transaction in enumerate(transactions)}
+    return {match.line: (positions[match.transaction_id], match.matched_on) for match in matched}
+
+
+def test_a_token_matches_whatever_the_amount_and_date():
+    transactions = [entry(1, -20, token="bank-1"), entry(28, -5)]
+    assert matches(transactions, [line(20, -21.5, token="bank-1")]) == {0: (0, "token")}
+
+
+def test_a_token_named_entry_is_not_taken_by_an_earlier_amount_match():
+    # the second line names the nearer entry, so the first line falls back to the other one
+    transactions = [entry(10, -12, token="bank-2"), entry(12, -12)]
+    lines = [line(10, -12), line(12, -12, token="bank-2")]
+    assert matches(transactions, lines) == {0: (1, "amount"), 1: (0, "token")}
+
+
+def test_an_unknown_token_falls_back_to_the_amount():
+    transactions = [entry(5, -8)]
+    assert matches(transactions, [line(5, -8, token="never-imported")]) == {0: (0, "amount")}
+
+
+def test_amounts_match_to_the_cent_within_the_window():
+    transactions = [entry(10, -9.999), entry(20, -9.99), entry(1, -40)]
+    lines = [line(12, -10), line(13, -9.99), line(5, -40)]
+    matched, missing, taken = match_statement(transactions, lines, WINDOW)
+    assert [(match.line, match.days_apart) for match in matched] == [(0, 2)]
+    # -9.99 is seven days from its entry and -40 four, both past the window
+    assert missing == [1, 2]
+    assert taken == {transactions[0].id}
+
+
+def test_the_nearest_date_wins_before_the_memo():
+    transactions = [entry(7, -15, memo="Corner Grocer"), entry(9, -15, memo="Fuel")]
+    assert matches(transactions, [line(9, -15, memo="Corner Grocer")]) == {0: (1, "amount")}
+
+
+def test_an_equally_near_pair_is_split_by_memo_then_ledger_order():
+    transactions = [entry(8, -15, memo="Fuel"), entry(12, -15, memo="Corner Grocer")]
+    assert matches(transactions, [line(10, -15, memo="CORNER GROCER #12")]) == {0: (1, "amount")}
+
+    transactions = [entry(8, -15, memo="Fuel"), entry(12, -15, memo="Fuel")]
+    assert matches(transactions, [line(10, -15, memo="Fuel")]) == {0: (0, "amount")}
+
+
+def test_each_entry_matches_one_line_in_date_order():
+    transactions = [entry(10, -3), entry(11, -3)]
+    lines = [line(12, -3), line(9, -3), line(14, -3)]
+    matched, missing, taken = match_statement(transactions, lines, WINDOW)
+    # the earliest line claims the first entry, the next one the second, and the last finds nothing left
+    assert {match.line: match.days_apart for match in matched} == {1: 1, 0: 1}
+    assert missing == [2]
+
+
+def test_an_entry_reconciled_by_an_earlier_statement_is_not_matched_again(ledger):
+    account_id = ledger.create_account()
+    january = ledger.create_transaction(account_id, "2023-01-30", -12)
+    february = ledger.create_transaction(account_id, "2023-02-01", -12)
+
+    statement = {"start_date": "2023-01-01", "end_date": "2023-01-31", "lines": [
+        {"transaction_date": "2023-01-30", "amount": -12},
+    ]}
+    response = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement)
+    assert [match["transaction_id"] for match in response.json()["matched"]] == [january["id"]]
+
+    # the January entry sits inside February's window, but it is already reconciled
+    statement = {"start_date": "2023-02-01", "end_date": "2023-02-28", "lines": [
+        {"transaction_date": "2023-02-02", "amount": -12},
+        {"transaction_date": "2023-02-02", "amount": -12},
+    ]}
+    response = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement)
+    assert [match["transaction_id"] for match in response.json()["matched"]] == [february["id"]]
+    assert len(response.json()["missing"]) == 1
+
+    # running the same statement again still finds its own reconciled entries
+    response = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement)
+    assert [match["transaction_id"] for match in response.json()["matched"]] == [february["id"]]
+
+
+def test_the_statement_balance_is_checked_and_unmatched_entries_reported(ledger, monkeypatch):
+    published = []
+    monkeypatch.setattr(events.broker, "publish", lambda user_id, ledger_events: published.extend(ledger_events))
+    account_id = ledger.create_account()
+    ledger.create_transaction(account_id, "2023-03-02", 100)
+    ledger.create_transaction(account_id, "2023-03-10", -30)
+    extra = ledger.create_transaction(account_id, "2023-03-20", -5)
+    published.clear()
+
+    statement = {"start_date": "2023-03-01", "end_date": "2023-03-31", "closing_balance": 70, "lines": [
+        {"transaction_date": "2023-03-02", "amount": 100},
+        {"transaction_date": "2023-03-11", "amount": -30},
+    ]}
+    response = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement, params={"mark": False})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["closing_balance"], result["ledger_balance"]) == (70, 65)
+    assert (result["difference"], result["balanced"]) == (5, False)
+    assert [transaction["id"] for transaction in result["extra"]] == [extra["id"]]
+    assert published == []
+
+    statement["lines"].append({"transaction_date": "2023-03-20", "amount": -5})
+    statement["closing_balance"] = 65
+    result = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement).json()
+    assert (result["difference"], result["balanced"], result["extra"]) == (0, True, [])
+    assert [(ledger_event["type"], ledger_event["count"]) for ledger_event in published] == [
+        ("transactions.reconciled", 3),
+    ]
+
+
+def test_only_marking_needs_the_period_open(ledger):
+    account_id = ledger.create_account()
+    ledger.create_transaction(account_id, "2023-03-02", 100)
+    ledger.create_transaction(account_id, "2024-01-05", 10)
+    assert ledger.client.post(f"/accounts/{account_id}/close", json={"year": 2023}).status_code == 200
+
+    statement = {"start_date": "2023-03-01", "end_date": "2023-03-31", "closing_balance": 100, "lines": []}
+    response = ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement, params={"mark": False})
+    assert response.status_code == 200, response.text
+    assert response.json()["balanced"] is True
+    assert ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement).status_code == 409
+
+    # a statement that runs into the closed year cannot mark either
+    statement = {"start_date": "2023-12-15", "end_date": "2024-01-14", "lines": []}
+    assert ledger.client.post(f"/accounts/{account_id}/reconcile", json=statement).status_code == 409
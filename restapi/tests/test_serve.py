@@ -0,0 +1,72 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from restapi.api import serve
+
+
+def test_a_crash_looping_worker_backs_off_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(serve, "min_worker_uptime", 5.0)
+    monkeypatch.setattr(serve, "max_respawn_delay", 4.0)
+    delays, delay = [], 0.0
+    for _ in range(5):
+        delay = serve.respawn_delay(delay, uptime=0.2)
+        delays.append(delay)
+    assert delays == [0.5, 1.0, 2.0, 4.0, 4.0]
+
+
+def test_a_worker_that_ran_for_a_while_is_replaced_at_once(monkeypatch):
+    monkeypatch.setattr(serve, "min_worker_uptime", 5.0)
+    assert serve.respawn_delay(8.0, uptime=60.0) == 0.0
+    assert serve.respawn_delay(0.0, uptime=60.0) == 0.0
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_a_killed_worker_is_replaced_and_a_stop_drains_them_all(monkeypatch):
+    monkeypatch.setattr(serve, "min_worker_uptime", 0.0)
+    monkeypatch.setattr(serve, "graceful_timeout", 5.0)
+    spawned = []
+
+    def spawn(app, sock):
+        pid = os.fork()
+        if pid == 0:
+            # a stand-in worker that idles until the supervisor signals it
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            time.sleep(30)
+            os._exit(0)
+        spawned.append(pid)
+        return pid
+
+    def drive():
+        try:
+            wait_for(lambda: len(spawned) == 2)
+            os.kill(spawned[0], signal.SIGKILL)
+            wait_for(lambda: len(spawned) == 3)
+        finally:
+            # stopped either way, so a failure here cannot leave the supervisor running
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    monkeypatch.setattr(serve, "spawn", spawn)
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    driver = threading.Thread(target=drive)
+    driver.start()
+    try:
+        serve.supervise(None, None, workers=2)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        driver.join()
+    assert len(set(spawned)) == 3
+    # every worker, the replacement included, has exited and been reaped
+    for pid in spawned:
+        with pytest.raises(ChildProcessError):
+            os.waitpid(pid, os.WNOHANG)
@@ -0,0 +1,185 @@
+import datetime
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, inspect
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from restapi.api import backfill, database, emailduck, rebalance
+from restapi.api.main import app
+from restapi.api.routers import auth
+from restapi.api.schemas import User, UserDirectory, Account, Category, Transaction, TransactionType
+
+REGISTRATION = {"username": "shardeduser", "email": "sharded@duckledger.test", "password": "Passw0rdX"}
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch, password_hash):
+    engines = {}
+    for name in ("shard0", "shard1", "directory"):
+        engines[name] = create_engine(f"sqlite:///{tmp_path / name}.sqlite", connect_args={"check_same_thread": False})
+        SQLModel.metadata.create_all(engines[name])
+    directory_engine = engines.pop("directory")
+    for module in (database, rebalance, backfill):
+        monkeypatch.setattr(module, "engines", engines)
+    for module in (database, backfill):
+        monkeypatch.setattr(module, "directory_engine", directory_engine)
+    monkeypatch.setattr(database, "ring", database.HashRing(list(engines)))
+    monkeypatch.setattr(database, "default_shard", "shard0")
+    # the real ShardSession rather than the single test database
+    monkeypatch.setattr(app, "dependency_overrides", {})
+    yield engines, directory_engine
+    for shard_engine in [*engines.values(), directory_engine]:
+        shard_engine.dispose()
+
+
+def users_on(shard_engine) -> list[str]:
+    with Session(shard_engine) as session:
+        return session.exec(select(User.username)).all()
+
+
+def seed_user(shard_engine, password_hash: str, name: str, user_id: uuid.UUID | None = None) -> uuid.UUID:
+    # a user with an account and a transaction, written straight to one shard
+    now = datetime.datetime.utcnow()
+    with Session(shard_engine) as session:
+        user = User(id=user_id or uuid.uuid4(), username=name, email=f"{name}@duckledger.test", hashed_password=password_hash)
+        account = Account(name="Checking", user_id=user.id)
+        category = Category(name="General", user_id=user.id)
+        session.add_all([user, account, category])
+        session.flush()
+        session.add(Transaction(
+            memo="Opening", amount=10, transaction_date=now.date(), transaction_type=TransactionType.Debit,
+            created_date=now, updated_date=now, running_balance=10, ordinal=1,
+            account_id=account.id, category_id=category.id, user_id=user.id,
+        ))
+        session.commit()
+        return user.id
+
+
+def test_get_bind_sends_the_directory_and_the_user_tables_apart(shards):
+    engines, directory_engine = shards
+    with database.ShardSession() as session:
+        assert session.get_bind(inspect(User)) is engines["shard0"]
+        database.use_shard(session, "shard1")
+        assert session.get_bind(inspect(User)) is engines["shard1"]
+        assert session.get_bind(inspect(UserDirectory)) is directory_engine
+
+
+def test_registration_places_the_user_on_its_shard_and_logs_in(shards):
+    engines, directory_engine = shards
+    client = TestClient(app)
+    response = client.post("/register", json=REGISTRATION)
+    assert response.status_code == 200, response.text
+
+    with Session(directory_engine) as session:
+        entry = session.exec(select(UserDirectory)).one()
+    shard = database.shard_for_user(entry.user_id)
+    assert users_on(engines[shard]) == ["shardeduser"]
+    assert users_on(engines[next(name for name in engines if name != shard)]) == []
+
+    response = client.post("/token", data={"username": "shardeduser", "password": "Passw0rdX"})
+    assert response.status_code == 200, response.text
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    assert client.post("/accounts/", json={"name": "Checking"}).status_code == 200
+    assert [account["name"] for account in client.get("/accounts/").json()] == ["Checking"]
+    assert client.post("/register", json=REGISTRATION).status_code == 400
+
+
+def test_an_unknown_username_touches_no_shard(shards):
+    engines, directory_engine = shards
+    statements = []
+    for shard_engine in engines.values():
+        event.listen(shard_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    response = TestClient(app).post("/token", data={"username": "nobodyhere", "password": "Passw0rdX"})
+    assert response.status_code == 401
+    assert statements == []
+
+
+def test_a_lost_directory_race_removes_the_shard_user(shards, monkeypatch, password_hash):
+    engines, directory_engine = shards
+    with Session(directory_engine) as session:
+        session.add(UserDirectory(user_id=uuid.uuid4(), username="shardeduser", email="first@duckledger.test"))
+        session.commit()
+    # both registrations passed the availability check before either wrote its entry
+    monkeypatch.setattr(auth, "locate_user", lambda session, username=None, email=None: None)
+
+    response = TestClient(app).post("/register", json=REGISTRATION)
+    assert response.status_code == 400
+    for shard_engine in engines.values():
+        assert users_on(shard_engine) == []
+
+
+def test_rebalance_moves_a_misplaced_user_with_its_rows(shards, password_hash):
+    engines, directory_engine = shards
+    user_id = uuid.uuid4()
+    home = database.shard_for_user(user_id)
+    away = next(name for name in engines if name != home)
+    seed_user(engines[away], password_hash, "movinguser", user_id)
+
+    rebalance.rebalance()
+    assert users_on(engines[home]) == ["movinguser"]
+    assert users_on(engines[away]) == []
+    with Session(engines[home]) as session:
+        assert session.exec(select(Transaction).where(Transaction.user_id == user_id)).one().amount == 10
+
+    # the user, its sync cursor, account, category and transaction
+    assert rebalance.move_user(user_id, home, away) == 5
+    assert users_on(engines[home]) == []
+    assert users_on(engines[away]) == ["movinguser"]
+
+
+def test_the_directory_backfill_lists_users_once(shards, password_hash):
+    engines, directory_engine = shards
+    user_id = seed_user(engines["shard1"], password_hash, "legacyuser")
+    assert TestClient(app).post("/token", data={"username": "legacyuser", "password": "Passw0rd"}).status_code == 401
+
+    assert backfill.backfill_directory() == 1
+    assert backfill.backfill_directory() == 0
+    with Session(directory_engine) as session:
+        assert session.exec(select(UserDirectory.user_id)).all() == [user_id]
+
+
+def test_a_password_reset_goes_straight_to_the_users_shard(shards, monkeypatch):
+    engines, directory_engine = shards
+    client = TestClient(app)
+    assert client.post("/register", json=REGISTRATION).status_code == 200
+    sent = []
+    monkeypatch.setattr(emailduck, "send_password_reset_email", lambda token, email: sent.append(token))
+    assert client.post("/send_reset_email", json={"email": REGISTRATION["email"]}).status_code == 200
+
+    with Session(directory_engine) as session:
+        shard = database.shard_for_user(session.exec(select(UserDirectory.user_id)).one())
+    statements = []
+    away = engines[next(name for name in engines if name != shard)]
+    event.listen(away, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    for token in (f"{uuid.uuid4()}.{sent[0].partition('.')[2]}", "not-a-token", sent[0].partition(".")[2]):
+        assert client.post("/reset_password", json={"token": token, "password": "N3wPassw0rd"}).status_code == 400
+    assert client.post("/reset_password", json={"token": sent[0], "password": "N3wPassw0rd"}).status_code == 200
+    assert statements == []
+
+    login = {"username": REGISTRATION["username"], "password": "N3wPassw0rd"}
+    assert client.post("/token", data=login).status_code == 200
+    # a token works once
+    assert client.post("/reset_password", json={"token": sent[0], "password": "Passw0rdX"}).status_code == 400
+
+
+def test_an_interrupted_registration_is_listed_or_swept(shards, password_hash):
+    engines, directory_engine = shards
+    # both stopped after the shard commit; someone else has since registered the first one's name
+    lost_id = seed_user(engines["shard0"], password_hash, "takenname")
+    seed_user(engines["shard1"], password_hash, "freename")
+    with Session(directory_engine) as session:
+        session.add(UserDirectory(user_id=uuid.uuid4(), username="takenname", email="other@duckledger.test"))
+        session.commit()
+
+    assert backfill.sweep_orphans() == 1
+    assert backfill.sweep_orphans() == 0
+    assert users_on(engines["shard0"]) == []
+    with Session(engines["shard0"]) as session:
+        assert session.exec(select(Transaction).where(Transaction.user_id == lost_id)).all() == []
+    assert users_on(engines["shard1"]) == ["freename"]
+
+    assert backfill.backfill_directory() == 1
+    with Session(directory_engine) as session:
+        assert sorted(session.exec(select(UserDirectory.username)).all()) == ["freename", "takenname"]
@@ -0,0 +1,36 @@
+from sqlmodel import Session, select
+
+from restapi.api import changes
+from restapi.api.schemas import SyncCursor, User
+
+
+def test_a_cursor_created_by_a_concurrent_first_write_is_reused(engine, password_hash):
+    with Session(engine) as session:
+        user = User(username="cursorless", email="cursorless@duckledger.test", hashed_password=password_hash)
+        session.add(user)
+        session.commit()
+        user_id = user.id
+    with Session(engine) as first, Session(engine) as second:
+        changes.create_cursor(first, user_id)
+        first.commit()
+        # the second writer also missed the cursor and inserts it after the first committed
+        changes.create_cursor(second, user_id)
+        assert changes.next_sync_version(second, user_id) == 1
+        second.commit()
+    with Session(engine) as session:
+        assert changes.next_sync_version(session, user_id) == 2
+        session.commit()
+        cursors = session.exec(select(SyncCursor).where(SyncCursor.user_id == user_id)).all()
+        assert [cursor.version for cursor in cursors] == [2]
+
+
+def test_changes_are_paged_by_version(ledger):
+    account_id = ledger.create_account()
+    for day in range(1, 6):
+        ledger.create_transaction(account_id, f"2023-01-0{day}", day)
+    first = ledger.client.get("/sync/", params={"since": 0, "limit": 2}).json()
+    assert first["has_more"]
+    second = ledger.client.get("/sync/", params={"since": first["sync_token"], "limit": 100}).json()
+    assert not second["has_more"]
+    seen = [row["id"] for row in first["transactions"] + second["transactions"]]
+    assert len(seen) == len(set(seen)) == 5
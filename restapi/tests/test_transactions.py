@@ -0,0 +1,185 @@
+import uuid
+
+import pytest
+from sqlmodel import Session, select, col
+
+from restapi.api import balances
+from restapi.api.routers import transactions
+from restapi.api.schemas import BalanceCheckpoint, Bill, Category
+
+ROWS = [("2023-01-01", 10), ("2023-01-05", 20), ("2023-01-09", 30), ("2023-01-13", 40)]
+
+
+def checkpoints(engine, account_id: str) -> list[tuple[int, float]]:
+    with Session(engine) as session:
+        statement = select(BalanceCheckpoint).where(BalanceCheckpoint.account_id == uuid.UUID(account_id))
+        statement = statement.order_by(col(BalanceCheckpoint.ordinal).asc())
+        return [(checkpoint.ordinal, checkpoint.running_balance) for checkpoint in session.exec(statement).all()]
+
+
+def test_a_back_dated_create_renumbers_every_later_row(ledger):
+    account_id = ledger.create_account()
+    for transaction_date, amount in ROWS:
+        ledger.create_transaction(account_id, transaction_date, amount)
+
+    created = ledger.create_transaction(account_id, "2023-01-03", 5)
+    assert created["running_balance"] == 15
+    assert ledger.ledger(account_id) == ledger.expected_ledger(ROWS + [("2023-01-03", 5)])
+
+    created = ledger.create_transaction(account_id, "2022-12-31", 1)
+    assert created["running_balance"] == 1
+    assert ledger.ledger(account_id) == ledger.expected_ledger(ROWS + [("2023-01-03", 5), ("2022-12-31", 1)])
+
+
+def test_a_back_dated_create_rewrites_the_checkpoints_it_passes(ledger, engine, monkeypatch):
+    monkeypatch.setattr(balances, "checkpoint_interval", 2)
+    account_id = ledger.create_account()
+    for transaction_date, amount in ROWS:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    assert checkpoints(engine, account_id) == [(2, 30), (4, 100)]
+
+    ledger.create_transaction(account_id, "2023-01-03", 5)
+    assert checkpoints(engine, account_id) == [(2, 15), (4, 65)]
+
+
+def test_moving_a_transaction_later_renumbers_the_rows_it_passes(ledger):
+    account_id = ledger.create_account()
+    created = [ledger.create_transaction(account_id, transaction_date, amount) for transaction_date, amount in ROWS]
+
+    response = ledger.client.patch(f"/transactions/{created[0]['id']}", json={"transaction_date": "2023-01-10T00:00:00"})
+    assert response.status_code == 200, response.text
+    assert response.json()["running_balance"] == 60
+    assert ledger.ledger(account_id) == ledger.expected_ledger([("2023-01-10", 10), *ROWS[1:]])
+
+
+def test_moving_a_transaction_earlier_renumbers_the_rows_it_passes(ledger):
+    account_id = ledger.create_account()
+    created = [ledger.create_transaction(account_id, transaction_date, amount) for transaction_date, amount in ROWS]
+
+    response = ledger.client.patch(f"/transactions/{created[3]['id']}", json={"transaction_date": "2023-01-02T00:00:00"})
+    assert response.status_code == 200, response.text
+    assert response.json()["running_balance"] == 50
+    assert ledger.ledger(account_id) == ledger.expected_ledger([*ROWS[:3], ("2023-01-02", 40)])
+
+
+def test_changing_an_amount_rewrites_the_later_balances(ledger):
+    account_id = ledger.create_account()
+    created = [ledger.create_transaction(account_id, transaction_date, amount) for transaction_date, amount in ROWS]
+
+    response = ledger.client.patch(f"/transactions/{created[1]['id']}", json={"amount": 25})
+    assert response.status_code == 200, response.text
+    assert ledger.ledger(account_id) == ledger.expected_ledger([ROWS[0], ("2023-01-05", 25), *ROWS[2:]])
+
+
+def test_a_back_dated_transfer_renumbers_both_accounts(ledger):
+    from_id, to_id = ledger.create_account("Checking"), ledger.create_account("Savings")
+    for account_id in (from_id, to_id):
+        for transaction_date, amount in ROWS:
+            ledger.create_transaction(account_id, transaction_date, amount)
+
+    body = {
+        "from_account_id": from_id,
+        "to_account_id": to_id,
+        "amount": 7,
+        "transaction_date": "2023-01-07",
+        "memo": "Transfer",
+        "category_id": ledger.category_id,
+    }
+    response = ledger.client.post("/transfers/", json=body)
+    assert response.status_code == 200, response.text
+    assert ledger.ledger(from_id) == ledger.expected_ledger(ROWS + [("2023-01-07", -7)])
+    assert ledger.ledger(to_id) == ledger.expected_ledger(ROWS + [("2023-01-07", 7)])
+
+
+def test_a_replayed_token_returns_the_first_transaction(ledger):
+    account_id = ledger.create_account()
+    for transaction_date, amount in ROWS:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    first = ledger.create_transaction(account_id, "2023-01-03", 5, transaction_token="import-1")
+
+    replayed = ledger.create_transaction(account_id, "2023-01-03", 5, transaction_token="import-1")
+    assert replayed["id"] == first["id"]
+    body = {"account_id": account_id, "memo": "retry", "amount": 5, "transaction_date": "2023-01-03",
+            "transaction_type": "debit", "category_id": ledger.category_id, "transaction_token": "import-1"}
+    response = ledger.client.post("/transactions/", json=body)
+    assert response.status_code == 200, response.text
+    assert response.json()["id"] == first["id"]
+    assert ledger.ledger(account_id) == ledger.expected_ledger(ROWS + [("2023-01-03", 5)])
+
+
+def test_a_token_that_loses_the_insert_race_returns_the_winner(ledger, monkeypatch):
+    account_id = ledger.create_account()
+    for transaction_date, amount in ROWS:
+        ledger.create_transaction(account_id, transaction_date, amount)
+    first = ledger.create_transaction(account_id, "2023-01-03", 5, transaction_token="import-2")
+
+    # the retry passes the token check before the first request commits, so only the unique index stops it
+    lookups = []
+    get_transaction_by_token = transactions.get_transaction_by_token
+
+    def racing_lookup(session, user, transaction):
+        lookups.append(transaction.transaction_token)
+        return None if len(lookups) == 1 else get_transaction_by_token(session, user, transaction)
+
+    monkeypatch.setattr(transactions, "get_transaction_by_token", racing_lookup)
+    replayed = ledger.create_transaction(account_id, "2023-01-03", 5, transaction_token="import-2")
+    assert lookups == ["import-2", "import-2"]
+    assert replayed["id"] == first["id"]
+    assert ledger.ledger(account_id) == ledger.expected_ledger(ROWS + [("2023-01-03", 5)])
+
+
+@pytest.fixture
+def filtered(ledger, engine):
+    # five rows across two accounts, two categories, a bill and three types; the last one deactivated
+    with Session(engine) as session:
+        category = Category(name="Fuel", user_id=ledger.user_id)
+        bill = Bill(name="Rent", amount=500, due_date=1, user_id=ledger.user_id)
+        session.add_all([category, bill])
+        session.commit()
+        category_id, bill_id = str(category.id), str(bill.id)
+    account_id, other_id = ledger.create_account("Checking"), ledger.create_account("Savings")
+    rows = {
+        "coffee": ledger.create_transaction(account_id, "2023-01-01", -4),
+        "fuel": ledger.create_transaction(account_id, "2023-01-05", -40, category_id=category_id),
+        "rent": ledger.create_transaction(account_id, "2023-01-09", -500, transaction_type="check"),
+        "salary": ledger.create_transaction(other_id, "2023-01-13", 1500, transaction_type="deposit"),
+        "refund": ledger.create_transaction(other_id, "2023-01-17", 40, transaction_type="deposit"),
+    }
+    response = ledger.client.patch(f"/transactions/{rows['rent']['id']}", json={"bill_id": bill_id})
+    assert response.status_code == 200, response.text
+    response = ledger.client.patch(f"/transactions/{rows['refund']['id']}", json={"active": False})
+    assert response.status_code == 200, response.text
+    names = {row["id"]: name for name, row in rows.items()}
+    return ledger, names, account_id, category_id, bill_id
+
+
+def listed(ledger, names: dict[str, str], path: str = "/transactions/", **params) -> list[str]:
+    response = ledger.client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return sorted(names[row["id"]] for row in response.json())
+
+
+def test_each_filter_narrows_the_list(filtered):
+    ledger, names, account_id, category_id, bill_id = filtered
+    assert listed(ledger, names) == ["coffee", "fuel", "refund", "rent", "salary"]
+    assert listed(ledger, names, start_date="2023-01-05", end_date="2023-01-13") == ["fuel", "rent", "salary"]
+    assert listed(ledger, names, category_id=category_id) == ["fuel"]
+    assert listed(ledger, names, bill_id=bill_id) == ["rent"]
+    assert listed(ledger, names, transaction_type="deposit") == ["refund", "salary"]
+    assert listed(ledger, names, min_amount=-40, max_amount=40) == ["coffee", "fuel", "refund"]
+    assert listed(ledger, names, active=False) == ["refund"]
+    assert listed(ledger, names, active=True, transaction_type="deposit") == ["salary"]
+    assert listed(ledger, names, f"/accounts/{account_id}/transactions/", max_amount=-10) == ["fuel", "rent"]
+
+
+def test_count_reports_every_match_beyond_the_page(filtered):
+    ledger, names, account_id, category_id, bill_id = filtered
+    response = ledger.client.get("/transactions/", params={"count": True, "limit": 2, "active": True})
+    assert response.status_code == 200, response.text
+    assert response.headers["X-Total-Count"] == "4"
+    assert len(response.json()) == 2
+
+    params = {"count": True, "limit": 1, "fields": "id,amount"}
+    response = ledger.client.get(f"/accounts/{account_id}/transactions/", params=params)
+    assert response.headers["X-Total-Count"] == "3"
+    assert "X-Total-Count" not in ledger.client.get("/transactions/").headers